@@ -0,0 +1,369 @@
+import threading
+
+import numpy as np
+
+import database
+
+# Rows fetched from SQLite per fetchmany() call while loading
+CHUNK_SIZE = 50000
+
+# Column arrays kept for every sale, with their types
+SALES_COLUMNS = {
+    "id": np.int64,
+    "key_number": np.int32,
+    "customer_id": np.int32,    # 0 for walk-in customers
+    "quantity": np.int32,
+    "sale_price": np.int64,     # Cents
+    "profit": np.int64,         # Cents
+    "sale_ts": np.int64,        # Epoch seconds
+    "tz_offset": np.int32,      # Seconds east of UTC
+}
+
+_SALES_QUERY = """
+SELECT id, key_number, IFNULL(customer_id, 0), quantity, sale_price, profit, sale_ts, tz_offset
+FROM sales
+WHERE id > ?
+ORDER BY id
+"""
+
+# Dimensions accepted by SalesAnalytics.aggregate(), with the field
+# name of each in the returned rows
+DIMENSIONS = {
+    "category": "category_id",
+    "product": "key_number",
+    "customer": "customer_id",
+    "day": "day",
+    "week": "week",
+    "month": "month",
+}
+
+# 1970-01-01 was a Thursday, shift so weeks start on Monday
+_WEEK_SHIFT = 3
+
+def _factorize(values):
+    """
+    Find the distinct values of an integer array.
+
+    Returns:
+        tuple: The sorted distinct values and, for every element, the index
+        of its value among them
+    """
+    if not len(values):
+        return values[:0], np.zeros(0, dtype=np.int64)
+
+    low = values.min()
+    span = int(values.max()) - int(low) + 1
+    if span > max(len(values), 1 << 16):
+        return np.unique(values, return_inverse=True)
+
+    # Keys, days and weeks span small ranges: counting beats sorting
+    offsets = (values - low).astype(np.int64)
+    present = np.bincount(offsets, minlength=span) > 0
+    index = np.cumsum(present) - 1
+    return (np.flatnonzero(present) + low).astype(values.dtype), index[offsets]
+
+class SalesAnalytics:
+    """
+    Columnar in-memory copy of the sales table for grouped reports.
+
+    Sales are loaded once into numpy arrays, in chunks, and later calls only
+    append the rows added since. Aggregates are computed with vectorized
+    operations, so a report over a million sales takes milliseconds once
+    the arrays are loaded.
+
+    Deleted sales are noticed by comparing row counts and cause a full
+    reload. Sales are never edited in place by this application; call
+    reload() after editing them by other means. Archived sales are not
+    loaded, only those still in the sales table.
+    """
+    def __init__(self, chunk_size=CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        """Drop the arrays, the next report reloads every sale"""
+        with self._lock:
+            self._db_path = database.DB_PATH
+            self._columns = {name: np.empty(0, dtype=dtype) for name, dtype in SALES_COLUMNS.items()}
+            self._columns["day"] = np.empty(0, dtype=np.int32)
+            self._loaded = False
+
+    def reload(self):
+        """Load every sale again"""
+        with self._lock:
+            self.clear()
+            self.refresh()
+
+    def _fetch(self, after_id):
+        """
+        Read the sales with an id above after_id into column arrays.
+
+        Returns:
+            tuple: Column arrays keyed by name and the current sales row count
+        """
+        chunks = []
+        with database.read_connection() as conn:
+            cursor = conn.cursor()
+            # Plain tuples convert to arrays much faster than sqlite3.Row
+            cursor.row_factory = None
+            cursor.execute(_SALES_QUERY, (after_id,))
+            while True:
+                rows = cursor.fetchmany(self.chunk_size)
+                if not rows:
+                    break
+                chunks.append(np.array(rows, dtype=np.int64))
+
+            cursor.execute("SELECT COUNT(*) FROM sales")
+            count = cursor.fetchone()[0]
+
+        table = np.concatenate(chunks) if chunks else np.empty((0, len(SALES_COLUMNS)), dtype=np.int64)
+        columns = {
+            name: table[:, index].astype(dtype)
+            for index, (name, dtype) in enumerate(SALES_COLUMNS.items())
+        }
+        # Local calendar day as days since 1970-01-01, like sales.sale_day
+        columns["day"] = ((columns["sale_ts"] + columns["tz_offset"]) // 86400).astype(np.int32)
+        return columns, count
+
+    def refresh(self):
+        """
+        Bring the arrays up to date with the sales table.
+
+        Returns:
+            int: Number of sales appended, -1 after a full reload
+        """
+        with self._lock:
+            if self._db_path != database.DB_PATH:
+                self.clear()
+            if self._loaded and not database.data_versions.changed(self, ("sales",)):
+                return 0
+
+            # Before querying, so a sale recorded meanwhile is picked up next time
+            database.data_versions.mark_seen(self, ("sales",))
+
+            last_id = int(self._columns["id"][-1]) if len(self._columns["id"]) else 0
+            new_columns, count = self._fetch(last_id)
+            appended = len(new_columns["id"])
+
+            if len(self._columns["id"]) + appended != count:
+                # Sales were deleted, start over
+                self._columns, count = self._fetch(0)
+                self._loaded = True
+                return -1
+
+            if appended:
+                self._columns = {
+                    name: np.concatenate((self._columns[name], new_columns[name]))
+                    for name in self._columns
+                }
+            self._loaded = True
+            return appended
+
+    def columns(self):
+        """
+        Get the current sales columns.
+
+        Returns:
+            dict: Read-only column arrays keyed by SALES_COLUMNS names, plus
+            "day", the local day of each sale as days since 1970-01-01
+        """
+        with self._lock:
+            self.refresh()
+            columns = {}
+            for name, array in self._columns.items():
+                view = array.view()
+                view.flags.writeable = False
+                columns[name] = view
+            return columns
+
+    def aggregate(self, by, start=None, end=None, category_id=None):
+        """
+        Group sales and total them.
+
+        Args:
+            by (tuple): Names from DIMENSIONS, e.g. ("category", "week")
+            start (str, optional): First day to include, "YYYY-MM-DD"
+            end (str, optional): Last day to include, "YYYY-MM-DD"
+            category_id (int, optional): Only sales of products in this category
+
+        Returns:
+            list: One dict per group, sorted by the group values. Each has the
+            dimension values (category_id, key_number, customer_id, or day,
+            week and month as "YYYY-MM-DD"/"YYYY-MM" strings) plus count,
+            quantity, revenue and profit in cents and margin (percent of revenue)
+        """
+        for dimension in by:
+            if dimension not in DIMENSIONS:
+                raise ValueError(f"Unknown dimension: {dimension}")
+
+        columns = self.columns()
+        days = columns["day"]
+        categories = None
+        if category_id is not None or "category" in by:
+            categories = self._categories(columns["key_number"])
+
+        mask = None
+        if start or end or category_id is not None:
+            mask = np.ones(len(days), dtype=bool)
+            if start:
+                mask &= days >= np.datetime64(start, "D").astype(np.int64)
+            if end:
+                mask &= days <= np.datetime64(end, "D").astype(np.int64)
+            if category_id is not None:
+                mask &= categories == category_id
+
+        def select(array):
+            return array if mask is None else array[mask]
+
+        quantity = select(columns["quantity"])
+        revenue = quantity * select(columns["sale_price"])
+        profit = select(columns["profit"])
+        days = select(days)
+
+        keys = []
+        for dimension in by:
+            if dimension == "category":
+                keys.append(select(categories))
+            elif dimension == "product":
+                keys.append(select(columns["key_number"]))
+            elif dimension == "customer":
+                keys.append(select(columns["customer_id"]))
+            elif dimension == "day":
+                keys.append(days)
+            elif dimension == "week":
+                keys.append((days + _WEEK_SHIFT) // 7 * 7 - _WEEK_SHIFT)
+            else:
+                keys.append(days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64))
+
+        # Combine the dimensions into one dense group number per sale
+        group = np.zeros(len(days), dtype=np.int64)
+        uniques = []
+        for key in keys:
+            values, inverse = _factorize(key)
+            group = group * len(values) + inverse
+            uniques.append(values)
+        if len(keys) == 1:
+            # Already dense
+            groups = np.arange(len(uniques[0]))
+        else:
+            groups, group = _factorize(group)
+
+        size = len(groups)
+        counts = np.bincount(group, minlength=size)
+        totals = {
+            "quantity": np.bincount(group, weights=quantity, minlength=size),
+            "revenue": np.bincount(group, weights=revenue, minlength=size),
+            "profit": np.bincount(group, weights=profit, minlength=size),
+        }
+        # Float sums of whole cents are exact below 2**53 cents
+        totals = {name: np.rint(values).astype(np.int64) for name, values in totals.items()}
+
+        # Split the group numbers back into their dimension values
+        labels = []
+        remainder = groups
+        for dimension, values in reversed(list(zip(by, uniques))):
+            remainder, index = np.divmod(remainder, len(values))
+            labels.append((dimension, self._labels(dimension, values[index])))
+        labels.reverse()
+
+        results = []
+        for row in range(size):
+            result = {DIMENSIONS[dimension]: values[row] for dimension, values in labels}
+            result["count"] = int(counts[row])
+            result["quantity"] = int(totals["quantity"][row])
+            result["revenue"] = int(totals["revenue"][row])
+            result["profit"] = int(totals["profit"][row])
+            result["margin"] = (result["profit"] / result["revenue"]) * 100 if result["revenue"] > 0 else 0.0
+            results.append(result)
+        return results
+
+    def _categories(self, key_numbers):
+        """Map product key numbers to their current category, like the rollup"""
+        products = database.get_all_products()
+        keys = np.array(sorted(product["key_number"] for product in products), dtype=np.int64)
+        category_by_key = {product["key_number"]: product["category_id"] for product in products}
+        category_ids = np.array([category_by_key[key] for key in keys.tolist()], dtype=np.int32)
+
+        # Sales of deleted products count towards the default category
+        if not len(keys) or not len(key_numbers):
+            return np.ones(len(key_numbers), dtype=np.int32)
+        if 0 <= keys[0] and keys[-1] <= max(len(key_numbers), 1 << 16):
+            # Small key numbers: index a lookup table directly
+            lookup = np.ones(max(int(keys[-1]), int(key_numbers.max())) + 1, dtype=np.int32)
+            lookup[keys] = category_ids
+            return lookup[key_numbers]
+
+        categories = np.ones(len(key_numbers), dtype=np.int32)
+        index = np.minimum(np.searchsorted(keys, key_numbers), len(keys) - 1)
+        found = keys[index] == key_numbers
+        categories[found] = category_ids[index[found]]
+        return categories
+
+    def _labels(self, dimension, values):
+        """Convert group values to the Python values returned by aggregate()"""
+        if dimension in ("day", "week"):
+            return np.datetime_as_string(values.astype("datetime64[D]")).tolist()
+        if dimension == "month":
+            return np.datetime_as_string(values.astype("datetime64[M]")).tolist()
+        return values.tolist()
+
+    def revenue_by_category_week(self, start=None, end=None):
+        """
+        Revenue of each category per week (weeks start on Monday).
+
+        Returns:
+            list: Rows with category_id, week, count, quantity, revenue, profit and margin
+        """
+        return self.aggregate(("category", "week"), start, end)
+
+    def margin_by_product(self, start=None, end=None, category_id=None):
+        """
+        Profit margin of each product.
+
+        Returns:
+            list: Rows with key_number, count, quantity, revenue, profit and margin
+        """
+        return self.aggregate(("product",), start, end, category_id)
+
+    def quantity_by_customer(self, start=None, end=None, category_id=None):
+        """
+        Units bought by each customer, walk-in sales under customer_id 0.
+
+        Returns:
+            list: Rows with customer_id, count, quantity, revenue, profit and margin
+        """
+        return self.aggregate(("customer",), start, end, category_id)
+
+# Shared engine used by the reports
+sales_analytics = SalesAnalytics()
+
+def get_top_customers(start=None, end=None, limit=10):
+    """
+    Rank the customers by revenue over a date range, walk-in sales left out.
+
+    The rollup has no customers, so this groups the sales with the shared
+    engine. Report periods stay within ARCHIVE_AFTER_DAYS, archived sales
+    are not included. In client mode this runs on the database server.
+
+    Args:
+        start (str, optional): First day to include, "YYYY-MM-DD"
+        end (str, optional): Last day to include, "YYYY-MM-DD"
+        limit (int): Number of customers in the ranking
+
+    Returns:
+        list: Up to limit customers with customer_id, name, rank, count,
+        quantity, revenue and profit (cents), margin and share (percent of
+        the period's revenue)
+    """
+    rows = sales_analytics.quantity_by_customer(start, end)
+    total_revenue = sum(row["revenue"] for row in rows)
+
+    ranked = sorted((row for row in rows if row["customer_id"]),
+                    key=lambda row: (-row["revenue"], row["customer_id"]))[:limit]
+    for rank, row in enumerate(ranked, 1):
+        customer = database.get_customer_by_id(row["customer_id"])
+        row["name"] = customer["name"] if customer else "Deleted customer"
+        row["rank"] = rank
+        row["share"] = (row["revenue"] / total_revenue) * 100 if total_revenue else 0.0
+    return ranked
@@ -0,0 +1,516 @@
+"""
+Online backups of the shop database.
+
+Backups are taken with the SQLite backup API from a separate connection, a
+few hundred pages per step with a short pause in between, so checkout keeps
+writing while a backup runs. The yearly sales archives the database refers
+to are backed up and restored with it. Each backup is checked, compressed
+with gzip and pruned by a retention policy. Run this module to back up, list, prune
+or restore from the command line:
+
+    python backup.py backup
+    python backup.py restore backups/mattress_shop-20250101-120000.db.gz
+"""
+import argparse
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+import database
+
+# Pages copied per backup step, 1 MB with the default 4 KiB pages
+PAGES_PER_STEP = 256
+
+# Pause between steps in seconds, lets the writers in
+STEP_PAUSE = 0.005
+
+# A write from another connection restarts a stepped backup. After this
+# many restarts the rest is copied in a single step, which in WAL mode
+# still only holds a read lock.
+MAX_RESTARTS = 5
+
+# Hours between scheduled backups
+BACKUP_INTERVAL_HOURS = 24
+
+# Backups kept by prune_backups(): the newest "last" ones, plus the newest
+# backup of each of the latest "daily" days, "weekly" weeks and "monthly" months
+RETENTION_POLICY = {
+    "last": 7,
+    "daily": 14,
+    "weekly": 8,
+    "monthly": 12,
+}
+
+_TIMESTAMP_FORMAT = "%Y%m%d-%H%M%S"
+
+class BackupCancelled(Exception):
+    """Raised when a backup is stopped before it finishes"""
+
+class _TooManyRestarts(Exception):
+    """Raised from the progress callback to switch to a single-step copy"""
+
+def default_backup_dir(db_path=None):
+    """
+    Get the backup folder of a database.
+
+    Returns:
+        str: The "backups" folder next to the database file
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(db_path or database.DB_PATH)), "backups")
+
+def _archive_prefix(db_path):
+    """File name prefix of the backups of a database"""
+    return os.path.splitext(os.path.basename(db_path))[0]
+
+def _copy_database(source_path, copy_path, pages_per_step, step_pause, cancel_event):
+    """
+    Copy a database in steps and check the copy.
+
+    Returns:
+        tuple: Pages copied and restarts
+    """
+    progress = {"remaining": None, "restarts": 0}
+
+    def on_progress(status, remaining, total):
+        if cancel_event is not None and cancel_event.is_set():
+            raise BackupCancelled()
+        if progress["remaining"] is not None and remaining > progress["remaining"]:
+            # The source changed and the copy started over
+            progress["restarts"] += 1
+            if progress["restarts"] > MAX_RESTARTS:
+                raise _TooManyRestarts()
+        progress["remaining"] = remaining
+        if remaining and step_pause:
+            time.sleep(step_pause)
+
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(copy_path)
+    try:
+        source.execute(f"PRAGMA busy_timeout = {int(database.get_performance_profile()['busy_timeout'])}")
+        try:
+            source.backup(target, pages=pages_per_step, progress=on_progress)
+        except _TooManyRestarts:
+            source.backup(target)
+
+        # A self-contained file, without the WAL flag of the source
+        target.execute("PRAGMA journal_mode = DELETE")
+        check = target.execute("PRAGMA quick_check").fetchone()[0]
+        if check != "ok":
+            raise sqlite3.DatabaseError(f"Backup copy failed its check: {check}")
+        pages = target.execute("PRAGMA page_count").fetchone()[0]
+    except BaseException:
+        target.close()
+        source.close()
+        if os.path.exists(copy_path):
+            os.remove(copy_path)
+        raise
+    target.close()
+    source.close()
+    return pages, progress["restarts"]
+
+def _compress(copy_path, archive_path, cancel_event):
+    """
+    Gzip a copy into archive_path and delete the copy.
+
+    Returns:
+        int: Size of the uncompressed copy in bytes
+    """
+    try:
+        with open(copy_path, "rb") as copy_file, gzip.open(archive_path + ".tmp", "wb", compresslevel=6) as archive:
+            while True:
+                chunk = copy_file.read(1024 * 1024)
+                if not chunk:
+                    break
+                if cancel_event is not None and cancel_event.is_set():
+                    raise BackupCancelled()
+                archive.write(chunk)
+        os.replace(archive_path + ".tmp", archive_path)
+        return os.path.getsize(copy_path)
+    finally:
+        os.remove(copy_path)
+        if os.path.exists(archive_path + ".tmp"):
+            os.remove(archive_path + ".tmp")
+
+def _registered_archives(db_path):
+    """File names of the sales archives a database refers to"""
+    conn = sqlite3.connect(db_path)
+    try:
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sales_archives'").fetchone():
+            return []
+        return [row[0] for row in conn.execute("SELECT file_name FROM sales_archives ORDER BY year")]
+    finally:
+        conn.close()
+
+def _archive_backup_path(backup_path, file_name):
+    """Path of the copy of a sales archive that belongs to a backup"""
+    return f"{backup_path[:-len('.db.gz')]}.{file_name}.gz"
+
+def backup_database(db_path=None, directory=None, pages_per_step=PAGES_PER_STEP, step_pause=STEP_PAUSE,
+                    cancel_event=None):
+    """
+    Back up a database and its yearly sales archives while they are in use.
+
+    The copy is written next to the archive, checked with PRAGMA quick_check,
+    compressed and only then given its final name, so a backup either
+    completes or leaves nothing behind. The sales archives the copy refers
+    to are backed up the same way into <backup>.<archive file>.gz before
+    the main file gets its name. They are copied after the database, so they
+    hold at least every sale the copy counts as archived.
+
+    Args:
+        db_path (str, optional): Database to back up, DB_PATH by default
+        directory (str, optional): Folder for the archive, default_backup_dir() by default
+        pages_per_step (int): Pages copied per step
+        step_pause (float): Seconds to wait between steps
+        cancel_event (threading.Event, optional): Stops the backup when set
+
+    Returns:
+        dict: path, pages, seconds, pages_per_second, size and
+        compressed_size (bytes), restarts and sales_archives (paths of the
+        archive copies) of the backup
+
+    Raises:
+        BackupCancelled: If cancel_event was set during the backup
+        sqlite3.DatabaseError: If a copy fails its check
+    """
+    db_path = db_path or database.DB_PATH
+    directory = directory or default_backup_dir(db_path)
+    os.makedirs(directory, exist_ok=True)
+
+    name = f"{_archive_prefix(db_path)}-{datetime.now().strftime(_TIMESTAMP_FORMAT)}.db"
+    archive_path = os.path.join(directory, name + ".gz")
+    copy_path = os.path.join(directory, name + ".part")
+
+    start = time.perf_counter()
+    pages, restarts = _copy_database(db_path, copy_path, pages_per_step, step_pause, cancel_event)
+    copied = time.perf_counter() - start
+
+    sales_archives = []
+    try:
+        for file_name in _registered_archives(copy_path):
+            source_path = os.path.join(database.get_archive_dir(db_path), file_name)
+            if not os.path.exists(source_path):
+                print(f"Error backing up sales archive: {source_path} is missing")
+                continue
+            target_path = _archive_backup_path(archive_path, file_name)
+            part_path = target_path[:-len(".gz")] + ".part"
+            _copy_database(source_path, part_path, pages_per_step, step_pause, cancel_event)
+            _compress(part_path, target_path, cancel_event)
+            sales_archives.append(target_path)
+
+        size = _compress(copy_path, archive_path, cancel_event)
+    except BaseException:
+        if os.path.exists(copy_path):
+            os.remove(copy_path)
+        for path in sales_archives:
+            os.remove(path)
+        raise
+
+    seconds = time.perf_counter() - start
+    result = {
+        "path": archive_path,
+        "pages": pages,
+        "seconds": seconds,
+        # Copy speed, without the compression
+        "pages_per_second": pages / copied if copied > 0 else 0.0,
+        "size": size,
+        "compressed_size": os.path.getsize(archive_path),
+        "restarts": restarts,
+        "sales_archives": sales_archives,
+    }
+    print(f"Backup written to {archive_path}: {pages} pages in {seconds:.2f} s "
+          f"({result['pages_per_second']:.0f} pages/s, {result['compressed_size'] / 1024:.0f} KiB compressed, "
+          f"{len(sales_archives)} sales archives)")
+    return result
+
+def list_backups(directory=None, db_path=None):
+    """
+    List the backups of a database, newest first.
+
+    Args:
+        directory (str, optional): Backup folder, default_backup_dir() by default
+        db_path (str, optional): Database the backups were taken of, DB_PATH by default
+
+    Returns:
+        list: Dicts with path, created (datetime) and compressed_size (bytes)
+    """
+    db_path = db_path or database.DB_PATH
+    directory = directory or default_backup_dir(db_path)
+    if not os.path.isdir(directory):
+        return []
+
+    pattern = re.compile(re.escape(_archive_prefix(db_path)) + r"-(\d{8}-\d{6})\.db\.gz$")
+    backups = []
+    for file_name in os.listdir(directory):
+        match = pattern.match(file_name)
+        if match:
+            path = os.path.join(directory, file_name)
+            backups.append({
+                "path": path,
+                "created": datetime.strptime(match.group(1), _TIMESTAMP_FORMAT),
+                "compressed_size": os.path.getsize(path),
+            })
+    backups.sort(key=lambda backup: backup["created"], reverse=True)
+    return backups
+
+def _sales_archive_backups(backup_path):
+    """Paths of the sales archive copies belonging to a backup"""
+    directory, file_name = os.path.split(backup_path)
+    stem = file_name[:-len("db.gz")]
+    return [os.path.join(directory, name) for name in os.listdir(directory or ".")
+            if name.startswith(stem) and name.endswith(".gz") and name != file_name]
+
+def prune_backups(directory=None, db_path=None, policy=None):
+    """
+    Delete the backups the retention policy does not keep.
+
+    Args:
+        directory (str, optional): Backup folder, default_backup_dir() by default
+        db_path (str, optional): Database the backups were taken of, DB_PATH by default
+        policy (dict, optional): Counts like RETENTION_POLICY
+
+    Returns:
+        list: Paths of the deleted backups
+    """
+    policy = policy or RETENTION_POLICY
+    backups = list_backups(directory, db_path)
+
+    keep = {backup["path"] for backup in backups[:policy.get("last", 0)]}
+    periods = {
+        "daily": lambda created: created.date(),
+        "weekly": lambda created: created.isocalendar()[:2],
+        "monthly": lambda created: (created.year, created.month),
+    }
+    for rule, period_of in periods.items():
+        seen = set()
+        for backup in backups:
+            period = period_of(backup["created"])
+            if period in seen:
+                continue
+            seen.add(period)
+            if len(seen) > policy.get(rule, 0):
+                break
+            # Newest backup of the period
+            keep.add(backup["path"])
+
+    deleted = []
+    for backup in backups:
+        if backup["path"] not in keep:
+            try:
+                # The main file goes last, so a failure leaves a listed backup
+                for path in _sales_archive_backups(backup["path"]):
+                    os.remove(path)
+                os.remove(backup["path"])
+                deleted.append(backup["path"])
+            except OSError as e:
+                print(f"Error deleting backup {backup['path']}: {e}")
+    return deleted
+
+def restore_backup(archive_path, db_path=None, backup_current=True):
+    """
+    Replace a database and its sales archives with the contents of a backup.
+
+    The archive and its sales archive copies are unpacked and checked first,
+    and the current database is backed up unless told otherwise. The data is
+    then copied in through SQLite, so other connections see either the old
+    or the restored database, never a mix. Restored backups of older
+    versions are migrated. Sales archive files the restored database does
+    not refer to are renamed to <file>.replaced-<time>, so the next
+    archiving run can't mix their rows with the restored ones.
+
+    Args:
+        archive_path (str): A .db.gz archive written by backup_database()
+        db_path (str, optional): Database to restore, DB_PATH by default
+        backup_current (bool): Back up the database being replaced first
+
+    Returns:
+        bool: True if successful
+    """
+    db_path = db_path or database.DB_PATH
+    restore_path = db_path + ".restore"
+    archive_dir = database.get_archive_dir(db_path)
+    unpacked = {}  # Sales archive file name: unpacked copy
+
+    try:
+        with gzip.open(archive_path, "rb") as archive, open(restore_path, "wb") as restore_file:
+            shutil.copyfileobj(archive, restore_file, 1024 * 1024)
+
+        registered = _registered_archives(restore_path)
+        for file_name in registered:
+            copy_path = _archive_backup_path(archive_path, file_name)
+            if not os.path.exists(copy_path):
+                # Backups taken before the archives were backed up
+                print(f"Error restoring backup: no copy of sales archive {file_name}, keeping the current file")
+                continue
+            os.makedirs(archive_dir, exist_ok=True)
+            unpacked[file_name] = os.path.join(archive_dir, file_name + ".restore")
+            with gzip.open(copy_path, "rb") as archive, open(unpacked[file_name], "wb") as restore_file:
+                shutil.copyfileobj(archive, restore_file, 1024 * 1024)
+            conn = sqlite3.connect(unpacked[file_name])
+            try:
+                check = conn.execute("PRAGMA quick_check").fetchone()[0]
+            finally:
+                conn.close()
+            if check != "ok":
+                print(f"Error restoring backup: sales archive {file_name} failed its check: {check}")
+                return False
+
+        source = sqlite3.connect(restore_path)
+        try:
+            check = source.execute("PRAGMA quick_check").fetchone()[0]
+            if check != "ok":
+                print(f"Error restoring backup: the archive failed its check: {check}")
+                return False
+
+            if backup_current and os.path.exists(db_path):
+                backup_database(db_path)
+
+            if os.path.abspath(db_path) == os.path.abspath(database.DB_PATH):
+                # Pooled connections and caches would keep serving the old data
+                database.close_connections()
+                database.catalog_cache.invalidate_categories()
+                database.catalog_cache.invalidate_products()
+
+            target = sqlite3.connect(db_path)
+            try:
+                target.execute(f"PRAGMA busy_timeout = {int(database.get_performance_profile()['busy_timeout'])}")
+                source.backup(target)
+            finally:
+                target.close()
+        finally:
+            source.close()
+
+        # The archives the restored database refers to, from the same backup
+        stamp = datetime.now().strftime(_TIMESTAMP_FORMAT)
+        prefix = f"{_archive_prefix(db_path)}-sales-"
+        if os.path.isdir(archive_dir):
+            for file_name in os.listdir(archive_dir):
+                if file_name.startswith(prefix) and file_name.endswith(".db") and file_name not in registered:
+                    path = os.path.join(archive_dir, file_name)
+                    os.replace(path, f"{path}.replaced-{stamp}")
+        for file_name, path in unpacked.items():
+            os.replace(path, os.path.join(archive_dir, file_name))
+
+        database.migrate_database(db_path)
+        print(f"Restored {db_path} and {len(unpacked)} sales archives from {archive_path}")
+        return True
+    except Exception as e:
+        print(f"Error restoring backup: {e}")
+        return False
+    finally:
+        for path in [restore_path, *unpacked.values()]:
+            if os.path.exists(path):
+                os.remove(path)
+
+class BackupScheduler(threading.Thread):
+    """
+    Background thread backing up the database at a fixed interval.
+
+    The first backup runs as soon as the newest existing one is older than
+    the interval, so restarting the application does not skip or repeat
+    backups. Each backup is followed by pruning.
+    """
+    def __init__(self, interval_hours=BACKUP_INTERVAL_HOURS, directory=None, policy=None):
+        super().__init__(name="backup-scheduler", daemon=True)
+        self.interval = timedelta(hours=interval_hours)
+        self.directory = directory
+        self.policy = policy
+        self.last_result = None
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+
+    def run_now(self):
+        """Back up as soon as possible instead of waiting for the interval"""
+        self._wake_event.set()
+
+    def stop(self):
+        """Cancel a running backup and stop the thread"""
+        self._stop_event.set()
+        self._wake_event.set()
+        self.join()
+
+    def seconds_until_due(self):
+        """
+        Time left until the next scheduled backup.
+
+        Returns:
+            float: Seconds, 0 if a backup is due
+        """
+        backups = list_backups(self.directory)
+        if not backups:
+            return 0.0
+        due = backups[0]["created"] + self.interval
+        return max((due - datetime.now()).total_seconds(), 0.0)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            if self._wake_event.is_set() or self.seconds_until_due() <= 0:
+                self._wake_event.clear()
+                try:
+                    self.last_result = backup_database(directory=self.directory, cancel_event=self._stop_event)
+                    prune_backups(self.directory, policy=self.policy)
+                except BackupCancelled:
+                    break
+                except Exception as e:
+                    print(f"Error in scheduled backup: {e}")
+                    # Try again later rather than in a tight loop
+                    self._wake_event.wait(min(self.interval.total_seconds(), 3600))
+                    continue
+            self._wake_event.wait(self.seconds_until_due())
+
+_scheduler = None
+
+def start_backup_scheduler(interval_hours=BACKUP_INTERVAL_HOURS):
+    """
+    Start the shared backup scheduler if it is not running.
+
+    Returns:
+        BackupScheduler: The running scheduler
+    """
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = BackupScheduler(interval_hours)
+        _scheduler.start()
+    return _scheduler
+
+def stop_backup_scheduler():
+    """Stop the shared backup scheduler if it was started"""
+    global _scheduler
+    if _scheduler is not None:
+        _scheduler.stop()
+        _scheduler = None
+
+def main():
+    parser = argparse.ArgumentParser(description="Back up and restore the shop database")
+    parser.add_argument("--db", default=database.DB_PATH, help="database file (default: %(default)s)")
+    parser.add_argument("--dir", help="backup folder (default: backups next to the database)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("backup", help="back up the database now")
+    commands.add_parser("list", help="list the backups, newest first")
+    commands.add_parser("prune", help="delete the backups the retention policy does not keep")
+    restore_parser = commands.add_parser("restore", help="replace the database with a backup")
+    restore_parser.add_argument("archive", help="backup archive (.db.gz)")
+    restore_parser.add_argument("--no-backup", action="store_true",
+                                help="do not back up the current database first")
+    args = parser.parse_args()
+
+    if args.command == "backup":
+        backup_database(args.db, args.dir)
+        prune_backups(args.dir, args.db)
+    elif args.command == "list":
+        for backup in list_backups(args.dir, args.db):
+            print(f"{backup['created']:%Y-%m-%d %H:%M:%S}  {backup['compressed_size'] / 1024:10.0f} KiB  {backup['path']}")
+    elif args.command == "prune":
+        for path in prune_backups(args.dir, args.db):
+            print(f"Deleted {path}")
+    elif args.command == "restore":
+        return 0 if restore_backup(args.archive, args.db, backup_current=not args.no_backup) else 1
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,119 +1,1144 @@
 import os
+import queue
+import random
+import re
 import sqlite3
-from datetime import datetime
+import tempfile
+import threading
+import time
+import unicodedata
+import weakref
+from concurrent.futures import Future
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
 import base64
 
 # Database file path
 DB_PATH = "mattress_shop.db"
 
+# Number of idle read connections each thread keeps for reuse
+READ_POOL_SIZE = 2
+
+# SQLite tuning applied to every connection when it is opened.
+# "balanced" favours throughput: WAL lets sales-history reads run alongside
+# checkout writes, and synchronous=NORMAL only risks the last commits on
+# power loss. "durable" syncs every commit and skips memory mapping.
+PERFORMANCE_PROFILES = {
+    "balanced": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16000,       # Negative values are KiB (about 16 MB)
+        "mmap_size": 268435456,     # 256 MB
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,       # Milliseconds
+    },
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "cache_size": -8000,
+        "mmap_size": 0,
+        "temp_store": "MEMORY",
+        "busy_timeout": 10000,
+    },
+}
+
+# Active profile, can be overridden with the RETAIL_DB_PROFILE environment variable
+DB_PROFILE = os.environ.get("RETAIL_DB_PROFILE", "balanced")
+
+def set_performance_profile(name):
+    """
+    Select the performance profile used for new connections.
+    
+    Args:
+        name (str): A key of PERFORMANCE_PROFILES
+    """
+    global DB_PROFILE
+    if name not in PERFORMANCE_PROFILES:
+        raise ValueError(f"Unknown database profile: {name}")
+    DB_PROFILE = name
+
+def get_performance_profile(name=None):
+    """
+    Return the settings of a performance profile.
+    
+    Args:
+        name (str, optional): Profile name, defaults to DB_PROFILE
+        
+    Returns:
+        dict: PRAGMA names mapped to their values
+    """
+    name = name or DB_PROFILE
+    if name not in PERFORMANCE_PROFILES:
+        print(f"Unknown database profile '{name}', using 'balanced'")
+        name = "balanced"
+    return PERFORMANCE_PROFILES[name]
+
+def apply_performance_profile(conn, profile, set_journal_mode=True):
+    """
+    Apply a performance profile to an open connection.
+    
+    Args:
+        conn: SQLite connection
+        profile (dict): Settings from get_performance_profile()
+        set_journal_mode (bool): Whether to switch the journal mode. The
+            mode is stored in the database file, so only writers need to set it.
+    """
+    # busy_timeout goes first so the journal mode switch can wait for locks
+    conn.execute(f"PRAGMA busy_timeout = {int(profile['busy_timeout'])}")
+    if set_journal_mode:
+        conn.execute(f"PRAGMA journal_mode = {profile['journal_mode']}")
+    conn.execute(f"PRAGMA synchronous = {profile['synchronous']}")
+    conn.execute(f"PRAGMA cache_size = {int(profile['cache_size'])}")
+    conn.execute(f"PRAGMA mmap_size = {int(profile['mmap_size'])}")
+    conn.execute(f"PRAGMA temp_store = {profile['temp_store']}")
+
+class ConnectionManager:
+    """
+    Keeps long-lived SQLite connections and hands them out per thread.
+
+    Every thread gets one write connection plus a small pool of read
+    connections. They are opened on first use and reused across calls, so
+    a lookup does not pay the connect and schema-load cost every time.
+    Connections live as long as their thread: those of exited threads are
+    closed the next time any thread opens one. The manager can be used as
+    a context manager and closes every connection it opened on exit.
+    """
+    def __init__(self, db_path, read_pool_size=READ_POOL_SIZE, profile=None):
+        self.db_path = db_path
+        self.read_pool_size = read_pool_size
+        self.profile_name = profile or DB_PROFILE
+        self.profile = get_performance_profile(self.profile_name)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = {}  # connection: thread that opened it
+        self._generation = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close_all()
+        return False
+
+    def _open(self, writer=False):
+        """Open a new connection and register it for shutdown"""
+        self._prune()
+        # Connections never leave the thread that opened them, but
+        # close_all() and _prune() may close them from another thread
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row  # This allows accessing columns by name
+        apply_performance_profile(conn, self.profile, set_journal_mode=writer)
+        with self._lock:
+            self._connections[conn] = threading.current_thread()
+        return conn
+
+    def _discard(self, conn):
+        """Close a connection that is not going back to a pool"""
+        with self._lock:
+            self._connections.pop(conn, None)
+        conn.close()
+
+    def _prune(self):
+        """Close the connections of threads that have exited"""
+        with self._lock:
+            dead = [conn for conn, thread in self._connections.items() if not thread.is_alive()]
+            for conn in dead:
+                del self._connections[conn]
+        for conn in dead:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                print(f"Error closing connection: {e}")
+
+    def connection_count(self):
+        """Number of open connections, on all threads"""
+        with self._lock:
+            return len(self._connections)
+
+    def _state(self):
+        """Return the connections owned by the calling thread"""
+        state = getattr(self._local, "state", None)
+        if state is None or state["generation"] != self._generation:
+            state = {"generation": self._generation, "writer": None, "depth": 0, "readers": []}
+            self._local.state = state
+        return state
+
+    @contextmanager
+    def writer(self):
+        """
+        Borrow the calling thread's write connection.
+
+        Any transaction still open when the outermost block exits is rolled
+        back, so an early return can never leak a half-finished write into
+        the next call.
+        """
+        state = self._state()
+        if state["writer"] is None:
+            state["writer"] = self._open(writer=True)
+        conn = state["writer"]
+        state["depth"] += 1
+        try:
+            yield conn
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            state["depth"] -= 1
+            if state["depth"] == 0 and conn.in_transaction:
+                conn.rollback()
+
+    @contextmanager
+    def reader(self):
+        """Borrow a read connection from the calling thread's pool"""
+        state = self._state()
+        idle = state["readers"]
+        if idle:
+            conn = idle.pop()
+        else:
+            conn = self._open()
+            conn.execute("PRAGMA query_only = ON")
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            if state["generation"] == self._generation and len(idle) < self.read_pool_size:
+                idle.append(conn)
+            else:
+                self._discard(conn)
+
+    def close_all(self):
+        """Close every connection opened by this manager, on all threads"""
+        with self._lock:
+            connections = list(self._connections)
+            self._connections.clear()
+            # Threads notice the new generation and reopen lazily
+            self._generation += 1
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                print(f"Error closing connection: {e}")
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_connection_manager():
+    """
+    Return the shared connection manager for DB_PATH.
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None or _manager.db_path != DB_PATH or _manager.profile_name != DB_PROFILE:
+            if _manager is not None:
+                _manager.close_all()
+            _manager = ConnectionManager(DB_PATH)
+        return _manager
+
+def read_connection():
+    """
+    Context manager yielding a pooled read connection.
+    """
+    return get_connection_manager().reader()
+
+def write_connection():
+    """
+    Context manager yielding the calling thread's write connection.
+    """
+    return get_connection_manager().writer()
+
+def close_connections():
+    """
+    Close all pooled connections. Called when the application shuts down.
+    """
+    global _manager
+    # Queued writes still need their connection
+    write_queue.stop()
+    with _manager_lock:
+        if _manager is not None:
+            _manager.close_all()
+            _manager = None
+    data_versions.close()
+
 def get_connection():
     """
-    Create and return a connection to the SQLite database.
+    Create and return a private connection to the SQLite database.
+
+    The caller owns the connection and must close it. Regular queries
+    should use read_connection() or write_connection() instead.
     """
     conn = sqlite3.connect(DB_PATH)
     conn.row_factory = sqlite3.Row  # This allows accessing columns by name
+    apply_performance_profile(conn, get_performance_profile())
     return conn
 
-def check_and_update_schema():
+# Times a write transaction is retried after finding the database busy, on
+# top of the profile's busy_timeout. The delay doubles from WRITE_RETRY_DELAY
+# up to WRITE_RETRY_MAX_DELAY seconds, with jitter so retrying writers spread out.
+WRITE_RETRIES = 5
+WRITE_RETRY_DELAY = 0.02
+WRITE_RETRY_MAX_DELAY = 0.5
+
+class WriteContention:
     """
-    Check if the database schema is up to date and migrate if needed.
+    Counts how often write transactions found the database busy.
+    
+    busy is every SQLITE_BUSY seen, retries the attempts made after one,
+    failures the writes that gave up and wait_seconds the time spent
+    backing off.
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        """Set every counter back to zero"""
+        with self._lock:
+            self._counters = {"busy": 0, "retries": 0, "failures": 0, "wait_seconds": 0.0}
+    
+    def record(self, retried, wait_seconds=0.0):
+        """Count a busy error, retried or given up on"""
+        with self._lock:
+            self._counters["busy"] += 1
+            if retried:
+                self._counters["retries"] += 1
+                self._counters["wait_seconds"] += wait_seconds
+            else:
+                self._counters["failures"] += 1
+    
+    def snapshot(self):
+        """
+        Returns:
+            dict: Current value of every counter
+        """
+        with self._lock:
+            return dict(self._counters)
+
+# Shared contention counters of this process
+write_contention = WriteContention()
+
+def get_write_contention():
+    """
+    Get the write contention counters, see WriteContention.
     
-    # Check if the 'categories' table exists
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='categories'")
-    if not cursor.fetchone():
-        # Create categories table
-        print("Migrating database: Adding categories table")
+    Returns:
+        dict: busy, retries, failures and wait_seconds
+    """
+    return write_contention.snapshot()
+
+def _is_busy(error):
+    """Whether an error means another connection holds the write lock"""
+    code = getattr(error, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return "locked" in str(error) or "busy" in str(error)
+
+def _write_with_retry(conn, write):
+    """
+    Run write(cursor) in a BEGIN IMMEDIATE transaction, retrying while the database is busy.
+    
+    The transaction is committed when write returns a value and rolled back
+    when it returns None.
+    
+    Returns:
+        What write returned
+        
+    Raises:
+        sqlite3.OperationalError: If the database stayed busy after WRITE_RETRIES retries
+    """
+    for attempt in range(WRITE_RETRIES + 1):
         try:
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS categories (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL UNIQUE,
-                description TEXT
-            )
-            ''')
+            # Take the write lock up front, a deferred transaction could
+            # only find it taken when upgrading and fail without waiting
+            conn.execute("BEGIN IMMEDIATE")
+            before = _catalog_versions(conn)
+            result = write(conn.cursor())
+            if result is None:
+                conn.rollback()
+            else:
+                after = _catalog_versions(conn)
+                conn.commit()
+                if after != before:
+                    catalog_cache.record_write(before, after)
+            return result
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction:
+                conn.rollback()
+            if not _is_busy(e):
+                raise
+            if attempt == WRITE_RETRIES:
+                write_contention.record(retried=False)
+                raise
+            delay = min(WRITE_RETRY_DELAY * 2 ** attempt, WRITE_RETRY_MAX_DELAY) * random.uniform(0.5, 1.0)
+            write_contention.record(retried=True, wait_seconds=delay)
+            time.sleep(delay)
+
+# Writes reaching the write queue within this many seconds of the first one
+# of a group are committed with it, in one transaction and one sync
+GROUP_COMMIT_WINDOW = 0.003
+
+# Most writes committed in one group
+GROUP_COMMIT_MAX = 200
+
+class WriteQueue:
+    """
+    Commits the writes of every thread in groups, from one writer thread.
+    
+    A write is a function taking a cursor. The writer collects the writes
+    that arrive while it waits, runs them in one BEGIN IMMEDIATE transaction,
+    each inside its own savepoint, and commits them together, so a busy
+    checkout day pays one sync per group instead of one per call. A write
+    that raises is rolled back alone and its error goes to its own caller;
+    returning None rolls it back too. The window is only waited out while
+    several threads are writing, so a lone write commits right away.
+    """
+    def __init__(self, window=GROUP_COMMIT_WINDOW, max_group=GROUP_COMMIT_MAX):
+        self.window = window
+        self.max_group = max_group
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_group_size = 0
+    
+    def submit(self, write, finish=None, fail=None):
+        """
+        Queue a write.
+        
+        Args:
+            write (callable): Called with a cursor inside the group's transaction
+            finish (callable, optional): Called with the write's result once it
+                is committed, on the writer thread; its return value becomes the
+                result of the future
+            fail (callable, optional): Called with the exception if the write or
+                its commit failed; its return value becomes the result of the
+                future instead of the exception
             
-            # Insert default category
-            cursor.execute("INSERT INTO categories (name, description) VALUES (?, ?)", 
-                          ("General", "Default category for all products"))
-            conn.commit()
-            print("Categories table created")
+        Returns:
+            concurrent.futures.Future: Resolved once the write is committed
+        """
+        future = Future()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="write-queue", daemon=True)
+                self._thread.start()
+            self._queue.put((write, finish, fail, future))
+        return future
+    
+    def flush(self):
+        """
+        Commit every write queued so far without waiting for more, and wait for it.
+        
+        Raises:
+            Exception: What committing the last group raised
+        """
+        with self._lock:
+            if self._thread is None:
+                return
+            future = Future()
+            self._queue.put((None, None, None, future))
+        future.result()
+    
+    def stop(self):
+        """Commit the queued writes and stop the writer thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is not None:
+                self._queue.put(None)
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+    
+    def _collect(self, first):
+        """Gather a group starting with first, returns it and whether to stop after it"""
+        group = [first]
+        busy = self._last_group_size > 1 or self._queue.qsize() > 0
+        deadline = time.monotonic() + (self.window if busy else 0)
+        while group[-1][0] is not None and len(group) < self.max_group:
+            try:
+                remaining = deadline - time.monotonic()
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return group, True
+            group.append(item)
+        return group, False
+    
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            group, stop = self._collect(item)
+            self._commit(group)
+            if stop:
+                break
+    
+    def _commit(self, group):
+        """Run and commit a group, then resolve its futures"""
+        writes = [item for item in group if item[0] is not None]
+        self._last_group_size = len(writes)
+        
+        def write_group(cursor):
+            # Built again if the group is retried after finding the database busy
+            outcomes = []
+            for write, _, _, _ in writes:
+                cursor.execute("SAVEPOINT queued_write")
+                try:
+                    result, error = write(cursor), None
+                except sqlite3.OperationalError as e:
+                    if _is_busy(e):
+                        raise
+                    result, error = None, e
+                except Exception as e:
+                    result, error = None, e
+                if result is None:
+                    cursor.execute("ROLLBACK TO queued_write")
+                cursor.execute("RELEASE queued_write")
+                outcomes.append((result, error))
+            return outcomes
+        
+        try:
+            outcomes = []
+            if writes:
+                with write_connection() as conn:
+                    outcomes = _write_with_retry(conn, write_group)
         except Exception as e:
-            print(f"Migration error (categories): {e}")
-            conn.rollback()
+            outcomes = [(None, e)] * len(writes)
+            for write, _, _, future in group:
+                if write is None:
+                    future.set_exception(e)
+        else:
+            for write, _, _, future in group:
+                if write is None:
+                    future.set_result(True)
+        
+        for (_, finish, fail, future), (result, error) in zip(writes, outcomes):
+            try:
+                if error is None:
+                    future.set_result(finish(result) if finish else result)
+                elif fail:
+                    future.set_result(fail(error))
+                else:
+                    future.set_exception(error)
+            except Exception as e:
+                future.set_exception(e)
+
+# Shared write queue of this process
+write_queue = WriteQueue()
+
+def _queued_write(write, finish=None, fail=None, wait=True):
+    """
+    Run a write through the shared write queue, see WriteQueue.submit().
     
-    # Check if category_id column exists in products table
-    cursor.execute("PRAGMA table_info(products)")
-    columns = [column[1] for column in cursor.fetchall()]
+    Returns:
+        The finished result once committed, or the future itself when wait is False
+    """
+    future = write_queue.submit(write, finish, fail)
+    return future.result() if wait else future
+
+def flush_writes():
+    """
+    Commit every queued write now and wait for it.
     
-    if "category_id" not in columns:
-        print("Migrating database: Adding category_id column to products table")
-        try:
-            cursor.execute("ALTER TABLE products ADD COLUMN category_id INTEGER DEFAULT 1 REFERENCES categories(id)")
-            conn.commit()
-            print("Added category_id column")
-        except Exception as e:
-            print(f"Migration error (category_id): {e}")
-            conn.rollback()
+    Calls that were made with wait=False are durable once this returns.
+    """
+    write_queue.flush()
+
+# Secondary indexes for the hot queries, keyed by name. The version suffix
+# changes whenever a definition changes: _sync_indexes() drops any idx_*
+# index that is no longer listed here and builds the new one. Changing this
+# dict needs a new migration, which re-syncs the indexes when it completes.
+INDEXES = {
+    # Sales history pages, newest first: day range seeks, and key_number lets
+    # the category filter join products without reading the skipped rows
+    "idx_sales_history_v3": "sales (sale_day, sale_ts, key_number)",
+    # One product's or customer's history, and delete_product's check
+    "idx_sales_key_v3": "sales (key_number, sale_day, sale_ts)",
+    "idx_sales_customer_v3": "sales (customer_id, sale_day, sale_ts)",
+    "idx_products_category_v1": "products (category_id, key_number)",
+    "idx_customers_phone_v1": "customers (phone)",
+    "idx_customers_name_v1": "customers (name)",
+    "idx_sales_invoice_v1": "sales (invoice_id)",
+    # Moves rollup rows when a product changes category
+    "idx_sales_rollup_key_v1": "sales_daily_rollup (key_number, day)",
+    # Stock ledger: monthly snapshot ranges, and one product's stock at a date
+    "idx_stock_movements_day_v1": "stock_movements (movement_day, key_number, quantity)",
+    "idx_stock_movements_key_v1": "stock_movements (key_number, movement_day, quantity)",
+}
+
+def _sync_indexes(cursor):
+    """
+    Create missing secondary indexes and drop outdated ones.
     
-    # Check if image_data column exists in products table
-    if "image_data" not in columns:
-        print("Migrating database: Adding image_data column to products table")
-        try:
-            cursor.execute("ALTER TABLE products ADD COLUMN image_data TEXT")
-            conn.commit()
-            print("Added image_data column")
-        except Exception as e:
-            print(f"Migration error (image_data): {e}")
-            conn.rollback()
+    Args:
+        cursor: Cursor inside the caller's transaction
+        
+    Returns:
+        list: Names of the indexes that were created
+    """
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx\\_%' ESCAPE '\\'")
+    existing = {row[0] for row in cursor.fetchall()}
     
-    # Check if the customers table exists
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='customers'")
-    if not cursor.fetchone():
-        print("Migrating database: Adding customers table")
+    for name in existing - set(INDEXES):
+        print(f"Migrating database: Dropping outdated index {name}")
+        cursor.execute(f"DROP INDEX IF EXISTS {name}")
+    
+    created = []
+    for name, definition in INDEXES.items():
+        if name not in existing:
+            print(f"Migrating database: Creating index {name}")
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+            created.append(name)
+    
+    if created:
+        # Give the query planner statistics for the new indexes
+        cursor.execute("ANALYZE")
+    
+    return created
+
+# Triggers keeping the product_search full-text index in sync with
+# products and categories. The index rowid is the product key number.
+# category_key holds the category id as a "~<id>" token: "~" is a token
+# character of the index, and search words never contain it, so only
+# category filters match these tokens.
+SEARCH_TRIGGERS = {
+    "products_search_insert": '''
+        AFTER INSERT ON products BEGIN
+            INSERT INTO product_search (rowid, name, category_name, category_key)
+            VALUES (new.key_number, new.name, (SELECT name FROM categories WHERE id = new.category_id),
+                    '~' || new.category_id);
+        END''',
+    "products_search_update": '''
+        AFTER UPDATE OF key_number, name, category_id ON products BEGIN
+            DELETE FROM product_search WHERE rowid = old.key_number;
+            INSERT INTO product_search (rowid, name, category_name, category_key)
+            VALUES (new.key_number, new.name, (SELECT name FROM categories WHERE id = new.category_id),
+                    '~' || new.category_id);
+        END''',
+    "products_search_delete": '''
+        AFTER DELETE ON products BEGIN
+            DELETE FROM product_search WHERE rowid = old.key_number;
+        END''',
+    "categories_search_update": '''
+        AFTER UPDATE OF name ON categories BEGIN
+            UPDATE product_search SET category_name = new.name
+            WHERE rowid IN (SELECT key_number FROM products WHERE category_id = new.id);
+        END''',
+}
+
+def _fill_search_index(cursor):
+    """Index every product, inside the caller's transaction"""
+    cursor.execute("DELETE FROM product_search")
+    cursor.execute('''
+    INSERT INTO product_search (rowid, name, category_name, category_key)
+    SELECT p.key_number, p.name, c.name, '~' || p.category_id
+    FROM products p
+    LEFT JOIN categories c ON p.category_id = c.id
+    ''')
+
+def rebuild_search_index():
+    """
+    Rebuild the product search index from the products table.
+    
+    Returns:
+        bool: True if successful
+    """
+    with write_connection() as conn:
         try:
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS customers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                phone TEXT,
-                email TEXT,
-                address TEXT,
-                created_at TEXT
-            )
-            ''')
+            _fill_search_index(conn.cursor())
             conn.commit()
-            print("Customers table created")
-        except Exception as e:
-            print(f"Migration error (customers): {e}")
-            conn.rollback()
+            return True
+        except sqlite3.OperationalError as e:
+            print(f"Error rebuilding search index: {e}")
+            return False
+
+# Trigger condition that is false while archive_sales() moves sales out, so
+# archived sales keep their rollup rows and stock movements
+_NOT_ARCHIVING = "NOT EXISTS (SELECT 1 FROM maintenance_flags WHERE name = 'archiving')"
+
+# Triggers keeping sales_daily_rollup in step with the sales table. Rows are
+# attributed to the product's current category, like the sales queries.
+ROLLUP_TRIGGERS = {
+    "sales_rollup_insert": '''
+        AFTER INSERT ON sales BEGIN
+            INSERT INTO sales_daily_rollup (day, category_id, key_number, sale_count, quantity, revenue, profit)
+            VALUES (new.sale_day,
+                    IFNULL((SELECT category_id FROM products WHERE key_number = new.key_number), 1),
+                    new.key_number, 1, new.quantity, new.quantity * new.sale_price, new.profit)
+            ON CONFLICT (day, category_id, key_number) DO UPDATE SET
+                sale_count = sale_count + 1,
+                quantity = quantity + excluded.quantity,
+                revenue = revenue + excluded.revenue,
+                profit = profit + excluded.profit;
+        END''',
+    "sales_rollup_delete": f'''
+        AFTER DELETE ON sales WHEN {_NOT_ARCHIVING} BEGIN
+            UPDATE sales_daily_rollup SET
+                sale_count = sale_count - 1,
+                quantity = quantity - old.quantity,
+                revenue = revenue - old.quantity * old.sale_price,
+                profit = profit - old.profit
+            WHERE day = old.sale_day AND key_number = old.key_number;
+            DELETE FROM sales_daily_rollup
+            WHERE day = old.sale_day AND key_number = old.key_number AND sale_count <= 0;
+        END''',
+    "sales_rollup_update": '''
+        AFTER UPDATE OF key_number, quantity, sale_price, sale_ts, tz_offset, profit ON sales BEGIN
+            UPDATE sales_daily_rollup SET
+                sale_count = sale_count - 1,
+                quantity = quantity - old.quantity,
+                revenue = revenue - old.quantity * old.sale_price,
+                profit = profit - old.profit
+            WHERE day = old.sale_day AND key_number = old.key_number;
+            DELETE FROM sales_daily_rollup
+            WHERE day = old.sale_day AND key_number = old.key_number AND sale_count <= 0;
+            INSERT INTO sales_daily_rollup (day, category_id, key_number, sale_count, quantity, revenue, profit)
+            VALUES (new.sale_day,
+                    IFNULL((SELECT category_id FROM products WHERE key_number = new.key_number), 1),
+                    new.key_number, 1, new.quantity, new.quantity * new.sale_price, new.profit)
+            ON CONFLICT (day, category_id, key_number) DO UPDATE SET
+                sale_count = sale_count + 1,
+                quantity = quantity + excluded.quantity,
+                revenue = revenue + excluded.revenue,
+                profit = profit + excluded.profit;
+        END''',
+    "products_rollup_category": '''
+        AFTER UPDATE OF category_id ON products BEGIN
+            UPDATE sales_daily_rollup SET category_id = new.category_id WHERE key_number = old.key_number;
+        END''',
+}
+
+def _fill_sales_rollup(cursor, sales_source="sales"):
+    """
+    Recompute the rollup, inside the caller's transaction.
     
-    # Check if customer_id column exists in sales table
-    cursor.execute("PRAGMA table_info(sales)")
-    columns = [column[1] for column in cursor.fetchall()]
+    From the sales table alone, the days up to the last archived one are
+    kept as they are: their sales are in the archive files.
+    
+    Args:
+        cursor: Cursor inside the caller's transaction
+        sales_source (str): Table or subquery to read sales from, see _sales_source()
+    """
+    through = _archived_through(cursor) if sales_source == "sales" else ""
+    cursor.execute("DELETE FROM sales_daily_rollup WHERE day > ?", (through,))
+    cursor.execute(f'''
+    INSERT INTO sales_daily_rollup (day, category_id, key_number, sale_count, quantity, revenue, profit)
+    SELECT s.sale_day, IFNULL(p.category_id, 1), s.key_number,
+           COUNT(*), SUM(s.quantity), SUM(s.quantity * s.sale_price), SUM(s.profit)
+    FROM {sales_source} s
+    LEFT JOIN products p ON s.key_number = p.key_number
+    WHERE s.sale_day > ?
+    GROUP BY 1, 2, 3
+    ''', (through,))
+
+# Each sales row is one line of its invoice
+INVOICE_LINES_VIEW = '''
+    CREATE VIEW IF NOT EXISTS invoice_lines AS
+    SELECT invoice_id, id as sale_id, key_number, quantity, sale_price as unit_price,
+           quantity * sale_price as amount, profit
+    FROM sales
+    WHERE invoice_id IS NOT NULL
+    '''
+
+def rebuild_sales_rollup():
+    """
+    Rebuild the daily sales rollup from the sales table and every archive.
     
-    if "customer_id" not in columns:
-        print("Migrating database: Adding customer_id column to sales table")
+    Returns:
+        bool: True if successful
+    """
+    with write_connection() as conn:
         try:
-            cursor.execute("ALTER TABLE sales ADD COLUMN customer_id INTEGER REFERENCES customers(id)")
-            conn.commit()
-            print("Added customer_id column to sales table")
+            with _attached_archives(conn) as archives:
+                try:
+                    _fill_sales_rollup(conn.cursor(), _sales_source(archives))
+                    conn.commit()
+                except Exception:
+                    # Archives can't be detached inside a transaction
+                    conn.rollback()
+                    raise
+            return True
         except Exception as e:
-            print(f"Migration error (customer_id): {e}")
-            conn.rollback()
-    
-    conn.close()
+            print(f"Error rebuilding sales rollup: {e}")
+            return False
 
-def create_database():
+# Local time of a change made by a trigger, like _sale_time()
+_TRIGGER_NOW_TS = "CAST(strftime('%s', 'now') AS INTEGER)"
+_TRIGGER_NOW_OFFSET = "(CAST(strftime('%s', 'now', 'localtime') AS INTEGER) - CAST(strftime('%s', 'now') AS INTEGER))"
+
+# Triggers writing the stock movements of sales, keeping the ledger append-only
+# and dropping the snapshots a back-dated movement makes stale. Receipts,
+# adjustments and product deletions are recorded by the functions doing them.
+STOCK_TRIGGERS = {
+    "sales_stock_insert": '''
+        AFTER INSERT ON sales BEGIN
+            INSERT INTO stock_movements (key_number, movement_ts, tz_offset, kind, quantity, sale_id)
+            VALUES (new.key_number, new.sale_ts, new.tz_offset, 'sale', -new.quantity, new.id);
+        END''',
+    "sales_stock_delete": f'''
+        AFTER DELETE ON sales WHEN {_NOT_ARCHIVING} BEGIN
+            INSERT INTO stock_movements (key_number, movement_ts, tz_offset, kind, quantity, sale_id)
+            VALUES (old.key_number, {_TRIGGER_NOW_TS}, {_TRIGGER_NOW_OFFSET}, 'sale_deleted', old.quantity, old.id);
+        END''',
+    "sales_stock_update": f'''
+        AFTER UPDATE OF key_number, quantity ON sales BEGIN
+            INSERT INTO stock_movements (key_number, movement_ts, tz_offset, kind, quantity, sale_id)
+            VALUES (old.key_number, {_TRIGGER_NOW_TS}, {_TRIGGER_NOW_OFFSET}, 'sale_changed', old.quantity, old.id),
+                   (new.key_number, {_TRIGGER_NOW_TS}, {_TRIGGER_NOW_OFFSET}, 'sale_changed', -new.quantity, new.id);
+        END''',
+    "stock_movements_no_update": '''
+        BEFORE UPDATE ON stock_movements BEGIN
+            SELECT RAISE(ABORT, 'stock_movements is append-only');
+        END''',
+    "stock_movements_no_delete": '''
+        BEFORE DELETE ON stock_movements BEGIN
+            SELECT RAISE(ABORT, 'stock_movements is append-only');
+        END''',
+    "stock_snapshots_invalidate": '''
+        AFTER INSERT ON stock_movements BEGIN
+            DELETE FROM stock_snapshots WHERE key_number = new.key_number AND day >= new.movement_day;
+        END''',
+}
+
+class DataVersionService:
     """
-    Create the database and necessary tables if they don't exist.
+    Tells consumers whether the tables they show changed since they loaded them.
+    
+    A dedicated connection polls PRAGMA data_version, which moves whenever
+    another connection commits, whether in this process or another one.
+    Only then are the per-table counters in table_versions read again, so
+    checking an unchanged database costs a single PRAGMA.
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    def __init__(self):
+        self._conn = None
+        self._db_path = None
+        self._data_version = None
+        self._versions = {}
+        self._seen = weakref.WeakKeyDictionary()
+        self._lock = threading.RLock()
+    
+    def _connection(self):
+        """Open the polling connection, again if DB_PATH changed"""
+        if self._conn is None or self._db_path != DB_PATH:
+            self.close()
+            self._conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+            self._db_path = DB_PATH
+        return self._conn
+    
+    def versions(self):
+        """
+        Get the current change counter of every tracked table.
+        
+        Returns:
+            dict: Versions keyed by table name, None if they can't be read
+        """
+        with self._lock:
+            try:
+                conn = self._connection()
+                data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+                if data_version != self._data_version:
+                    self._versions = dict(conn.execute("SELECT table_name, version FROM table_versions").fetchall())
+                    self._data_version = data_version
+                return self._versions
+            except sqlite3.Error as e:
+                print(f"Error reading table versions: {e}")
+                return None
+    
+    def changed(self, owner, tables):
+        """
+        Check whether any of the tables changed since owner last called mark_seen().
+        
+        Args:
+            owner: The consumer, usually a widget
+            tables (tuple): Names of the tables the consumer depends on
+            
+        Returns:
+            bool: True if the consumer should reload
+        """
+        versions = self.versions()
+        seen = self._seen.get(owner)
+        if versions is None or seen is None:
+            return True
+        return any(versions.get(table) != seen.get(table) for table in tables)
+    
+    def mark_seen(self, owner, tables):
+        """
+        Record the current versions of the tables as loaded by owner.
+        
+        Call this before querying, so a write racing the query triggers
+        another reload rather than being missed.
+        """
+        versions = self.versions()
+        if versions is None:
+            return
+        seen = self._seen.setdefault(owner, {})
+        for table in tables:
+            seen[table] = versions.get(table)
+    
+    def close(self):
+        """Close the polling connection"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+                self._data_version = None
+
+# Shared change tracker used by the UI
+data_versions = DataVersionService()
+
+# Columns returned for every product, shared by the catalog cache queries
+_PRODUCT_SELECT = """
+    SELECT p.key_number, p.name, p.purchase_price, p.sale_price, p.total_added, p.sold, 
+           (p.total_added - p.sold) as remaining, p.image_path, p.category_id,
+           EXISTS (SELECT 1 FROM product_images i WHERE i.key_number = p.key_number) as has_image,
+           c.name as category_name
+    FROM products p
+    JOIN categories c ON p.category_id = c.id
+"""
+
+# Tables the catalog is built from
+CATALOG_TABLES = ("categories", "products", "product_images")
+
+def _catalog_versions(conn):
+    """Read the catalog table versions inside the caller's transaction"""
+    placeholders = ", ".join("?" * len(CATALOG_TABLES))
+    rows = conn.execute(
+        f"SELECT table_name, version FROM table_versions WHERE table_name IN ({placeholders})",
+        CATALOG_TABLES).fetchall()
+    versions = dict(rows)
+    return {table: versions.get(table) for table in CATALOG_TABLES}
+
+class CatalogCache:
+    """
+    In-process read-through cache of categories and products.
+    
+    The write functions in this module invalidate exactly what they change:
+    a sale refreshes the products it sold, a category rename the categories
+    and the product rows showing the name. Writes from other processes are
+    noticed through table_versions and drop the whole cache. Each local write
+    records the versions it found and left behind, so a foreign write just
+    before or after one of ours is not mistaken for our own.
     
-    # Create categories table
+    Loads run under the cache lock, so an invalidation can never be
+    overwritten by a load that started before it.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+    
+    def clear(self):
+        """Drop everything, the next read reloads from the database"""
+        with self._lock:
+            self._db_path = DB_PATH
+            self._versions = None
+            self._expected_versions = None
+            self._foreign_write = False
+            self._categories = None
+            self._categories_by_id = None
+            self._products = None
+            self._by_category = None
+            self._stale_keys = set()
+    
+    def invalidate_categories(self):
+        """Reload the categories on the next read"""
+        with self._lock:
+            self._categories = None
+            self._categories_by_id = None
+    
+    def invalidate_products(self, key_numbers=None):
+        """
+        Reload products on the next read.
+        
+        Args:
+            key_numbers (iterable, optional): Only these products, all when omitted
+        """
+        with self._lock:
+            if key_numbers is None:
+                self._products = None
+                self._by_category = None
+                self._stale_keys = set()
+            elif self._products is not None:
+                self._stale_keys.update(key_numbers)
+    
+    def record_write(self, before, after):
+        """
+        Note a committed local write to the catalog tables.
+        
+        Args:
+            before (dict): Catalog table versions when the transaction began
+            after (dict): Catalog table versions the transaction committed
+        """
+        with self._lock:
+            expected = self._expected_versions or self._versions
+            if expected is not None and before != expected:
+                # Someone else wrote since the last version we know of
+                self._foreign_write = True
+            self._expected_versions = after
+    
+    def _check_versions(self):
+        """Drop the cache if another process changed the catalog tables"""
+        if self._db_path != DB_PATH:
+            self.clear()
+        
+        versions = data_versions.versions()
+        if versions is None:
+            return
+        current = {table: versions.get(table) for table in CATALOG_TABLES}
+        expected = self._expected_versions or self._versions
+        if self._foreign_write or (expected is not None and current != expected):
+            self.clear()
+        # Our own writes were invalidated precisely, start tracking from here
+        self._versions = current
+        self._expected_versions = None
+        self._foreign_write = False
+    
+    def _load_categories(self):
+        with read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, name, description FROM categories ORDER BY name")
+            self._categories = [dict(row) for row in cursor.fetchall()]
+        self._categories_by_id = {category["id"]: category for category in self._categories}
+    
+    def _load_products(self):
+        with read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(_PRODUCT_SELECT + " ORDER BY p.key_number")
+            self._products = {row["key_number"]: dict(row) for row in cursor.fetchall()}
+        self._by_category = None
+        self._stale_keys = set()
+    
+    def _refresh_stale_products(self):
+        """Reload only the products invalidated since the last read"""
+        stale = list(self._stale_keys)
+        self._stale_keys = set()
+        
+        fresh = {}
+        with read_connection() as conn:
+            cursor = conn.cursor()
+            # Stay well below SQLite's bound parameter limit
+            for start in range(0, len(stale), 500):
+                chunk = stale[start:start + 500]
+                placeholders = ", ".join("?" * len(chunk))
+                cursor.execute(_PRODUCT_SELECT + f" WHERE p.key_number IN ({placeholders})", chunk)
+                fresh.update((row["key_number"], dict(row)) for row in cursor.fetchall())
+        
+        reorder = False
+        for key_number in stale:
+            old = self._products.get(key_number)
+            new = fresh.get(key_number)
+            if new is None:
+                self._products.pop(key_number, None)
+            else:
+                self._products[key_number] = new
+                reorder = reorder or old is None
+            
+            # Added, deleted or moved products change the category index
+            old_category = old["category_id"] if old else None
+            new_category = new["category_id"] if new else None
+            if old_category != new_category:
+                self._by_category = None
+        
+        if reorder:
+            self._products = dict(sorted(self._products.items()))
+    
+    def _ensure_products(self):
+        self._check_versions()
+        if self._products is None:
+            self._load_products()
+        elif self._stale_keys:
+            self._refresh_stale_products()
+    
+    def categories(self):
+        """
+        Get all categories ordered by name.
+        
+        Returns:
+            list: Copies of the category dictionaries
+        """
+        with self._lock:
+            self._check_versions()
+            if self._categories is None:
+                self._load_categories()
+            return [dict(category) for category in self._categories]
+    
+    def category(self, category_id):
+        """
+        Get one category.
+        
+        Returns:
+            dict: A copy of the category or None if not found
+        """
+        with self._lock:
+            self._check_versions()
+            if self._categories is None:
+                self._load_categories()
+            category = self._categories_by_id.get(category_id)
+            return dict(category) if category else None
+    
+    def products(self, category_id=None):
+        """
+        Get all products, or those of one category, ordered by key number.
+        
+        Returns:
+            list: Copies of the product dictionaries
+        """
+        with self._lock:
+            self._ensure_products()
+            if category_id is None:
+                return [dict(product) for product in self._products.values()]
+            
+            if self._by_category is None:
+                self._by_category = {}
+                for key_number, product in self._products.items():
+                    self._by_category.setdefault(product["category_id"], []).append(key_number)
+            return [dict(self._products[key_number]) for key_number in self._by_category.get(category_id, [])]
+    
+    def product(self, key_number):
+        """
+        Get one product.
+        
+        Returns:
+            dict: A copy of the product or None if not found
+        """
+        with self._lock:
+            self._ensure_products()
+            product = self._products.get(key_number)
+            return dict(product) if product else None
+    
+    def products_by_key(self, key_numbers):
+        """
+        Get several products in the given order, skipping unknown ones.
+        
+        Returns:
+            list: Copies of the product dictionaries
+        """
+        with self._lock:
+            self._ensure_products()
+            products = (self._products.get(key_number) for key_number in key_numbers)
+            return [dict(product) for product in products if product]
+
+# Shared catalog cache behind the category and product getters
+catalog_cache = CatalogCache()
+
+def _table_exists(cursor, name):
+    """Check whether a table or view exists"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type IN ('table', 'view') AND name = ?", (name,))
+    return cursor.fetchone() is not None
+
+def _column_names(cursor, table):
+    """Return the column names of a table"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    return [column[1] for column in cursor.fetchall()]
+
+# Schema migrations live below. The pending ones run in a single transaction
+# together with the rebuild of the derived objects and the PRAGMA
+# user_version bump. Databases created before versioning report version 0
+# but may already contain any of these tables, so every migration must also
+# work on a partially migrated schema.
+
+def _migrate_base_tables(cursor):
+    """Categories, products, customers, sales and license tables"""
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS categories (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -128,7 +1153,6 @@ def create_database():
         cursor.execute("INSERT INTO categories (name, description) VALUES (?, ?)", 
                       ("General", "Default category for all products"))
     
-    # Create products table
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS products (
         key_number INTEGER PRIMARY KEY,
@@ -138,13 +1162,14 @@ def create_database():
         total_added INTEGER NOT NULL,
         sold INTEGER DEFAULT 0,
         image_path TEXT,
-        image_data TEXT,
         category_id INTEGER DEFAULT 1,
         FOREIGN KEY (category_id) REFERENCES categories(id)
     )
     ''')
     
-    # Create customers table
+    if "category_id" not in _column_names(cursor, "products"):
+        cursor.execute("ALTER TABLE products ADD COLUMN category_id INTEGER DEFAULT 1 REFERENCES categories(id)")
+    
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS customers (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -156,7 +1181,6 @@ def create_database():
     )
     ''')
     
-    # Create sales table
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS sales (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -171,28 +1195,543 @@ def create_database():
     )
     ''')
     
-    conn.commit()
-    conn.close()
+    if "customer_id" not in _column_names(cursor, "sales"):
+        cursor.execute("ALTER TABLE sales ADD COLUMN customer_id INTEGER REFERENCES customers(id)")
+    
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS license (
+        key TEXT PRIMARY KEY,
+        customer_id TEXT,
+        expiry_date TEXT,
+        activation_date TEXT
+    )
+    ''')
+
+def _migrate_product_images(cursor):
+    """Image and thumbnail tables, moving base64 images out of products"""
+    # Kept apart from products so list queries stay small
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS product_images (
+        key_number INTEGER PRIMARY KEY,
+        image_data BLOB NOT NULL,
+        FOREIGN KEY (key_number) REFERENCES products (key_number)
+    )
+    ''')
+    
+    # One pre-scaled image per UI size
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS product_thumbnails (
+        key_number INTEGER NOT NULL,
+        size TEXT NOT NULL,
+        image_data BLOB NOT NULL,
+        PRIMARY KEY (key_number, size),
+        FOREIGN KEY (key_number) REFERENCES products (key_number)
+    )
+    ''')
     
-    # Check if we need to migrate existing data
-    check_and_update_schema()
+    if "image_data" in _column_names(cursor, "products"):
+        cursor.execute("SELECT key_number, image_data FROM products WHERE image_data IS NOT NULL")
+        cursor.executemany(
+            "INSERT OR REPLACE INTO product_images (key_number, image_data) VALUES (?, ?)",
+            [(row[0], base64.b64decode(row[1])) for row in cursor.fetchall()]
+        )
+        cursor.execute("UPDATE products SET image_data = NULL WHERE image_data IS NOT NULL")
 
-def get_all_categories():
+def _migrate_invoices(cursor):
+    """Invoice headers, with existing sales grouped into invoices"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS invoices (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        customer_id INTEGER,
+        invoice_date TEXT NOT NULL,
+        FOREIGN KEY (customer_id) REFERENCES customers (id)
+    )
+    ''')
+    
+    if "invoice_id" not in _column_names(cursor, "sales"):
+        cursor.execute("ALTER TABLE sales ADD COLUMN invoice_id INTEGER REFERENCES invoices(id)")
+    
+    # Group sales recorded before invoices existed. Checkout stamped every
+    # line of a cart with the same customer and, almost always, the same second.
+    cursor.execute("SELECT id, customer_id, sale_date FROM sales WHERE invoice_id IS NULL ORDER BY id")
+    invoice_ids = {}
+    assignments = []
+    for sale_id, customer_id, sale_date in cursor.fetchall():
+        group = (customer_id, sale_date)
+        if group not in invoice_ids:
+            cursor.execute("INSERT INTO invoices (customer_id, invoice_date) VALUES (?, ?)", group)
+            invoice_ids[group] = cursor.lastrowid
+        assignments.append((invoice_ids[group], sale_id))
+    cursor.executemany("UPDATE sales SET invoice_id = ? WHERE id = ?", assignments)
+
+def _migrate_sales_rollup(cursor):
+    """Daily sales rollup table"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sales_daily_rollup (
+        day TEXT NOT NULL,
+        category_id INTEGER NOT NULL,
+        key_number INTEGER NOT NULL,
+        sale_count INTEGER NOT NULL DEFAULT 0,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0,
+        profit REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, category_id, key_number)
+    )
+    ''')
+
+def _migrate_search_index(cursor):
+    """FTS5 product search index"""
+    if not _table_exists(cursor, "product_search"):
+        try:
+            cursor.execute('''
+            CREATE VIRTUAL TABLE product_search USING fts5(
+                name,
+                category_name,
+                tokenize = 'unicode61 remove_diacritics 2',
+                prefix = '2 3'
+            )
+            ''')
+        except sqlite3.OperationalError as e:
+            # SQLite builds without FTS5 fall back to LIKE searches
+            print(f"Product search index not available: {e}")
+            return
+        
+        # Rank name matches well above category matches
+        cursor.execute("INSERT INTO product_search (product_search, rank) VALUES ('rank', 'bm25(10.0, 1.0)')")
+
+# Tables whose writes bump their counter in table_versions. Adding a table
+# here needs a new migration, like any change to the derived objects.
+TRACKED_TABLES = ("categories", "products", "product_images", "customers", "sales", "invoices")
+
+def _create_version_triggers(cursor):
+    """Create the table_versions row and triggers of every tracked table"""
+    for table in TRACKED_TABLES:
+        cursor.execute("INSERT OR IGNORE INTO table_versions (table_name) VALUES (?)", (table,))
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cursor.execute(f'''
+            CREATE TRIGGER {table}_version_{event.lower()}
+            AFTER {event} ON {table} BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE table_name = '{table}';
+            END
+            ''')
+
+def _migrate_table_versions(cursor):
+    """Per-table change counters for skipping redundant UI refreshes"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS table_versions (
+        table_name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+
+def _rebuild_table(cursor, table, definition, columns):
     """
-    Retrieve all product categories.
+    Replace a table with a new definition, copying every row.
+    
+    Triggers and views must be dropped first, renaming checks them all.
+    Indexes on the table go with it and are rebuilt by _sync_derived_objects().
+    
+    Args:
+        cursor: Cursor inside the migration's transaction
+        table (str): Table to rebuild
+        definition (str): Column and constraint definitions of the new table
+        columns (dict): New column names mapped to SQL expressions over the old table
+    """
+    # Keep AUTOINCREMENT from reusing the ids of deleted rows
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,))
+    sequence = cursor.fetchone()
     
+    cursor.execute(f"CREATE TABLE {table}_new ({definition})")
+    cursor.execute(f"""
+    INSERT INTO {table}_new ({', '.join(columns)})
+    SELECT {', '.join(columns.values())} FROM {table}
+    """)
+    cursor.execute(f"DROP TABLE {table}")
+    cursor.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+    
+    if sequence is not None:
+        cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (sequence[0], table))
+
+def _migrate_money_to_cents(cursor):
+    """Store prices, profit and revenue as integer cents"""
+    _drop_derived_objects(cursor)
+    
+    _rebuild_table(cursor, "products", '''
+        key_number INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        purchase_price INTEGER NOT NULL,
+        sale_price INTEGER NOT NULL,
+        total_added INTEGER NOT NULL,
+        sold INTEGER DEFAULT 0,
+        image_path TEXT,
+        category_id INTEGER DEFAULT 1,
+        FOREIGN KEY (category_id) REFERENCES categories(id)
+    ''', {
+        "key_number": "key_number",
+        "name": "name",
+        "purchase_price": "CAST(ROUND(purchase_price * 100) AS INTEGER)",
+        "sale_price": "CAST(ROUND(sale_price * 100) AS INTEGER)",
+        "total_added": "total_added",
+        "sold": "sold",
+        "image_path": "image_path",
+        "category_id": "category_id",
+    })
+    
+    _rebuild_table(cursor, "sales", '''
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        key_number INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        sale_price INTEGER NOT NULL,
+        sale_date TEXT NOT NULL,
+        profit INTEGER NOT NULL,
+        customer_id INTEGER,
+        invoice_id INTEGER,
+        FOREIGN KEY (key_number) REFERENCES products (key_number),
+        FOREIGN KEY (customer_id) REFERENCES customers (id),
+        FOREIGN KEY (invoice_id) REFERENCES invoices (id)
+    ''', {
+        "id": "id",
+        "key_number": "key_number",
+        "quantity": "quantity",
+        "sale_price": "CAST(ROUND(sale_price * 100) AS INTEGER)",
+        "sale_date": "sale_date",
+        "profit": "CAST(ROUND(profit * 100) AS INTEGER)",
+        "customer_id": "customer_id",
+        "invoice_id": "invoice_id",
+    })
+    
+    # The rollup is derived data, refilled by _sync_derived_objects()
+    cursor.execute("DROP TABLE sales_daily_rollup")
+    cursor.execute('''
+    CREATE TABLE sales_daily_rollup (
+        day TEXT NOT NULL,
+        category_id INTEGER NOT NULL,
+        key_number INTEGER NOT NULL,
+        sale_count INTEGER NOT NULL DEFAULT 0,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        revenue INTEGER NOT NULL DEFAULT 0,
+        profit INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, category_id, key_number)
+    )
+    ''')
+
+def _migrate_sale_timestamps(cursor):
+    """Store sale times as epoch seconds with a generated local sale_day"""
+    _drop_derived_objects(cursor)
+    
+    # sale_date was local time. The offset is kept per sale so sale_day
+    # stays the shop's calendar day across DST changes and moves.
+    _rebuild_table(cursor, "sales", '''
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        key_number INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        sale_price INTEGER NOT NULL,
+        sale_ts INTEGER NOT NULL,
+        tz_offset INTEGER NOT NULL DEFAULT 0,
+        sale_day TEXT GENERATED ALWAYS AS (date(sale_ts + tz_offset, 'unixepoch')) VIRTUAL,
+        profit INTEGER NOT NULL,
+        customer_id INTEGER,
+        invoice_id INTEGER,
+        FOREIGN KEY (key_number) REFERENCES products (key_number),
+        FOREIGN KEY (customer_id) REFERENCES customers (id),
+        FOREIGN KEY (invoice_id) REFERENCES invoices (id)
+    ''', {
+        "id": "id",
+        "key_number": "key_number",
+        "quantity": "quantity",
+        "sale_price": "sale_price",
+        "sale_ts": "CAST(strftime('%s', sale_date, 'utc') AS INTEGER)",
+        "tz_offset": "strftime('%s', sale_date) - strftime('%s', sale_date, 'utc')",
+        "profit": "profit",
+        "customer_id": "customer_id",
+        "invoice_id": "invoice_id",
+    })
+
+def _reconcile_stock_ledger(cursor):
+    """
+    Record an adjustment for every product whose ledger total differs from
+    total_added - sold, inside the caller's transaction.
+    """
+    now_ts, now_offset, _ = _sale_time()
+    cursor.execute('''
+    INSERT INTO stock_movements (key_number, movement_ts, tz_offset, kind, quantity, note)
+    SELECT p.key_number, ?, ?, 'adjustment', (p.total_added - p.sold) - IFNULL(m.on_hand, 0),
+           'Reconciled with the stock counters'
+    FROM products p
+    LEFT JOIN (SELECT key_number, SUM(quantity) as on_hand FROM stock_movements GROUP BY key_number) m
+        ON p.key_number = m.key_number
+    WHERE (p.total_added - p.sold) != IFNULL(m.on_hand, 0)
+    ''', (now_ts, now_offset))
+
+def _migrate_stock_ledger(cursor):
+    """Stock movement ledger and snapshots, backfilled from products and sales"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS stock_movements (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        key_number INTEGER NOT NULL,
+        movement_ts INTEGER NOT NULL,
+        tz_offset INTEGER NOT NULL DEFAULT 0,
+        movement_day TEXT GENERATED ALWAYS AS (date(movement_ts + tz_offset, 'unixepoch')) VIRTUAL,
+        kind TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        sale_id INTEGER,
+        note TEXT
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS stock_snapshots (
+        key_number INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        on_hand INTEGER NOT NULL,
+        PRIMARY KEY (key_number, day)
+    )
+    ''')
+    
+    # Receipt dates were never kept: the stock added so far opens the ledger
+    # at the product's first sale, followed by every sale still on record
+    now_ts, now_offset, _ = _sale_time()
+    cursor.execute('''
+    INSERT INTO stock_movements (key_number, movement_ts, tz_offset, kind, quantity, note)
+    SELECT p.key_number, IFNULL(f.sale_ts, ?), IFNULL(f.tz_offset, ?), 'opening', p.total_added,
+           'Stock added before the ledger'
+    FROM products p
+    LEFT JOIN (SELECT key_number, MIN(sale_ts) as sale_ts, tz_offset FROM sales GROUP BY key_number) f
+        ON p.key_number = f.key_number
+    ''', (now_ts, now_offset))
+    cursor.execute('''
+    INSERT INTO stock_movements (key_number, movement_ts, tz_offset, kind, quantity, sale_id)
+    SELECT key_number, sale_ts, tz_offset, 'sale', -quantity, id
+    FROM sales
+    ORDER BY sale_ts, id
+    ''')
+    
+    # Sold counts reset by clear_sales_history() or edited by hand
+    _reconcile_stock_ledger(cursor)
+
+def _migrate_sales_archives(cursor):
+    """Registry of the yearly sales archive files and the trigger guard flags"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sales_archives (
+        year INTEGER PRIMARY KEY,
+        file_name TEXT NOT NULL,
+        through_day TEXT NOT NULL,
+        sale_count INTEGER NOT NULL,
+        archived_at TEXT NOT NULL
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS maintenance_flags (
+        name TEXT PRIMARY KEY
+    )
+    ''')
+
+def _migrate_search_categories(cursor):
+    """Category keys and one-letter prefixes in the product search index"""
+    if not _table_exists(cursor, "product_search") or "category_key" in _column_names(cursor, "product_search"):
+        return
+    
+    # The index is derived data, refilled by _sync_derived_objects()
+    _drop_derived_objects(cursor)
+    cursor.execute("DROP TABLE product_search")
+    cursor.execute('''
+    CREATE VIRTUAL TABLE product_search USING fts5(
+        name,
+        category_name,
+        category_key,
+        tokenize = "unicode61 remove_diacritics 2 tokenchars '~'",
+        prefix = '1 2 3'
+    )
+    ''')
+    # Rank name matches well above category matches, category keys not at all
+    cursor.execute("INSERT INTO product_search (product_search, rank) VALUES ('rank', 'bm25(10.0, 1.0, 0.0)')")
+
+def _migrate_sales_indexes(cursor):
+    """Nothing to change in the tables: INDEXES is re-synced after the migrations"""
+
+def _drop_derived_objects(cursor):
+    """Drop every trigger and view"""
+    cursor.execute("SELECT type, name FROM sqlite_master WHERE type IN ('trigger', 'view')")
+    for object_type, name in cursor.fetchall():
+        cursor.execute(f"DROP {object_type.upper()} IF EXISTS {name}")
+
+def _sync_derived_objects(cursor):
+    """
+    Rebuild everything derived from the tables using the current definitions.
+    
+    Triggers, views and indexes are not created by the migrations themselves:
+    they follow the latest schema, so an old database would not have the
+    columns they refer to until its last migration has run. This is called
+    at the end of the migrations' transaction instead, and also recomputes
+    the rollup and the search index.
+    """
+    _drop_derived_objects(cursor)
+    cursor.execute(INVOICE_LINES_VIEW)
+    
+    for name, body in ROLLUP_TRIGGERS.items():
+        cursor.execute(f"CREATE TRIGGER {name} {body}")
+    _fill_sales_rollup(cursor)
+    
+    # Missing when SQLite was built without FTS5
+    if _table_exists(cursor, "product_search"):
+        for name, body in SEARCH_TRIGGERS.items():
+            cursor.execute(f"CREATE TRIGGER {name} {body}")
+        _fill_search_index(cursor)
+    
+    for name, body in STOCK_TRIGGERS.items():
+        cursor.execute(f"CREATE TRIGGER {name} {body}")
+    
+    _create_version_triggers(cursor)
+    _sync_indexes(cursor)
+
+# Ordered (version, description, migration) entries. Append new migrations
+# with the next version number; never reorder released ones or change the
+# tables they produce.
+MIGRATIONS = [
+    (1, "Creating base tables", _migrate_base_tables),
+    (2, "Moving product images to product_images", _migrate_product_images),
+    (3, "Grouping sales into invoices", _migrate_invoices),
+    (4, "Creating daily sales rollup", _migrate_sales_rollup),
+    (5, "Creating product search index", _migrate_search_index),
+    (6, "Adding table change counters", _migrate_table_versions),
+    (7, "Storing money as integer cents", _migrate_money_to_cents),
+    (8, "Storing sale times as timestamps", _migrate_sale_timestamps),
+    (9, "Adding the stock movement ledger", _migrate_stock_ledger),
+    (10, "Adding sales archives", _migrate_sales_archives),
+    (11, "Indexing product categories for search", _migrate_search_categories),
+    (12, "Trimming the sales indexes", _migrate_sales_indexes),
+]
+
+# Secondary indexes are not a migration step: INDEXES follows the latest
+# schema and _sync_derived_objects() rebuilds them after the migrations.
+
+# Version of the schema this code expects
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+class MigrationError(Exception):
+    """Raised when the schema could not be brought up to SCHEMA_VERSION"""
+
+def get_schema_version(conn):
+    """
+    Read the schema version recorded in a database.
+    
+    Args:
+        conn: Connection to the database
+        
     Returns:
-        list: List of category dictionaries
+        int: The value of PRAGMA user_version
     """
-    conn = get_connection()
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def _apply_migrations(conn):
+    """
+    Run every migration newer than the database in one transaction.
+    
+    Migrations drop the triggers and views they would break, and those can
+    only be rebuilt once the schema is current. Committing halfway would
+    leave a database without its rollup, search and version triggers, so a
+    failure rolls back the whole chain instead.
+    
+    Raises:
+        MigrationError: If a migration failed, the database is left unchanged
+    """
+    version = get_schema_version(conn)
+    if version > SCHEMA_VERSION:
+        print(f"Database schema version {version} is newer than this application ({SCHEMA_VERSION})")
+        return version
+    if version == SCHEMA_VERSION:
+        return version
+    
     cursor = conn.cursor()
+    target = version
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        for target, description, migrate in MIGRATIONS:
+            if target <= version:
+                continue
+            print(f"Migrating database: {description} (version {target})")
+            migrate(cursor)
+        _sync_derived_objects(cursor)
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        raise MigrationError(f"Migration to version {target} failed, "
+                             f"the database stays at version {version}: {e}") from e
+    
+    return SCHEMA_VERSION
+
+def migrate_database(db_path=None):
+    """
+    Bring a database up to SCHEMA_VERSION.
+    
+    A database that is already current costs a single PRAGMA read.
+    
+    Args:
+        db_path (str, optional): Database file to migrate instead of DB_PATH,
+            through a private connection
+        
+    Returns:
+        int: The schema version after migrating
+        
+    Raises:
+        MigrationError: If a migration failed
+    """
+    if db_path is None:
+        with write_connection() as conn:
+            return _apply_migrations(conn)
+    
+    conn = sqlite3.connect(db_path)
+    try:
+        return _apply_migrations(conn)
+    finally:
+        conn.close()
+
+def check_migrations(db_path=None):
+    """
+    Run the pending migrations against a temporary copy of a database.
+    
+    The original file is only read, so this is safe to try before upgrading.
     
-    cursor.execute("SELECT id, name, description FROM categories ORDER BY name")
+    Args:
+        db_path (str, optional): Database file to copy, DB_PATH by default
+        
+    Returns:
+        bool: True if the copy reached SCHEMA_VERSION
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        copy_path = os.path.join(temp_dir, "migration_check.db")
+        source = sqlite3.connect(db_path or DB_PATH)
+        target = sqlite3.connect(copy_path)
+        try:
+            source.backup(target)
+        finally:
+            source.close()
+            target.close()
+        
+        try:
+            return migrate_database(copy_path) == SCHEMA_VERSION
+        except MigrationError as e:
+            print(f"Migration check failed: {e}")
+            return False
+
+def create_database():
+    """
+    Create the database or bring its schema up to date.
     
-    categories = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    Raises:
+        MigrationError: If the schema could not be brought up to date, the
+            application must not run on the database then
+    """
+    migrate_database()
+
+def get_all_categories():
+    """
+    Retrieve all product categories.
     
-    return categories
+    Returns:
+        list: List of category dictionaries
+    """
+    return catalog_cache.categories()
 
 def get_category_by_id(category_id):
     """
@@ -204,45 +1743,41 @@ def get_category_by_id(category_id):
     Returns:
         dict: Category information or None if not found
     """
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT id, name, description FROM categories WHERE id = ?", (category_id,))
-    
-    row = cursor.fetchone()
-    conn.close()
-    
-    return dict(row) if row else None
+    return catalog_cache.category(category_id)
 
-def add_category(name, description=""):
+def add_category(name, description="", wait=True):
     """
     Add a new category.
     
     Args:
         name (str): Category name
         description (str): Category description
+        wait (bool): False to return a Future instead of waiting for the
+            commit, see flush_writes()
         
     Returns:
         int: New category ID or None if error
     """
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    try:
+    def write(cursor):
         cursor.execute(
             "INSERT INTO categories (name, description) VALUES (?, ?)",
             (name, description)
         )
-        conn.commit()
-        new_id = cursor.lastrowid
+        return cursor.lastrowid
+    
+    def finish(new_id):
+        catalog_cache.invalidate_categories()
         return new_id
-    except sqlite3.IntegrityError:
-        # Category name already exists
-        return None
-    finally:
-        conn.close()
+    
+    def fail(error):
+        if isinstance(error, sqlite3.IntegrityError):
+            # Category name already exists
+            return None
+        raise error
+    
+    return _queued_write(write, finish, fail, wait)
 
-def update_category(category_id, name, description):
+def update_category(category_id, name, description, wait=True):
     """
     Update an existing category.
     
@@ -250,47 +1785,50 @@ def update_category(category_id, name, description):
         category_id (int): The category ID to update
         name (str): New category name
         description (str): New category description
+        wait (bool): False to return a Future instead of waiting for the commit
         
     Returns:
         bool: True if successful, False otherwise
     """
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    try:
+    def write(cursor):
         cursor.execute(
             "UPDATE categories SET name = ?, description = ? WHERE id = ?",
             (name, description, category_id)
         )
-        conn.commit()
-        return cursor.rowcount > 0
-    except sqlite3.IntegrityError:
-        # Category name already exists
-        return False
-    finally:
-        conn.close()
+        return cursor.rowcount > 0 or None
+    
+    def finish(updated):
+        if not updated:
+            return False
+        catalog_cache.invalidate_categories()
+        # Products carry the category name
+        catalog_cache.invalidate_products()
+        return True
+    
+    def fail(error):
+        if isinstance(error, sqlite3.IntegrityError):
+            # Category name already exists
+            return False
+        raise error
+    
+    return _queued_write(write, finish, fail, wait)
 
-def delete_category(category_id):
+def delete_category(category_id, wait=True):
     """
     Delete a category, moving all products to the default category.
     
     Args:
         category_id (int): The category ID to delete
+        wait (bool): False to return a Future instead of waiting for the commit
         
     Returns:
         bool: True if successful
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    # Don't allow deleting the default category (ID 1)
+    if category_id == 1:
+        return False
     
-    try:
-        # Don't allow deleting the default category (ID 1)
-        if category_id == 1:
-            return False
-            
-        # Begin transaction
-        conn.execute("BEGIN TRANSACTION")
-        
+    def write(cursor):
         # Move all products in this category to the default category
         cursor.execute(
             "UPDATE products SET category_id = 1 WHERE category_id = ?",
@@ -299,66 +1837,82 @@ def delete_category(category_id):
         
         # Delete the category
         cursor.execute("DELETE FROM categories WHERE id = ?", (category_id,))
-        
-        conn.commit()
         return True
-    except Exception as e:
-        conn.rollback()
+    
+    def finish(deleted):
+        catalog_cache.invalidate_categories()
+        catalog_cache.invalidate_products()
+        return deleted
+    
+    def fail(e):
         print(f"Error deleting category: {e}")
         return False
-    finally:
-        conn.close()
+    
+    return _queued_write(write, finish, fail, wait)
 
-def add_product(key_number, name, purchase_price, sale_price, total_added, category_id=1, image_path=None, image_data=None):
+def add_product(key_number, name, purchase_price, sale_price, total_added, category_id=1, image_path=None, image_data=None,
+                thumbnails=None, wait=True):
     """
     Add a new product to the database.
     
     Args:
         key_number (int): Unique identifier for the product
         name (str): Name of the product
-        purchase_price (float): Price paid to wholesaler
-        sale_price (float): Price to be charged to customers
+        purchase_price (int): Price paid to wholesaler, in cents
+        sale_price (int): Price to be charged to customers, in cents
         total_added (int): Total quantity initially added
         category_id (int): Category ID the product belongs to
         image_path (str, optional): Path to the image file
-        image_data (str, optional): Base64 encoded image data
+        image_data (bytes, optional): Raw image file contents
+        thumbnails (dict, optional): Encoded thumbnails keyed by size name
+        wait (bool): False to return a Future instead of waiting for the
+            commit, see flush_writes()
         
     Returns:
         bool: True if successful, False if key_number already exists
     """
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    try:
+    def write(cursor):
         cursor.execute(
-            "INSERT INTO products (key_number, name, purchase_price, sale_price, total_added, category_id, image_path, image_data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-            (key_number, name, purchase_price, sale_price, total_added, category_id, image_path, image_data)
+            "INSERT INTO products (key_number, name, purchase_price, sale_price, total_added, category_id, image_path) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key_number, name, purchase_price, sale_price, total_added, category_id, image_path)
         )
-        conn.commit()
+        if total_added:
+            _record_stock_movement(cursor, key_number, "receipt", total_added, "Initial stock")
+        if image_data:
+            cursor.execute(
+                "INSERT OR REPLACE INTO product_images (key_number, image_data) VALUES (?, ?)",
+                (key_number, image_data)
+            )
+            _write_thumbnails(cursor, key_number, thumbnails)
         return True
-    except sqlite3.IntegrityError:
-        # Key number already exists
-        return False
-    finally:
-        conn.close()
+    
+    def finish(added):
+        catalog_cache.invalidate_products([key_number])
+        return added
+    
+    def fail(error):
+        if isinstance(error, sqlite3.IntegrityError):
+            # Key number already exists
+            return False
+        raise error
+    
+    return _queued_write(write, finish, fail, wait)
 
-def update_product(key_number, name=None, purchase_price=None, sale_price=None, category_id=None):
+def update_product(key_number, name=None, purchase_price=None, sale_price=None, category_id=None, wait=True):
     """
     Update an existing product's details.
     
     Args:
         key_number (int): The key number of the product to update
         name (str, optional): New product name
-        purchase_price (float, optional): New purchase price
-        sale_price (float, optional): New sale price
+        purchase_price (int, optional): New purchase price in cents
+        sale_price (int, optional): New sale price in cents
         category_id (int, optional): New category ID
+        wait (bool): False to return a Future instead of waiting for the commit
         
     Returns:
         bool: True if successful, False if product not found
     """
-    conn = get_connection()
-    cursor = conn.cursor()
-    
     # Build update query dynamically based on provided parameters
     query_parts = []
     params = []
@@ -386,160 +1940,325 @@ def update_product(key_number, name=None, purchase_price=None, sale_price=None,
     query = f"UPDATE products SET {', '.join(query_parts)} WHERE key_number = ?"
     params.append(key_number)
     
-    try:
+    def write(cursor):
         cursor.execute(query, params)
-        conn.commit()
-        return cursor.rowcount > 0
-    except Exception as e:
+        return cursor.rowcount > 0 or None
+    
+    def finish(updated):
+        if not updated:
+            return False
+        catalog_cache.invalidate_products([key_number])
+        return True
+    
+    def fail(e):
         print(f"Error updating product: {e}")
         return False
-    finally:
-        conn.close()
+    
+    return _queued_write(write, finish, fail, wait)
+
+def get_all_products():
+    """
+    Retrieve all products from the database.
+    
+    Returns:
+        list: List of product dictionaries
+    """
+    return catalog_cache.products()
+
+def get_products_by_category(category_id):
+    """
+    Retrieve all products in a specific category.
+    
+    Args:
+        category_id (int): The category ID to filter by
+        
+    Returns:
+        list: List of product dictionaries
+    """
+    return catalog_cache.products(category_id)
+
+def get_product_by_key(key_number):
+    """
+    Retrieve a product by its key number.
+    
+    Args:
+        key_number (int): The key number to search for
+        
+    Returns:
+        dict: Product information or None if not found
+    """
+    return catalog_cache.product(key_number)
+
+def _search_match_expression(search_term, category_id=None):
+    """
+    Build an FTS5 query matching every word of the search term as a prefix.
+    
+    Args:
+        search_term (str): The search term
+        category_id (int, optional): Only match products in this category
+        
+    Returns:
+        str: MATCH expression or None if the term has no searchable words
+    """
+    words = re.findall(r"\w+", search_term)
+    if not words:
+        return None
+    match = " ".join(f'"{word}"*' for word in words)
+    if category_id is not None:
+        match = f'"~{int(category_id)}" {match}'
+    return match
+
+# Searches matching more products than this skip relevance ranking and list
+# matches by key number, since scoring every match costs more than it helps
+RANKED_SEARCH_MAX = 200
+
+# bm25 parameters and column weights of the relevance ranking, as in the
+# index's rank option: a word in the name counts ten times one in the category
+BM25_K1 = 1.2
+BM25_B = 0.75
+NAME_WEIGHT = 10.0
+CATEGORY_WEIGHT = 1.0
+
+_SEARCH_WORD = re.compile(r"[^\W_]+")
+
+def _search_words(text):
+    """Split text into lowercase words without diacritics, as the search index does"""
+    if not text.isascii():
+        text = "".join(ch for ch in unicodedata.normalize("NFKD", text) if not unicodedata.combining(ch))
+    return _SEARCH_WORD.findall(text.casefold())
 
-def get_all_products():
+def _rank_matches(products, words):
     """
-    Retrieve all products from the database.
+    Sort the products matching every search word by relevance, best first.
     
+    The score is the index's bm25 without the weight of each word by its
+    rarity, which costs a pass over every row containing the word.
+    
+    Args:
+        products (list): Products matching all words
+        words (list): Search words, each matching as a prefix
+        
     Returns:
-        list: List of product dictionaries
+        list: Key numbers, ties in key number order
     """
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-    SELECT p.key_number, p.name, p.purchase_price, p.sale_price, p.total_added, p.sold, 
-           (p.total_added - p.sold) as remaining, p.image_path, p.image_data, p.category_id,
-           c.name as category_name
-    FROM products p
-    JOIN categories c ON p.category_id = c.id
-    ORDER BY p.key_number
-    """)
+    documents = []
+    categories = {}
+    for product in products:
+        name = _search_words(product["name"])
+        category_name = product["category_name"] or ""
+        if category_name not in categories:
+            categories[category_name] = _search_words(category_name)
+        category = categories[category_name]
+        # The category key token counts towards the length too. Joined with a
+        # leading space, " " + word counts the tokens starting with the word.
+        length = len(name) + len(category) + 1
+        documents.append((product["key_number"], " " + " ".join(name), " " + " ".join(category), length))
+    if not documents:
+        return []
+    average_length = sum(document[3] for document in documents) / len(documents)
+    
+    scores = {}
+    for key_number, name, category, length in documents:
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+        score = 0.0
+        for word in words:
+            prefix = " " + word
+            frequency = NAME_WEIGHT * name.count(prefix) + CATEGORY_WEIGHT * category.count(prefix)
+            score += frequency * (BM25_K1 + 1) / (frequency + norm)
+        scores[key_number] = score
+    return sorted(scores, key=lambda key_number: (-scores[key_number], key_number))
+
+def _search_keys(cursor, match, words, limit):
+    """
+    Find the key numbers of the products matching an FTS5 expression.
     
-    products = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    The first RANKED_SEARCH_MAX + 1 matches are read in key number order,
+    which stops early. When that finds them all they are ranked from the
+    catalog cache.
     
-    return products
+    Raises:
+        sqlite3.OperationalError: If there is no FTS5 index
+    """
+    cursor.execute("SELECT rowid FROM product_search WHERE product_search MATCH ? LIMIT ?",
+                   (match, RANKED_SEARCH_MAX + 1))
+    keys = [row[0] for row in cursor.fetchall()]
+    if len(keys) <= RANKED_SEARCH_MAX:
+        keys = _rank_matches(catalog_cache.products_by_key(keys), words)
+    elif limit is None or limit > len(keys):
+        cursor.execute("SELECT rowid FROM product_search WHERE product_search MATCH ? ORDER BY rowid LIMIT ?",
+                       (match, -1 if limit is None else limit))
+        keys = [row[0] for row in cursor.fetchall()]
+    return keys if limit is None else keys[:limit]
 
-def get_products_by_category(category_id):
+def search_products(search_term, limit=None, category_id=None):
     """
-    Retrieve all products in a specific category.
+    Search for products by key number, name or category name.
+    
+    Words in the search term match as prefixes, and results are ranked by
+    relevance with an exact key number match first. The index supplies the
+    key numbers and the rows come from the catalog cache.
     
     Args:
-        category_id (int): The category ID to filter by
+        search_term (str): The search term
+        limit (int, optional): Maximum number of results, best matches first
+        category_id (int, optional): Only products in this category
         
     Returns:
-        list: List of product dictionaries
+        list: Matching products
     """
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-    SELECT p.key_number, p.name, p.purchase_price, p.sale_price, p.total_added, p.sold, 
-           (p.total_added - p.sold) as remaining, p.image_path, p.image_data, p.category_id,
-           c.name as category_name
-    FROM products p
-    JOIN categories c ON p.category_id = c.id
-    WHERE p.category_id = ?
-    ORDER BY p.key_number
-    """, (category_id,))
+    # Try to convert search term to integer for key number search
+    try:
+        key_number = int(search_term)
+    except ValueError:
+        key_number = None  # No match possible for key if not an integer
     
-    products = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    match = _search_match_expression(search_term, category_id)
+    if match is None and key_number is None:
+        return []
     
-    return products
+    keys = [key_number] if key_number is not None else []
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            if match is not None:
+                keys += _search_keys(cursor, match, _search_words(search_term), limit)
+        except sqlite3.OperationalError:
+            # No FTS5 index, fall back to a substring scan
+            where = "WHERE name LIKE ?"
+            params = [f"%{search_term}%"]
+            if category_id is not None:
+                where += " AND category_id = ?"
+                params.append(category_id)
+            cursor.execute(f"SELECT key_number FROM products {where} ORDER BY key_number LIMIT ?",
+                           params + [-1 if limit is None else limit])
+            keys += [row[0] for row in cursor.fetchall()]
+    
+    # The key number match may have matched by name as well
+    products = catalog_cache.products_by_key(dict.fromkeys(keys))
+    if category_id is not None and key_number is not None:
+        products = [product for product in products if product["category_id"] == category_id]
+    return products if limit is None else products[:limit]
 
-def get_product_by_key(key_number):
+def update_product_image(key_number, image_path=None, image_data=None, thumbnails=None, wait=True):
     """
-    Retrieve a product by its key number.
+    Update the image for a product.
     
     Args:
-        key_number (int): The key number to search for
+        key_number (int): The key number of the product
+        image_path (str, optional): Path to the product image
+        image_data (bytes, optional): Raw image file contents, None removes the image
+        thumbnails (dict, optional): Encoded thumbnails of the new image keyed by size name
+        wait (bool): False to return a Future instead of waiting for the commit
         
     Returns:
-        dict: Product information or None if not found
+        bool: True if successful, False if product not found
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    def write(cursor):
+        cursor.execute(
+            "UPDATE products SET image_path = ? WHERE key_number = ?",
+            (image_path, key_number)
+        )
+        # Check if any row was updated
+        if cursor.rowcount == 0:
+            return None
+        
+        # Thumbnails of the previous image are stale either way
+        cursor.execute("DELETE FROM product_thumbnails WHERE key_number = ?", (key_number,))
+        if image_data:
+            cursor.execute(
+                "INSERT OR REPLACE INTO product_images (key_number, image_data) VALUES (?, ?)",
+                (key_number, image_data)
+            )
+            _write_thumbnails(cursor, key_number, thumbnails)
+        else:
+            cursor.execute("DELETE FROM product_images WHERE key_number = ?", (key_number,))
+        return True
     
-    cursor.execute("""
-    SELECT p.key_number, p.name, p.purchase_price, p.sale_price, p.total_added, p.sold, 
-           (p.total_added - p.sold) as remaining, p.image_path, p.image_data, p.category_id,
-           c.name as category_name
-    FROM products p
-    JOIN categories c ON p.category_id = c.id
-    WHERE p.key_number = ?
-    """, (key_number,))
+    def finish(updated):
+        if not updated:
+            return False
+        catalog_cache.invalidate_products([key_number])
+        return True
     
-    row = cursor.fetchone()
-    conn.close()
+    def fail(e):
+        print(f"Error updating product image: {e}")
+        return False
     
-    return dict(row) if row else None
+    return _queued_write(write, finish, fail, wait)
 
-def search_products(search_term):
+def get_product_image(key_number):
     """
-    Search for products by key number or name.
+    Retrieve the stored image of a product.
     
     Args:
-        search_term (str): The search term
+        key_number (int): The key number of the product
         
     Returns:
-        list: Matching products
+        bytes: Raw image file contents or None if the product has no image
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    with read_connection() as conn:
+        cursor = conn.cursor()
     
-    # Try to convert search term to integer for key number search
-    try:
-        key_number = int(search_term)
-        key_search = f"p.key_number = {key_number}"
-    except ValueError:
-        key_search = "0"  # No match possible for key if not an integer
+        cursor.execute("SELECT image_data FROM product_images WHERE key_number = ?", (key_number,))
     
-    cursor.execute(f"""
-    SELECT p.key_number, p.name, p.purchase_price, p.sale_price, p.total_added, p.sold, 
-           (p.total_added - p.sold) as remaining, p.image_path, p.image_data, p.category_id,
-           c.name as category_name
-    FROM products p
-    JOIN categories c ON p.category_id = c.id
-    WHERE {key_search} OR p.name LIKE ?
-    ORDER BY p.key_number
-    """, (f"%{search_term}%",))
+        row = cursor.fetchone()
+    
+        return row["image_data"] if row else None
+
+def _write_thumbnails(cursor, key_number, thumbnails):
+    """Store encoded thumbnails for a product inside the caller's transaction"""
+    if thumbnails:
+        cursor.executemany(
+            "INSERT OR REPLACE INTO product_thumbnails (key_number, size, image_data) VALUES (?, ?, ?)",
+            [(key_number, size, data) for size, data in thumbnails.items()]
+        )
+
+def save_product_thumbnails(key_number, thumbnails, wait=True):
+    """
+    Store pre-scaled thumbnails for a product's current image.
+    
+    Args:
+        key_number (int): The key number of the product
+        thumbnails (dict): Encoded thumbnail bytes keyed by size name
+        wait (bool): False to return a Future instead of waiting for the commit
+        
+    Returns:
+        bool: True if successful
+    """
+    def write(cursor):
+        _write_thumbnails(cursor, key_number, thumbnails)
+        return True
     
-    products = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    def fail(e):
+        print(f"Error saving product thumbnails: {e}")
+        return False
     
-    return products
+    return _queued_write(write, None, fail, wait)
 
-def update_product_image(key_number, image_path=None, image_data=None):
+def get_product_thumbnail(key_number, size):
     """
-    Update the image for a product.
+    Retrieve a pre-scaled thumbnail of a product image.
     
     Args:
         key_number (int): The key number of the product
-        image_path (str, optional): Path to the product image
-        image_data (str, optional): Base64 encoded image data
+        size (str): Thumbnail size name
         
     Returns:
-        bool: True if successful, False if product not found
+        bytes: Encoded thumbnail or None if it has not been generated
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    with read_connection() as conn:
+        cursor = conn.cursor()
     
-    try:
         cursor.execute(
-            "UPDATE products SET image_path = ?, image_data = ? WHERE key_number = ?",
-            (image_path, image_data, key_number)
+            "SELECT image_data FROM product_thumbnails WHERE key_number = ? AND size = ?",
+            (key_number, size)
         )
-        conn.commit()
-        # Check if any row was updated
-        return cursor.rowcount > 0
-    except Exception as e:
-        print(f"Error updating product image: {e}")
-        return False
-    finally:
-        conn.close()
+    
+        row = cursor.fetchone()
+    
+        return row["image_data"] if row else None
 
-def add_customer(name, phone=None, email=None, address=None):
+def add_customer(name, phone=None, email=None, address=None, wait=True):
     """
     Add a new customer to the database.
     
@@ -548,46 +2267,26 @@ def add_customer(name, phone=None, email=None, address=None):
         phone (str, optional): Customer phone number
         email (str, optional): Customer email address
         address (str, optional): Customer address
+        wait (bool): False to return a Future instead of waiting for the commit
         
     Returns:
         int: New customer ID or None if error
     """
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    # Make sure the customers table exists
-    try:
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS customers (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            phone TEXT,
-            email TEXT,
-            address TEXT,
-            created_at TEXT
-        )
-        ''')
-        conn.commit()
-    except Exception as e:
-        print(f"Error ensuring customers table exists: {e}")
+    created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     
-    try:
-        created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        print(f"Adding customer: {name}, {phone}, {email}, {address}, {created_at}")
+    def write(cursor):
+        # The customers table is created by the database migrations
         cursor.execute(
             "INSERT INTO customers (name, phone, email, address, created_at) VALUES (?, ?, ?, ?, ?)",
             (name, phone, email, address, created_at)
         )
-        conn.commit()
-        new_id = cursor.lastrowid
-        print(f"Added customer with ID: {new_id}")
-        return new_id
-    except Exception as e:
+        return cursor.lastrowid
+    
+    def fail(e):
         print(f"Error adding customer: {e}")
-        conn.rollback()
         return None
-    finally:
-        conn.close()
+    
+    return _queued_write(write, None, fail, wait)
 
 def get_customer_by_id(customer_id):
     """
@@ -599,15 +2298,14 @@ def get_customer_by_id(customer_id):
     Returns:
         dict: Customer information or None if not found
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    with read_connection() as conn:
+        cursor = conn.cursor()
     
-    cursor.execute("SELECT id, name, phone, email, address, created_at FROM customers WHERE id = ?", (customer_id,))
+        cursor.execute("SELECT id, name, phone, email, address, created_at FROM customers WHERE id = ?", (customer_id,))
     
-    row = cursor.fetchone()
-    conn.close()
+        row = cursor.fetchone()
     
-    return dict(row) if row else None
+        return dict(row) if row else None
 
 def get_all_customers():
     """
@@ -616,15 +2314,14 @@ def get_all_customers():
     Returns:
         list: List of customer dictionaries
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    with read_connection() as conn:
+        cursor = conn.cursor()
     
-    cursor.execute("SELECT id, name, phone, email, address, created_at FROM customers ORDER BY name")
+        cursor.execute("SELECT id, name, phone, email, address, created_at FROM customers ORDER BY name")
     
-    customers = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+        customers = [dict(row) for row in cursor.fetchall()]
     
-    return customers
+        return customers
 
 def search_customers(search_term):
     """
@@ -636,110 +2333,422 @@ def search_customers(search_term):
     Returns:
         list: Matching customers
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    with read_connection() as conn:
+        cursor = conn.cursor()
     
-    cursor.execute("""
-    SELECT id, name, phone, email, address, created_at 
-    FROM customers
-    WHERE name LIKE ? OR phone LIKE ?
-    ORDER BY name
-    """, (f"%{search_term}%", f"%{search_term}%"))
+        cursor.execute("""
+        SELECT id, name, phone, email, address, created_at 
+        FROM customers
+        WHERE name LIKE ? OR phone LIKE ?
+        ORDER BY name
+        """, (f"%{search_term}%", f"%{search_term}%"))
+    
+        customers = [dict(row) for row in cursor.fetchall()]
     
-    customers = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+        return customers
+
+# When each sale happened, pre-split for display: epoch seconds, the local
+# day "YYYY-MM-DD" and the local time "HH:MM:SS"
+_SALE_TIME_COLUMNS = "s.sale_ts, s.sale_day, time(s.sale_ts + s.tz_offset, 'unixepoch') as sale_time"
+
+def _sale_time():
+    """
+    Timestamp a new sale.
     
-    return customers
+    Returns:
+        tuple: Epoch seconds, the local UTC offset in seconds and the local
+        time as "YYYY-MM-DD HH:MM:SS" for the invoice
+    """
+    now = datetime.now().astimezone()
+    return int(now.timestamp()), int(now.utcoffset().total_seconds()), now.strftime("%Y-%m-%d %H:%M:%S")
+
+def _record_stock_movement(cursor, key_number, kind, quantity, note=None):
+    """Append a stock movement dated now, inside the caller's transaction"""
+    movement_ts, tz_offset, _ = _sale_time()
+    cursor.execute(
+        "INSERT INTO stock_movements (key_number, movement_ts, tz_offset, kind, quantity, note) VALUES (?, ?, ?, ?, ?, ?)",
+        (key_number, movement_ts, tz_offset, kind, quantity, note)
+    )
 
-def record_sale(key_number, quantity, sale_price, customer_id=None):
+def record_sale(key_number, quantity, sale_price, customer_id=None, wait=True):
     """
     Record a sale in the database and update inventory.
     
+    Stock is taken with a single UPDATE that only matches while enough is
+    left, so concurrent checkouts can't oversell. The sale is committed
+    through the write queue, with the other writes arriving at the same time.
+    
     Args:
         key_number (int): Product key number
         quantity (int): Quantity sold
-        sale_price (float): Price per unit
+        sale_price (int): Price per unit in cents
         customer_id (int, optional): Customer ID for this sale
+        wait (bool): False to return a Future instead of waiting for the
+            commit, see flush_writes()
         
     Returns:
         int: Sale ID if successful, None otherwise
     """
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    try:
-        # Start a transaction
-        conn.execute("BEGIN TRANSACTION")
-        
-        # Get product details
-        cursor.execute("SELECT purchase_price, (total_added - sold) as remaining FROM products WHERE key_number = ?", 
-                      (key_number,))
-        product = cursor.fetchone()
-        
-        if not product or product["remaining"] < quantity:
-            conn.rollback()
+    def write(cursor):
+        cursor.execute(
+            "UPDATE products SET sold = sold + ? WHERE key_number = ? AND total_added - sold >= ?",
+            (quantity, key_number, quantity)
+        )
+        if cursor.rowcount == 0:
+            # Unknown product or not enough stock
             return None
         
-        # Calculate profit
-        purchase_price = product["purchase_price"]
-        profit = (sale_price - purchase_price) * quantity
-        sale_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        cursor.execute("SELECT purchase_price FROM products WHERE key_number = ?", (key_number,))
+        profit = (sale_price - cursor.fetchone()["purchase_price"]) * quantity
+        sale_ts, tz_offset, invoice_date = _sale_time()
+        
+        # Every sale belongs to an invoice, here a single-line one
+        cursor.execute(
+            "INSERT INTO invoices (customer_id, invoice_date) VALUES (?, ?)",
+            (customer_id or None, invoice_date)
+        )
+        invoice_id = cursor.lastrowid
         
         # Record the sale
-        if customer_id:
-            cursor.execute(
-                "INSERT INTO sales (key_number, quantity, sale_price, sale_date, profit, customer_id) VALUES (?, ?, ?, ?, ?, ?)",
-                (key_number, quantity, sale_price, sale_date, profit, customer_id)
-            )
-        else:
-            cursor.execute(
-                "INSERT INTO sales (key_number, quantity, sale_price, sale_date, profit) VALUES (?, ?, ?, ?, ?)",
-                (key_number, quantity, sale_price, sale_date, profit)
-            )
+        cursor.execute(
+            "INSERT INTO sales (key_number, quantity, sale_price, sale_ts, tz_offset, profit, customer_id, invoice_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (key_number, quantity, sale_price, sale_ts, tz_offset, profit, customer_id or None, invoice_id)
+        )
+        return cursor.lastrowid
+    
+    def finish(sale_id):
+        if sale_id is not None:
+            catalog_cache.invalidate_products([key_number])
+        return sale_id
+    
+    def fail(e):
+        print(f"Error recording sale: {e}")
+        return None
+    
+    return _queued_write(write, finish, fail, wait)
+
+def record_cart_sale(items, customer_id=None, wait=True):
+    """
+    Record every line of a cart as one invoice in a single transaction.
+    
+    Stock is taken for all lines with guarded UPDATEs before the sales are
+    written, so the cart is either recorded completely or not at all. The
+    invoice is committed through the write queue.
+    
+    Args:
+        items (list): Dicts with key_number, quantity and price (cents) for each line
+        customer_id (int, optional): Customer ID for this sale
+        wait (bool): False to return a Future instead of waiting for the commit
         
-        sale_id = cursor.lastrowid
+    Returns:
+        int: Invoice ID if successful, None otherwise
+    """
+    if not items:
+        return None
+    
+    # The same product may appear on several lines
+    requested = {}
+    for item in items:
+        requested[item["key_number"]] = requested.get(item["key_number"], 0) + item["quantity"]
+    
+    def write(cursor):
+        cursor.executemany(
+            "UPDATE products SET sold = sold + ? WHERE key_number = ? AND total_added - sold >= ?",
+            [(quantity, key_number, quantity) for key_number, quantity in requested.items()]
+        )
+        if cursor.rowcount != len(requested):
+            # A product is unknown or short, the stock taken so far is rolled back
+            return None
         
-        # Update the inventory
+        placeholders = ", ".join("?" * len(requested))
         cursor.execute(
-            "UPDATE products SET sold = sold + ? WHERE key_number = ?",
-            (quantity, key_number)
+            f"SELECT key_number, purchase_price FROM products WHERE key_number IN ({placeholders})",
+            list(requested)
         )
+        purchase_prices = {row["key_number"]: row["purchase_price"] for row in cursor.fetchall()}
         
-        conn.commit()
-        return sale_id
-    except Exception as e:
-        conn.rollback()
-        print(f"Error recording sale: {e}")
+        sale_ts, tz_offset, invoice_date = _sale_time()
+        cursor.execute(
+            "INSERT INTO invoices (customer_id, invoice_date) VALUES (?, ?)",
+            (customer_id or None, invoice_date)
+        )
+        invoice_id = cursor.lastrowid
+        
+        cursor.executemany(
+            "INSERT INTO sales (key_number, quantity, sale_price, sale_ts, tz_offset, profit, customer_id, invoice_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(item["key_number"], item["quantity"], item["price"], sale_ts, tz_offset,
+              (item["price"] - purchase_prices[item["key_number"]]) * item["quantity"],
+              customer_id or None, invoice_id)
+             for item in items]
+        )
+        return invoice_id
+    
+    def finish(invoice_id):
+        if invoice_id is not None:
+            catalog_cache.invalidate_products(requested)
+        return invoice_id
+    
+    def fail(e):
+        print(f"Error recording cart sale: {e}")
         return None
+    
+    return _queued_write(write, finish, fail, wait)
+
+# Sales older than this many days are moved out by archive_sales()
+ARCHIVE_AFTER_DAYS = 730
+
+# Stored columns of the sales table, sale_day is generated from them
+_SALES_STORED_COLUMNS = "id, key_number, quantity, sale_price, sale_ts, tz_offset, profit, customer_id, invoice_id"
+
+def get_archive_dir(db_path=None):
+    """
+    Get the folder holding the yearly sales archives of a database.
+    
+    Returns:
+        str: The "archive" folder next to the database file
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(db_path or DB_PATH)), "archive")
+
+def _archived_through(cursor):
+    """Last day moved to an archive, "" if nothing was archived"""
+    if not _table_exists(cursor, "sales_archives"):
+        return ""
+    cursor.execute("SELECT IFNULL(MAX(through_day), '') FROM sales_archives")
+    return cursor.fetchone()[0]
+
+@contextmanager
+def _attached_archives(conn, start=None, end=None):
+    """
+    Attach the archives holding sales between two days for the duration of a block.
+    
+    Must be entered outside a transaction. On read connections, which are
+    query_only, the archives can only be read.
+    
+    Args:
+        conn: Connection to attach them to
+        start (str, optional): First day needed, "YYYY-MM-DD"
+        end (str, optional): Last day needed, "YYYY-MM-DD"
+        
+    Yields:
+        list: (schema name, through_day) of every attached archive
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+    SELECT year, file_name, through_day FROM sales_archives
+    WHERE through_day >= ? AND year <= ?
+    ORDER BY year DESC
+    """, (start or "", int(end[:4]) if end else 9999))
+    archives = cursor.fetchall()
+    
+    # SQLite limits how many databases one connection can attach
+    limit = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    if len(archives) > limit:
+        print(f"Error attaching sales archives: only the newest {limit} of {len(archives)} can be read at once")
+        archives = archives[:limit]
+    
+    attached = []
+    try:
+        for year, file_name, through_day in archives:
+            path = os.path.join(get_archive_dir(), file_name)
+            if not os.path.exists(path):
+                print(f"Error attaching sales archive: {path} is missing")
+                continue
+            schema = f"archive_{int(year)}"
+            cursor.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+            attached.append((schema, through_day))
+        yield attached
     finally:
-        conn.close()
+        for schema, _ in attached:
+            conn.execute(f"DETACH DATABASE {schema}")
 
-def get_sales_history():
+def _sales_source(archives):
     """
-    Retrieve all sales history.
+    FROM clause source for the sales, including attached archives.
     
+    Args:
+        archives (list): What _attached_archives() yielded
+        
     Returns:
-        list: List of sales records
+        str: "sales", or a UNION ALL subquery with the same columns plus
+        archived (1 for rows read from an archive)
     """
-    conn = get_connection()
+    if not archives:
+        return "sales"
+    
+    columns = f"{_SALES_STORED_COLUMNS}, sale_day"
+    # An archive only counts up to its registered day: rows past it were
+    # copied by an archiving run that did not finish removing them here
+    parts = [f"SELECT {columns}, 0 AS archived FROM sales"]
+    parts += [f"SELECT {columns}, 1 AS archived FROM {schema}.sales WHERE sale_day <= '{through_day}'"
+              for schema, through_day in archives]
+    return f"({' UNION ALL '.join(parts)})"
+
+def _include_archives(include_archive, start):
+    """Whether a sales query reads the archives, see query_sales()"""
+    if include_archive is None:
+        return bool(start)
+    return include_archive
+
+def _archive_year(conn, year, through_day):
+    """
+    Move the sales of one year up to through_day into its archive file.
+    
+    The rows are first copied and committed in the archive, then removed
+    here in a second transaction that also records the archive. If the
+    second step never happens, the copies are ignored until a later run
+    finishes the job.
+    
+    Returns:
+        int: Number of sales moved
+    """
+    file_name = f"{os.path.splitext(os.path.basename(DB_PATH))[0]}-sales-{year}.db"
+    path = os.path.join(get_archive_dir(), file_name)
+    os.makedirs(get_archive_dir(), exist_ok=True)
+    first_day = f"{year}-01-01"
+    
     cursor = conn.cursor()
+    cursor.execute("ATTACH DATABASE ? AS archive_target", (path,))
+    try:
+        # A deferred transaction only locks the archive for writing
+        conn.execute("BEGIN")
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archive_target.invoices (
+            id INTEGER PRIMARY KEY,
+            customer_id INTEGER,
+            invoice_date TEXT NOT NULL
+        )
+        ''')
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archive_target.sales (
+            id INTEGER PRIMARY KEY,
+            key_number INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            sale_price INTEGER NOT NULL,
+            sale_ts INTEGER NOT NULL,
+            tz_offset INTEGER NOT NULL DEFAULT 0,
+            sale_day TEXT GENERATED ALWAYS AS (date(sale_ts + tz_offset, 'unixepoch')) VIRTUAL,
+            profit INTEGER NOT NULL,
+            customer_id INTEGER,
+            invoice_id INTEGER
+        )
+        ''')
+        for name, definition in INDEXES.items():
+            if definition.startswith("sales ("):
+                cursor.execute(f"CREATE INDEX IF NOT EXISTS archive_target.{name} ON {definition}")
+        
+        cursor.execute('''
+        INSERT OR IGNORE INTO archive_target.invoices (id, customer_id, invoice_date)
+        SELECT id, customer_id, invoice_date FROM invoices
+        WHERE id IN (SELECT invoice_id FROM sales WHERE sale_day >= ? AND sale_day <= ?)
+        ''', (first_day, through_day))
+        cursor.execute(f'''
+        INSERT OR IGNORE INTO archive_target.sales ({_SALES_STORED_COLUMNS})
+        SELECT {_SALES_STORED_COLUMNS} FROM sales WHERE sale_day >= ? AND sale_day <= ?
+        ''', (first_day, through_day))
+        conn.commit()
+        
+        conn.execute("BEGIN IMMEDIATE")
+        # The rollup rows and stock movements of these sales stay
+        cursor.execute("INSERT OR IGNORE INTO maintenance_flags (name) VALUES ('archiving')")
+        cursor.execute("DELETE FROM sales WHERE sale_day >= ? AND sale_day <= ?", (first_day, through_day))
+        moved = cursor.rowcount
+        cursor.execute('''
+        DELETE FROM invoices
+        WHERE id IN (SELECT id FROM archive_target.invoices)
+          AND NOT EXISTS (SELECT 1 FROM sales WHERE sales.invoice_id = invoices.id)
+        ''')
+        cursor.execute("DELETE FROM maintenance_flags WHERE name = 'archiving'")
+        cursor.execute('''
+        INSERT INTO sales_archives (year, file_name, through_day, sale_count, archived_at)
+        VALUES (?, ?, ?, (SELECT COUNT(*) FROM archive_target.sales), ?)
+        ON CONFLICT (year) DO UPDATE SET
+            through_day = MAX(through_day, excluded.through_day),
+            sale_count = excluded.sale_count,
+            archived_at = excluded.archived_at
+        ''', (year, file_name, through_day, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        conn.commit()
+        return moved
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute("DETACH DATABASE archive_target")
+
+def archive_sales(before=None):
+    """
+    Move old sales and their invoices into yearly archive files.
     
-    cursor.execute("""
-    SELECT s.id, s.key_number, p.name, p.category_id, c.name as category_name,
-           s.quantity, s.sale_price, s.sale_date, s.profit, p.purchase_price,
-           s.customer_id, IFNULL(cust.name, 'Walk-in Customer') as customer_name,
-           IFNULL(cust.phone, '') as customer_phone
-    FROM sales s
-    JOIN products p ON s.key_number = p.key_number
-    JOIN categories c ON p.category_id = c.id
-    LEFT JOIN customers cust ON s.customer_id = cust.id
-    ORDER BY s.sale_date DESC
-    """)
+    Each year goes to its own database in the archive folder, so the sales
+    table that checkout and the default views read stays small. Reports on
+    the daily rollup keep covering archived days, and sales queries read the
+    archives when asked to (see query_sales()). Archived sales can no longer
+    be deleted.
+    
+    Args:
+        before (str, optional): Archive the sales of days before this one,
+            "YYYY-MM-DD". Defaults to ARCHIVE_AFTER_DAYS ago.
+        
+    Returns:
+        dict: Number of sales moved per year
+    """
+    if before is None:
+        before = (datetime.now().date() - timedelta(days=ARCHIVE_AFTER_DAYS)).isoformat()
+    last_day = (datetime.strptime(before, "%Y-%m-%d").date() - timedelta(days=1)).isoformat()
+    
+    moved = {}
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT DISTINCT substr(sale_day, 1, 4) FROM sales WHERE sale_day < ?", (before,))
+            years = sorted(int(row[0]) for row in cursor.fetchall())
+            
+            for year in years:
+                moved[year] = _archive_year(conn, year, min(f"{year}-12-31", last_day))
+        except Exception as e:
+            print(f"Error archiving sales: {e}")
+    
+    if moved:
+        catalog_cache.invalidate_products()
+    return moved
+
+def get_sales_archives():
+    """
+    List the sales archives.
     
-    sales = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    Returns:
+        list: Archive dictionaries with year, file_name, through_day,
+        sale_count and archived_at, oldest first
+    """
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT year, file_name, through_day, sale_count, archived_at FROM sales_archives ORDER BY year")
+        return [dict(row) for row in cursor.fetchall()]
+
+def get_sales_history():
+    """
+    Retrieve all sales history.
     
-    return sales
+    Returns:
+        list: List of sales records
+    """
+    with read_connection() as conn:
+        cursor = conn.cursor()
+    
+        cursor.execute(f"""
+        SELECT s.id, s.key_number, p.name, p.category_id, c.name as category_name,
+               s.quantity, s.sale_price, {_SALE_TIME_COLUMNS}, s.profit, p.purchase_price,
+               s.customer_id, IFNULL(cust.name, 'Walk-in Customer') as customer_name,
+               IFNULL(cust.phone, '') as customer_phone
+        FROM sales s
+        JOIN products p ON s.key_number = p.key_number
+        JOIN categories c ON p.category_id = c.id
+        LEFT JOIN customers cust ON s.customer_id = cust.id
+        ORDER BY s.sale_day DESC, s.sale_ts DESC
+        """)
+    
+        sales = [dict(row) for row in cursor.fetchall()]
+    
+        return sales
 
 def get_sales_by_customer(customer_id):
     """
@@ -751,95 +2760,150 @@ def get_sales_by_customer(customer_id):
     Returns:
         list: List of sales records for the customer
     """
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-    SELECT s.id, s.key_number, p.name, p.category_id, c.name as category_name,
-           s.quantity, s.sale_price, s.sale_date, s.profit, p.purchase_price,
-           s.customer_id, cust.name as customer_name, cust.phone as customer_phone
-    FROM sales s
+    with read_connection() as conn:
+        cursor = conn.cursor()
+    
+        cursor.execute(f"""
+        SELECT s.id, s.key_number, p.name, p.category_id, c.name as category_name,
+               s.quantity, s.sale_price, {_SALE_TIME_COLUMNS}, s.profit, p.purchase_price,
+               s.customer_id, cust.name as customer_name, cust.phone as customer_phone
+        FROM sales s
+        JOIN products p ON s.key_number = p.key_number
+        JOIN categories c ON p.category_id = c.id
+        JOIN customers cust ON s.customer_id = cust.id
+        WHERE s.customer_id = ?
+        ORDER BY s.sale_day DESC, s.sale_ts DESC
+        """, (customer_id,))
+    
+        sales = [dict(row) for row in cursor.fetchall()]
+    
+        return sales
+
+def _fetch_sale_details(cursor, sales_source, sale_id):
+    """Run the get_sale_details() query against a sales table or subquery"""
+    cursor.execute(f"""
+    SELECT s.id, s.key_number, p.name as product_name, p.category_id, 
+           c.name as category_name, s.quantity, s.sale_price, 
+           (s.quantity * s.sale_price) as total_amount,
+           {_SALE_TIME_COLUMNS}, s.profit, p.purchase_price,
+           s.customer_id, IFNULL(cust.name, 'Walk-in Customer') as customer_name,
+           IFNULL(cust.phone, '') as customer_phone,
+           IFNULL(cust.email, '') as customer_email,
+           IFNULL(cust.address, '') as customer_address
+    FROM {sales_source} s
     JOIN products p ON s.key_number = p.key_number
     JOIN categories c ON p.category_id = c.id
-    JOIN customers cust ON s.customer_id = cust.id
-    WHERE s.customer_id = ?
-    ORDER BY s.sale_date DESC
-    """, (customer_id,))
-    
-    sales = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    LEFT JOIN customers cust ON s.customer_id = cust.id
+    WHERE s.id = ?
+    """, (sale_id,))
     
-    return sales
+    # fetchall() finishes the statement, so the archives can be detached
+    rows = cursor.fetchall()
+    return rows[0] if rows else None
 
 def get_sale_details(sale_id):
     """
     Get detailed information about a specific sale, including customer info.
     
+    Archived sales are looked up in the archives.
+    
     Args:
         sale_id (int): The sale ID
         
     Returns:
         dict: Sale details or None if not found
     """
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-    SELECT s.id, s.key_number, p.name as product_name, p.category_id, 
-           c.name as category_name, s.quantity, s.sale_price, 
-           (s.quantity * s.sale_price) as total_amount,
-           s.sale_date, s.profit, p.purchase_price,
-           s.customer_id, IFNULL(cust.name, 'Walk-in Customer') as customer_name,
+    with read_connection() as conn:
+        row = _fetch_sale_details(conn.cursor(), "sales", sale_id)
+        if row is None:
+            with _attached_archives(conn) as archives:
+                if archives:
+                    row = _fetch_sale_details(conn.cursor(), _sales_source(archives), sale_id)
+    
+        return dict(row) if row else None
+
+def _fetch_bill_rows(cursor, invoices, lines, invoice_id):
+    """Run the generate_bill_data() query against an invoices table and its lines"""
+    cursor.execute(f"""
+    SELECT i.invoice_date,
+           IFNULL(cust.name, 'Walk-in Customer') as customer_name,
            IFNULL(cust.phone, '') as customer_phone,
            IFNULL(cust.email, '') as customer_email,
-           IFNULL(cust.address, '') as customer_address
-    FROM sales s
-    JOIN products p ON s.key_number = p.key_number
+           IFNULL(cust.address, '') as customer_address,
+           l.key_number, p.name as product_name, c.name as category_name,
+           l.unit_price, l.quantity, l.amount
+    FROM {invoices} i
+    LEFT JOIN customers cust ON i.customer_id = cust.id
+    JOIN {lines} l ON l.invoice_id = i.id
+    JOIN products p ON l.key_number = p.key_number
     JOIN categories c ON p.category_id = c.id
-    LEFT JOIN customers cust ON s.customer_id = cust.id
-    WHERE s.id = ?
-    """, (sale_id,))
-    
-    row = cursor.fetchone()
-    conn.close()
-    
-    return dict(row) if row else None
+    WHERE i.id = ?
+    ORDER BY l.sale_id
+    """, (invoice_id,))
+    return cursor.fetchall()
 
-def generate_bill_data(sale_id):
+def generate_bill_data(invoice_id):
     """
-    Generate data for a bill based on a sale ID.
+    Generate data for a bill based on an invoice ID.
+    
+    The header, customer and every line are fetched in one query. Archived
+    invoices are looked up in the archives.
     
     Args:
-        sale_id (int): The sale ID
+        invoice_id (int): The invoice ID
         
     Returns:
-        dict: Bill data including sale, product, and customer information
+        dict: Bill data including invoice, customer and line information, amounts in cents
     """
-    sale_details = get_sale_details(sale_id)
-    if not sale_details:
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        rows = _fetch_bill_rows(cursor, "invoices", "invoice_lines", invoice_id)
+    
+        if not rows:
+            with _attached_archives(conn) as archives:
+                for schema, through_day in archives:
+                    # Same columns as the invoice_lines view
+                    lines = f"""(
+                        SELECT invoice_id, id as sale_id, key_number, quantity,
+                               sale_price as unit_price, quantity * sale_price as amount
+                        FROM {schema}.sales
+                        WHERE invoice_id IS NOT NULL AND sale_day <= '{through_day}'
+                    )"""
+                    rows = _fetch_bill_rows(cursor, f"{schema}.invoices", lines, invoice_id)
+                    if rows:
+                        break
+    
+    if not rows:
         return None
     
     # Format date for printing
-    sale_date = datetime.strptime(sale_details["sale_date"], "%Y-%m-%d %H:%M:%S")
-    formatted_date = sale_date.strftime("%d-%m-%Y %I:%M %p")
+    header = rows[0]
+    invoice_date = datetime.strptime(header["invoice_date"], "%Y-%m-%d %H:%M:%S")
+    formatted_date = invoice_date.strftime("%d-%m-%Y %I:%M %p")
+    
+    lines = [
+        {
+            "name": row["product_name"],
+            "key_number": row["key_number"],
+            "category": row["category_name"],
+            "unit_price": row["unit_price"],
+            "quantity": row["quantity"],
+            "amount": row["amount"]
+        }
+        for row in rows
+    ]
     
     bill_data = {
-        "sale_id": sale_id,
+        "invoice_id": invoice_id,
         "bill_date": formatted_date,
         "customer": {
-            "name": sale_details["customer_name"],
-            "phone": sale_details["customer_phone"],
-            "email": sale_details["customer_email"],
-            "address": sale_details["customer_address"]
-        },
-        "product": {
-            "name": sale_details["product_name"],
-            "key_number": sale_details["key_number"],
-            "category": sale_details["category_name"],
-            "unit_price": sale_details["sale_price"]
+            "name": header["customer_name"],
+            "phone": header["customer_phone"],
+            "email": header["customer_email"],
+            "address": header["customer_address"]
         },
-        "quantity": sale_details["quantity"],
-        "total_amount": sale_details["total_amount"]
+        "lines": lines,
+        "total_amount": sum(line["amount"] for line in lines)
     }
     
     return bill_data
@@ -854,42 +2918,207 @@ def get_sales_by_category(category_id):
     Returns:
         list: List of sales records for the category
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    with read_connection() as conn:
+        cursor = conn.cursor()
+    
+        cursor.execute(f"""
+        SELECT s.id, s.key_number, p.name, p.category_id, c.name as category_name,
+               s.quantity, s.sale_price, {_SALE_TIME_COLUMNS}, s.profit, p.purchase_price,
+               s.customer_id, IFNULL(cust.name, 'Walk-in Customer') as customer_name,
+               IFNULL(cust.phone, '') as customer_phone
+        FROM sales s
+        JOIN products p ON s.key_number = p.key_number
+        JOIN categories c ON p.category_id = c.id
+        LEFT JOIN customers cust ON s.customer_id = cust.id
+        WHERE p.category_id = ?
+        ORDER BY s.sale_day DESC, s.sale_ts DESC
+        """, (category_id,))
+    
+        sales = [dict(row) for row in cursor.fetchall()]
+    
+        return sales
+
+# Default number of rows returned per query_sales() page
+SALES_PAGE_SIZE = 500
+
+def query_sales(start=None, end=None, category_id=None, customer_id=None, key_number=None,
+                limit=SALES_PAGE_SIZE, after_cursor=None, include_archive=None):
+    """
+    Retrieve one page of sales history, newest first, with all filters applied in SQL.
     
-    cursor.execute("""
-    SELECT s.id, s.key_number, p.name, p.category_id, c.name as category_name,
-           s.quantity, s.sale_price, s.sale_date, s.profit, p.purchase_price,
-           s.customer_id, IFNULL(cust.name, 'Walk-in Customer') as customer_name,
-           IFNULL(cust.phone, '') as customer_phone
-    FROM sales s
-    JOIN products p ON s.key_number = p.key_number
-    JOIN categories c ON p.category_id = c.id
-    LEFT JOIN customers cust ON s.customer_id = cust.id
-    WHERE p.category_id = ?
-    ORDER BY s.sale_date DESC
-    """, (category_id,))
+    Archived sales are only read when asked to, so the unfiltered history
+    stays on the live sales table.
+    
+    Args:
+        start (str, optional): First day to include, "YYYY-MM-DD"
+        end (str, optional): Last day to include, "YYYY-MM-DD"
+        category_id (int, optional): Only sales of products in this category
+        customer_id (int, optional): Only sales to this customer
+        key_number (int, optional): Only sales of this product
+        limit (int): Maximum number of sales in the page
+        after_cursor (tuple, optional): next_cursor of the previous page
+        include_archive (bool, optional): Whether to include archived sales.
+            By default they are included when a start day is given, from the
+            archives overlapping the range.
+        
+    Returns:
+        dict: "sales" (list of sales records, archived ones flagged by "archived"), "next_cursor" (tuple or None when
+        this is the last page) and "totals" (count, quantity, revenue and profit in cents
+        over every matching sale; only computed for the first page, None otherwise)
+    """
+    conditions = []
+    params = []
+    
+    if start:
+        conditions.append("s.sale_day >= ?")
+        params.append(start)
+    
+    if end:
+        conditions.append("s.sale_day <= ?")
+        params.append(end)
+    
+    if category_id is not None:
+        conditions.append("p.category_id = ?")
+        params.append(category_id)
+    
+    if customer_id is not None:
+        conditions.append("s.customer_id = ?")
+        params.append(customer_id)
+    
+    if key_number is not None:
+        conditions.append("s.key_number = ?")
+        params.append(key_number)
+    
+    include_archive = _include_archives(include_archive, start)
+    with read_connection() as conn, \
+            (_attached_archives(conn, start, end) if include_archive else nullcontext([])) as archives:
+        cursor = conn.cursor()
+        sales_source = _sales_source(archives)
+    
+        totals = None
+        if after_cursor is None and customer_id is None:
+            # The daily rollup answers every filter except the customer. It
+            # still covers archived days, leave them out with their sales.
+            after_day = None if include_archive else _archived_through(cursor)
+            totals = _summarize_rollup(cursor, start, end, category_id, key_number, after_day)
+        elif after_cursor is None:
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+            cursor.execute(f"""
+            SELECT COUNT(*) as count, IFNULL(SUM(s.quantity), 0) as quantity,
+                   IFNULL(SUM(s.quantity * s.sale_price), 0) as revenue,
+                   IFNULL(SUM(s.profit), 0) as profit
+            FROM {sales_source} s
+            JOIN products p ON s.key_number = p.key_number
+            {where}
+            """, params)
+            totals = dict(cursor.fetchone())
+    
+        page_conditions = list(conditions)
+        page_params = list(params)
+        if after_cursor is not None:
+            # Keyset pagination: continue strictly after the last row of the previous page
+            last_day, last_ts, last_id = after_cursor
+            page_conditions.append("s.sale_day <= ? AND (s.sale_day < ? OR s.sale_ts < ? OR (s.sale_ts = ? AND s.id < ?))")
+            page_params.extend([last_day, last_day, last_ts, last_ts, last_id])
+        where = f"WHERE {' AND '.join(page_conditions)}" if page_conditions else ""
+    
+        # CROSS JOIN keeps sales as the outer loop, so the page is read in
+        # index order (or seeked by day, product or customer) instead of
+        # joining every sale and sorting
+        cursor.execute(f"""
+        SELECT s.id, s.key_number, p.name, p.category_id, c.name as category_name,
+               s.quantity, s.sale_price, {_SALE_TIME_COLUMNS}, s.profit, p.purchase_price,
+               s.customer_id, IFNULL(cust.name, 'Walk-in Customer') as customer_name,
+               IFNULL(cust.phone, '') as customer_phone, {"s.archived" if archives else "0"} as archived
+        FROM {sales_source} s
+        CROSS JOIN products p ON s.key_number = p.key_number
+        CROSS JOIN categories c ON p.category_id = c.id
+        LEFT JOIN customers cust ON s.customer_id = cust.id
+        {where}
+        ORDER BY s.sale_day DESC, s.sale_ts DESC, s.id DESC
+        LIMIT ?
+        """, page_params + [limit + 1])
+    
+        sales = [dict(row) for row in cursor.fetchall()]
+    
+    # The extra row only tells whether another page exists
+    next_cursor = None
+    if len(sales) > limit:
+        sales = sales[:limit]
+        next_cursor = (sales[-1]["sale_day"], sales[-1]["sale_ts"], sales[-1]["id"])
+    
+    return {"sales": sales, "next_cursor": next_cursor, "totals": totals}
+
+def _summarize_rollup(cursor, start=None, end=None, category_id=None, key_number=None, after_day=None):
+    """Sum the daily rollup rows matching the filters, only days after after_day if given"""
+    conditions = []
+    params = []
+    
+    if after_day:
+        conditions.append("day > ?")
+        params.append(after_day)
+    
+    if start:
+        conditions.append("day >= ?")
+        params.append(start)
+    
+    if end:
+        conditions.append("day <= ?")
+        params.append(end)
+    
+    if category_id is not None:
+        conditions.append("category_id = ?")
+        params.append(category_id)
+    
+    if key_number is not None:
+        conditions.append("key_number = ?")
+        params.append(key_number)
     
-    sales = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    cursor.execute(f"""
+    SELECT IFNULL(SUM(sale_count), 0) as count, IFNULL(SUM(quantity), 0) as quantity,
+           IFNULL(SUM(revenue), 0) as revenue, IFNULL(SUM(profit), 0) as profit
+    FROM sales_daily_rollup
+    {where}
+    """, params)
+    return dict(cursor.fetchone())
+
+def get_sales_summary(start=None, end=None, category_id=None, key_number=None):
+    """
+    Summarize sales over a date range from the daily rollup.
+    
+    The cost grows with the number of days in the range, not the number of sales.
+    
+    Args:
+        start (str, optional): First day to include, "YYYY-MM-DD"
+        end (str, optional): Last day to include, "YYYY-MM-DD"
+        category_id (int, optional): Only sales of products in this category
+        key_number (int, optional): Only sales of this product
+        
+    Returns:
+        dict: count, quantity, revenue and profit (cents) and margin (percent of revenue)
+    """
+    with read_connection() as conn:
+        summary = _summarize_rollup(conn.cursor(), start, end, category_id, key_number)
     
-    return sales
+    revenue = summary["revenue"]
+    summary["margin"] = (summary["profit"] / revenue) * 100 if revenue > 0 else 0.0
+    return summary
 
 def get_total_profit():
     """
     Calculate the total profit from all sales.
     
     Returns:
-        float: Total profit
+        int: Total profit in cents
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    with read_connection() as conn:
+        cursor = conn.cursor()
     
-    cursor.execute("SELECT SUM(profit) as total_profit FROM sales")
-    result = cursor.fetchone()
-    conn.close()
+        cursor.execute("SELECT SUM(profit) as total_profit FROM sales_daily_rollup")
+        result = cursor.fetchone()
     
-    return result["total_profit"] if result and result["total_profit"] else 0.0
+        return result["total_profit"] if result and result["total_profit"] else 0
 
 def get_total_profit_by_category(category_id):
     """
@@ -899,138 +3128,579 @@ def get_total_profit_by_category(category_id):
         category_id (int): The category ID
         
     Returns:
-        float: Total profit for the category
+        int: Total profit for the category in cents
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    with read_connection() as conn:
+        cursor = conn.cursor()
     
-    cursor.execute("""
-    SELECT SUM(s.profit) as total_profit
-    FROM sales s
-    JOIN products p ON s.key_number = p.key_number
-    WHERE p.category_id = ?
-    """, (category_id,))
+        cursor.execute("""
+        SELECT SUM(profit) as total_profit
+        FROM sales_daily_rollup
+        WHERE category_id = ?
+        """, (category_id,))
+    
+        result = cursor.fetchone()
+    
+        return result["total_profit"] if result and result["total_profit"] else 0
+
+def _day_range_filter(start, end, column="day"):
+    """Build the WHERE clause and parameters for an optional day range"""
+    conditions = []
+    params = []
+    if start:
+        conditions.append(f"{column} >= ?")
+        params.append(start)
+    if end:
+        conditions.append(f"{column} <= ?")
+        params.append(end)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return where, params
+
+def get_top_products(start=None, end=None, limit=10):
+    """
+    Rank the products by revenue and by profit over a date range.
+    
+    Both rankings come from a single pass over the daily rollup.
+    
+    Args:
+        start (str, optional): First day to include, "YYYY-MM-DD"
+        end (str, optional): Last day to include, "YYYY-MM-DD"
+        limit (int): Number of products in each ranking
+        
+    Returns:
+        dict: "by_revenue" and "by_profit", lists of up to limit products with
+        key_number, name, category_name, quantity, revenue and profit (cents),
+        margin, rank and share (percent of the period's revenue or profit)
+    """
+    where, params = _day_range_filter(start, end)
+    
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+        WITH totals AS (
+            SELECT key_number, SUM(quantity) as quantity, SUM(revenue) as revenue, SUM(profit) as profit
+            FROM sales_daily_rollup
+            {where}
+            GROUP BY key_number
+        ), ranked AS (
+            SELECT key_number, quantity, revenue, profit,
+                   ROW_NUMBER() OVER (ORDER BY revenue DESC, key_number) as revenue_rank,
+                   ROW_NUMBER() OVER (ORDER BY profit DESC, key_number) as profit_rank,
+                   SUM(revenue) OVER () as total_revenue,
+                   SUM(profit) OVER () as total_profit
+            FROM totals
+        )
+        SELECT r.*, IFNULL(p.name, 'Deleted product') as name, IFNULL(c.name, '') as category_name
+        FROM ranked r
+        LEFT JOIN products p ON r.key_number = p.key_number
+        LEFT JOIN categories c ON p.category_id = c.id
+        WHERE r.revenue_rank <= ? OR r.profit_rank <= ?
+        """, params + [limit, limit])
+        rows = [dict(row) for row in cursor.fetchall()]
+    
+    def ranking(rank_field, total_field, value_field):
+        ranked = []
+        for row in sorted((row for row in rows if row[rank_field] <= limit), key=lambda row: row[rank_field]):
+            product = {key: row[key] for key in ("key_number", "name", "category_name", "quantity", "revenue", "profit")}
+            product["margin"] = (row["profit"] / row["revenue"]) * 100 if row["revenue"] > 0 else 0.0
+            product["rank"] = row[rank_field]
+            product["share"] = (row[value_field] / row[total_field]) * 100 if row[total_field] else 0.0
+            ranked.append(product)
+        return ranked
+    
+    return {
+        "by_revenue": ranking("revenue_rank", "total_revenue", "revenue"),
+        "by_profit": ranking("profit_rank", "total_profit", "profit"),
+    }
+
+def get_category_margins(start=None, end=None):
+    """
+    Revenue, profit and margin of every category with sales in a date range.
+    
+    Args:
+        start (str, optional): First day to include, "YYYY-MM-DD"
+        end (str, optional): Last day to include, "YYYY-MM-DD"
+        
+    Returns:
+        list: Categories by revenue, highest first, with category_id,
+        category_name, count, quantity, revenue and profit (cents), margin
+        and revenue_share (percent of the period's revenue)
+    """
+    where, params = _day_range_filter(start, end)
+    
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+        SELECT r.category_id, IFNULL(c.name, 'Unknown') as category_name,
+               SUM(r.sale_count) as count, SUM(r.quantity) as quantity,
+               SUM(r.revenue) as revenue, SUM(r.profit) as profit,
+               IFNULL(SUM(r.profit) * 100.0 / NULLIF(SUM(r.revenue), 0), 0.0) as margin,
+               IFNULL(SUM(r.revenue) * 100.0 / NULLIF(SUM(SUM(r.revenue)) OVER (), 0), 0.0) as revenue_share
+        FROM sales_daily_rollup r
+        LEFT JOIN categories c ON r.category_id = c.id
+        {where}
+        GROUP BY r.category_id
+        ORDER BY revenue DESC
+        """, params)
+        return [dict(row) for row in cursor.fetchall()]
+
+def compare_periods(start, end):
+    """
+    Compare a date range with the period of the same length just before it.
+    
+    Args:
+        start (str): First day of the period, "YYYY-MM-DD"
+        end (str): Last day of the period, "YYYY-MM-DD"
+        
+    Returns:
+        dict: "current" and "previous" (each with start, end, count, quantity,
+        revenue and profit in cents and margin) and "change", the percent
+        change of each total, None where the previous period had none
+    """
+    first = datetime.strptime(start, "%Y-%m-%d").date()
+    last = datetime.strptime(end, "%Y-%m-%d").date()
+    previous_end = first - timedelta(days=1)
+    previous_start = previous_end - (last - first)
+    
+    periods = {
+        "current": {"start": start, "end": end},
+        "previous": {"start": previous_start.isoformat(), "end": previous_end.isoformat()},
+    }
+    for period in periods.values():
+        period.update(count=0, quantity=0, revenue=0, profit=0)
+    
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+        SELECT CASE WHEN day >= ? THEN 'current' ELSE 'previous' END as period,
+               SUM(sale_count) as count, SUM(quantity) as quantity,
+               SUM(revenue) as revenue, SUM(profit) as profit
+        FROM sales_daily_rollup
+        WHERE day >= ? AND day <= ?
+        GROUP BY 1
+        """, (start, periods["previous"]["start"], end))
+        for row in cursor.fetchall():
+            periods[row["period"]].update(count=row["count"], quantity=row["quantity"],
+                                          revenue=row["revenue"], profit=row["profit"])
+    
+    for period in periods.values():
+        period["margin"] = (period["profit"] / period["revenue"]) * 100 if period["revenue"] > 0 else 0.0
+    
+    change = {}
+    for field in ("count", "quantity", "revenue", "profit"):
+        previous = periods["previous"][field]
+        change[field] = ((periods["current"][field] - previous) / abs(previous)) * 100 if previous else None
+    periods["change"] = change
+    return periods
+
+def get_sales_by_hour(start=None, end=None, include_archive=None):
+    """
+    Sales per local hour of day over a date range.
     
-    result = cursor.fetchone()
-    conn.close()
+    Reads the sales themselves, the rollup has no times, but only through
+    the covering sale_day index.
     
-    return result["total_profit"] if result and result["total_profit"] else 0.0
+    Args:
+        start (str, optional): First day to include, "YYYY-MM-DD"
+        end (str, optional): Last day to include, "YYYY-MM-DD"
+        include_archive (bool, optional): Whether to include archived sales,
+            see query_sales()
+        
+    Returns:
+        list: 24 rows, one per hour from 0 to 23, with hour, count, quantity,
+        revenue and profit (cents) and revenue_share (percent of the period's revenue)
+    """
+    where, params = _day_range_filter(start, end, column="sale_day")
+    hours = [{"hour": hour, "count": 0, "quantity": 0, "revenue": 0, "profit": 0, "revenue_share": 0.0}
+             for hour in range(24)]
+    
+    include_archive = _include_archives(include_archive, start)
+    with read_connection() as conn, \
+            (_attached_archives(conn, start, end) if include_archive else nullcontext([])) as archives:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+        SELECT CAST(strftime('%H', sale_ts + tz_offset, 'unixepoch') AS INTEGER) as hour,
+               COUNT(*) as count, SUM(quantity) as quantity,
+               SUM(quantity * sale_price) as revenue, SUM(profit) as profit,
+               IFNULL(SUM(quantity * sale_price) * 100.0 / NULLIF(SUM(SUM(quantity * sale_price)) OVER (), 0), 0.0) as revenue_share
+        FROM {_sales_source(archives)}
+        {where}
+        GROUP BY 1
+        """, params)
+        for row in cursor.fetchall():
+            hours[row["hour"]].update(dict(row))
+    
+    return hours
 
-def delete_product(key_number):
+def delete_product(key_number, wait=True):
     """
     Delete a product from the database.
     
     Args:
         key_number (int): The key number of the product to delete
+        wait (bool): False to return a Future instead of waiting for the commit
         
     Returns:
         bool: True if successful, False if product not found or has sales
     """
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    try:
-        # Check if there are sales for this product
-        cursor.execute("SELECT COUNT(*) FROM sales WHERE key_number = ?", (key_number,))
-        sales_count = cursor.fetchone()[0]
-        
-        if sales_count > 0:
+    def write(cursor):
+        # Check if there are sales for this product, archived ones
+        # only show in the rollup
+        cursor.execute("""
+        SELECT EXISTS (SELECT 1 FROM sales WHERE key_number = ?)
+            OR EXISTS (SELECT 1 FROM sales_daily_rollup WHERE key_number = ? AND sale_count > 0)
+        """, (key_number, key_number))
+        if cursor.fetchone()[0]:
             # Product has sales records, can't delete
-            return False
+            return None
         
-        # Delete the product
-        cursor.execute("DELETE FROM products WHERE key_number = ?", (key_number,))
-        conn.commit()
+        # Write off whatever stock is left
+        cursor.execute("SELECT total_added - sold FROM products WHERE key_number = ?", (key_number,))
+        product = cursor.fetchone()
+        if product and product[0]:
+            _record_stock_movement(cursor, key_number, "product_deleted", -product[0])
         
-        # Check if any row was deleted
-        return cursor.rowcount > 0
-    except Exception as e:
+        # Delete the product and its image
+        cursor.execute("DELETE FROM products WHERE key_number = ?", (key_number,))
+        if cursor.rowcount == 0:
+            return None
+        cursor.execute("DELETE FROM product_images WHERE key_number = ?", (key_number,))
+        cursor.execute("DELETE FROM product_thumbnails WHERE key_number = ?", (key_number,))
+        return True
+    
+    def finish(deleted):
+        if not deleted:
+            return False
+        catalog_cache.invalidate_products([key_number])
+        return True
+    
+    def fail(e):
         print(f"Error deleting product: {e}")
         return False
-    finally:
-        conn.close()
+    
+    return _queued_write(write, finish, fail, wait)
 
-def delete_sale(sale_id):
+def delete_sale(sale_id, wait=True):
     """
     Delete a sale record and update inventory accordingly.
     
+    Only live sales can be deleted. Archived sales are read-only, their
+    days in the rollup and the stock ledger are final.
+    
     Args:
         sale_id (int): The ID of the sale to delete
+        wait (bool): False to return a Future instead of waiting for the commit
         
     Returns:
-        bool: True if successful, False if sale not found
+        bool: True if successful, False if sale not found or archived
     """
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    try:
-        # Start a transaction
-        conn.execute("BEGIN TRANSACTION")
-        
+    def write(cursor):
         # Get sale details before deleting
         cursor.execute(
-            "SELECT key_number, quantity FROM sales WHERE id = ?", 
+            "SELECT key_number, quantity, invoice_id FROM sales WHERE id = ?", 
             (sale_id,)
         )
         sale = cursor.fetchone()
-        
         if not sale:
-            conn.rollback()
-            return False
-        
-        product_key, quantity = sale["key_number"], sale["quantity"]
+            return None
         
         # Delete the sale
         cursor.execute("DELETE FROM sales WHERE id = ?", (sale_id,))
         
-        if cursor.rowcount > 0:
-            # Update product inventory (reduce sold quantity)
-            cursor.execute(
-                "UPDATE products SET sold = sold - ? WHERE key_number = ?",
-                (quantity, product_key)
-            )
-            
-            conn.commit()
-            return True
-        else:
-            conn.rollback()
+        # Update product inventory (reduce sold quantity)
+        cursor.execute(
+            "UPDATE products SET sold = sold - ? WHERE key_number = ?",
+            (sale["quantity"], sale["key_number"])
+        )
+        
+        # Drop the invoice once its last line is gone
+        cursor.execute(
+            "DELETE FROM invoices WHERE id = ? AND NOT EXISTS (SELECT 1 FROM sales WHERE invoice_id = ?)",
+            (sale["invoice_id"], sale["invoice_id"])
+        )
+        return sale["key_number"]
+    
+    def finish(product_key):
+        if product_key is None:
             return False
-    except Exception as e:
-        conn.rollback()
+        catalog_cache.invalidate_products([product_key])
+        return True
+    
+    def fail(e):
         print(f"Error deleting sale: {e}")
         return False
-    finally:
-        conn.close()
+    
+    return _queued_write(write, finish, fail, wait)
 
 def clear_sales_history():
     """
-    Clear all sales history and reset product sold counts.
+    Clear all sales history, archived sales included, and reset product sold counts.
+    
+    The stock ledger keeps the sales and records each live one being
+    deleted, plus an adjustment wherever the reset returns stock the deleted
+    sales do not account for. The sales archive files are deleted once the
+    rest is committed.
     
     Returns:
         int: Number of sales records deleted
     """
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    try:
-        # Start a transaction
-        conn.execute("BEGIN TRANSACTION")
-        
+    def write(cursor):
         # Count sales records before deletion
         cursor.execute("SELECT COUNT(*) FROM sales")
         sales_count = cursor.fetchone()[0]
+        cursor.execute("SELECT file_name, sale_count FROM sales_archives")
+        archives = [dict(row) for row in cursor.fetchall()]
+        sales_count += sum(archive["sale_count"] for archive in archives)
         
-        # Delete all sales
+        # Delete all sales and their invoices
         cursor.execute("DELETE FROM sales")
+        cursor.execute("DELETE FROM invoices")
+        
+        # The rollup rows left are those of the archived days
+        cursor.execute("DELETE FROM sales_daily_rollup")
+        cursor.execute("DELETE FROM sales_archives")
         
         # Reset sold counts for all products
         cursor.execute("UPDATE products SET sold = 0")
-        
-        conn.commit()
+        _reconcile_stock_ledger(cursor)
+        return sales_count, archives
+    
+    def finish(cleared):
+        sales_count, archives = cleared
+        catalog_cache.invalidate_products()
+        for archive in archives:
+            path = os.path.join(get_archive_dir(), archive["file_name"])
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except OSError as e:
+                print(f"Error deleting sales archive {path}: {e}")
         return sales_count
-    except Exception as e:
-        conn.rollback()
+    
+    def fail(e):
         print(f"Error clearing sales history: {e}")
         return 0
-    finally:
-        conn.close()
+    
+    return _queued_write(write, finish, fail)
+
+# Kinds of stock movement. Quantities are signed changes to the stock on hand.
+STOCK_MOVEMENT_KINDS = ("opening", "receipt", "sale", "sale_deleted", "sale_changed",
+                        "adjustment", "product_deleted")
+
+def adjust_stock(key_number, quantity, kind="adjustment", note=None, wait=True):
+    """
+    Add or remove stock outside of sales and record it in the ledger.
+    
+    Args:
+        key_number (int): Product key number
+        quantity (int): Units to add, negative to remove
+        kind (str): "receipt" for deliveries, "adjustment" for counts and write-offs
+        note (str, optional): Reason shown in the stock history
+        wait (bool): False to return a Future instead of waiting for the commit
+        
+    Returns:
+        bool: True if successful, False if the product was not found or the
+        stock would drop below zero
+    """
+    if kind not in ("receipt", "adjustment") or not quantity:
+        return False
+    
+    def write(cursor):
+        # Removed stock comes off total_added, so sold keeps counting sales only
+        cursor.execute(
+            "UPDATE products SET total_added = total_added + ? WHERE key_number = ? AND total_added - sold + ? >= 0",
+            (quantity, key_number, quantity)
+        )
+        if cursor.rowcount == 0:
+            return None
+        
+        _record_stock_movement(cursor, key_number, kind, quantity, note)
+        return True
+    
+    def finish(adjusted):
+        if not adjusted:
+            return False
+        catalog_cache.invalidate_products([key_number])
+        return True
+    
+    def fail(e):
+        print(f"Error adjusting stock: {e}")
+        return False
+    
+    return _queued_write(write, finish, fail, wait)
+
+def _month_end(day):
+    """Last day of the month of a date"""
+    next_month = (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return next_month - timedelta(days=1)
+
+def take_stock_snapshots(through=None):
+    """
+    Snapshot the stock on hand at the end of every month that has none yet.
+    
+    Each product with movements in a month gets a row with its stock at the
+    end of that month: its previous snapshot plus the movements since.
+    Products without movements keep their previous snapshot.
+    
+    Args:
+        through (str, optional): Last day to snapshot, "YYYY-MM-DD". Defaults
+            to the end of the last complete month.
+        
+    Returns:
+        int: Number of months snapshotted
+    """
+    if through is None:
+        last = datetime.now().date().replace(day=1) - timedelta(days=1)
+    else:
+        last = datetime.strptime(through, "%Y-%m-%d").date()
+    
+    with write_connection() as conn:
+        cursor = conn.cursor()
+    
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            
+            cursor.execute("SELECT MAX(day) FROM stock_snapshots")
+            previous = cursor.fetchone()[0]
+            cursor.execute("SELECT MIN(movement_day) FROM stock_movements WHERE movement_day > ?", (previous or "",))
+            first = cursor.fetchone()[0]
+            if first is None:
+                conn.rollback()
+                return 0
+            
+            months = 0
+            month_end = _month_end(datetime.strptime(first, "%Y-%m-%d").date())
+            while month_end <= last:
+                day = month_end.isoformat()
+                cursor.execute('''
+                INSERT OR REPLACE INTO stock_snapshots (key_number, day, on_hand)
+                SELECT k.key_number, ?,
+                       IFNULL(s.on_hand, 0) + (
+                           SELECT SUM(m.quantity) FROM stock_movements m
+                           WHERE m.key_number = k.key_number AND m.movement_day > IFNULL(s.day, '') AND m.movement_day <= ?
+                       )
+                FROM (SELECT DISTINCT key_number FROM stock_movements WHERE movement_day > ? AND movement_day <= ?) k
+                LEFT JOIN stock_snapshots s ON s.key_number = k.key_number
+                    AND s.day = (SELECT MAX(day) FROM stock_snapshots WHERE key_number = k.key_number AND day < ?)
+                ''', (day, day, previous or "", day, day))
+                previous = day
+                months += 1
+                month_end = _month_end(month_end + timedelta(days=1))
+            
+            conn.commit()
+            return months
+        except Exception as e:
+            conn.rollback()
+            print(f"Error taking stock snapshots: {e}")
+            return 0
+
+def get_stock_at(day, key_number=None):
+    """
+    Get the stock on hand at the end of a day.
+    
+    Reads each product's latest snapshot up to that day plus the movements
+    after it, so only part of a month is summed rather than the whole ledger.
+    
+    Args:
+        day (str): The day, "YYYY-MM-DD"
+        key_number (int, optional): Only this product
+        
+    Returns:
+        dict: Key numbers mapped to units on hand, for the current products
+        and any product with a snapshot
+    """
+    key_filter = "WHERE key_number = :key_number" if key_number is not None else ""
+    
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+        WITH keys AS (
+            SELECT key_number FROM products {key_filter}
+            UNION
+            SELECT DISTINCT key_number FROM stock_snapshots {key_filter}
+        ), latest AS (
+            SELECT k.key_number, s.day, s.on_hand
+            FROM keys k
+            LEFT JOIN stock_snapshots s ON s.key_number = k.key_number
+                AND s.day = (SELECT MAX(day) FROM stock_snapshots WHERE key_number = k.key_number AND day <= :day)
+        )
+        SELECT l.key_number, IFNULL(l.on_hand, 0) + IFNULL((
+            SELECT SUM(m.quantity) FROM stock_movements m
+            WHERE m.key_number = l.key_number AND m.movement_day > IFNULL(l.day, '') AND m.movement_day <= :day
+        ), 0) as on_hand
+        FROM latest l
+        """, {"day": day, "key_number": key_number})
+        return {row["key_number"]: row["on_hand"] for row in cursor.fetchall()}
+
+def get_stock_movements(key_number, start=None, end=None):
+    """
+    List the stock movements of a product, oldest first.
+    
+    Args:
+        key_number (int): Product key number
+        start (str, optional): First day to include, "YYYY-MM-DD"
+        end (str, optional): Last day to include, "YYYY-MM-DD"
+        
+    Returns:
+        list: Movement dictionaries with id, movement_ts, movement_day, kind,
+        quantity, sale_id, note and balance (stock on hand after the movement)
+    """
+    # The running balance starts from the stock at the end of the day before
+    opening = 0
+    if start:
+        day_before = (datetime.strptime(start, "%Y-%m-%d").date() - timedelta(days=1)).isoformat()
+        opening = get_stock_at(day_before, key_number).get(key_number, 0)
+    conditions = ["key_number = ?"]
+    params = [opening, key_number]
+    if start:
+        conditions.append("movement_day >= ?")
+        params.append(start)
+    if end:
+        conditions.append("movement_day <= ?")
+        params.append(end)
+    
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+        SELECT id, movement_ts, movement_day, kind, quantity, sale_id, note,
+               ? + SUM(quantity) OVER (ORDER BY movement_day, movement_ts, id) as balance
+        FROM stock_movements
+        WHERE {' AND '.join(conditions)}
+        ORDER BY movement_day, movement_ts, id
+        """, params)
+        return [dict(row) for row in cursor.fetchall()]
+
+def get_license():
+    """
+    Get the stored license.
+    
+    Returns:
+        dict: key, customer_id, expiry_date and activation_date, or None if
+        no license is registered
+    """
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT key, customer_id, expiry_date, activation_date FROM license LIMIT 1")
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+def save_license(key, customer_id, expiry_date):
+    """
+    Replace the stored license, activated today.
+    
+    Args:
+        key (str): License key
+        customer_id (str): Customer ID the key was issued to
+        expiry_date (str): Last valid day, "YYYY-MM-DD"
+        
+    Raises:
+        sqlite3.Error: If the license could not be stored
+    """
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM license")
+        cursor.execute(
+            "INSERT INTO license (key, customer_id, expiry_date, activation_date) VALUES (?, ?, ?, ?)",
+            (key, customer_id, expiry_date, datetime.now().strftime("%Y-%m-%d"))
+        )
+        conn.commit()
@@ -0,0 +1,515 @@
+"""
+Database service for running several checkout terminals on one database.
+
+One machine runs the server, which owns the SQLite file and serves the
+database.py API over TCP. Every other terminal runs the application in
+client mode: the database functions are replaced by calls to the server,
+so no terminal ever opens the file over a network drive.
+
+    python db_service.py serve --host 0.0.0.0 --token <secret>
+    RETAIL_DB_TOKEN=<secret> python main.py --server 192.168.1.10:8765
+
+Messages are single lines of JSON. A request carries a batch of calls,
+which run in order on one of the server's worker threads, and the
+response carries one result or error per call. Clients keep one socket
+per thread open, and the workers keep their pooled SQLite connections, so
+a call costs one round trip and no connect. Every request must carry the
+shared token (RETAIL_DB_TOKEN or --token), which the server requires
+whenever it listens on more than the loopback address.
+"""
+import argparse
+import base64
+import hmac
+import ipaddress
+import json
+import os
+import socket
+import socketserver
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import analytics
+import database
+import forecasting
+
+# Port the server listens on by default
+DEFAULT_PORT = 8765
+
+# Threads running database calls on the server. Each one keeps its own
+# pooled connections, reads run in parallel and writes queue in SQLite.
+WORKER_THREADS = 4
+
+# Seconds a client waits for the server before giving up on a call
+CLIENT_TIMEOUT = 30
+
+# Longest request line the server reads, in bytes. Product images travel
+# base64-encoded inside requests, so this leaves room for large photos.
+MAX_REQUEST_SIZE = 32 * 1024 * 1024
+
+# Shared secret expected in every request. Empty is only accepted on the
+# loopback address, where no other machine can connect.
+DEFAULT_TOKEN = os.environ.get("RETAIL_DB_TOKEN", "")
+
+# database.py functions served to the clients. Maintenance such as
+# migrations, archiving and snapshots only runs on the server, and so do
+# the functions in HOST_ONLY_FUNCTIONS.
+REMOTE_FUNCTIONS = (
+    "get_all_categories", "get_category_by_id", "add_category", "update_category", "delete_category",
+    "add_product", "update_product", "get_all_products", "get_products_by_category",
+    "get_product_by_key", "search_products", "delete_product",
+    "update_product_image", "get_product_image", "save_product_thumbnails", "get_product_thumbnail",
+    "add_customer", "get_customer_by_id", "get_all_customers", "search_customers",
+    "record_sale", "record_cart_sale", "delete_sale",
+    "get_sales_archives", "get_sales_history", "get_sales_by_customer", "get_sale_details",
+    "generate_bill_data", "get_sales_by_category", "query_sales", "get_sales_summary",
+    "get_total_profit", "get_total_profit_by_category", "get_top_products", "get_category_margins",
+    "compare_periods", "get_sales_by_hour",
+    "adjust_stock", "get_stock_at", "get_stock_movements", "get_write_contention",
+)
+
+# Admin actions only run on the machine holding the database. In client
+# mode they raise RemoteError instead of opening a local database.
+HOST_ONLY_FUNCTIONS = ("clear_sales_history", "get_license", "save_license")
+
+class RemoteError(Exception):
+    """Raised on the client when a call failed on the server or could not reach it"""
+
+def _encode(value):
+    """Convert a value to JSON types, tagging the ones JSON can't represent"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {"$bytes": base64.b64encode(bytes(value)).decode("ascii")}
+    if isinstance(value, tuple):
+        return {"$tuple": [_encode(item) for item in value]}
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    if isinstance(value, dict):
+        if all(isinstance(key, str) and not key.startswith("$") for key in value):
+            return {key: _encode(item) for key, item in value.items()}
+        # Keys such as key numbers or thumbnail sizes must stay what they were
+        return {"$items": [[_encode(key), _encode(item)] for key, item in value.items()]}
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    raise TypeError(f"Cannot send {type(value).__name__} values")
+
+def _decode(value):
+    """Inverse of _encode()"""
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    if isinstance(value, dict):
+        if "$bytes" in value:
+            return base64.b64decode(value["$bytes"])
+        if "$tuple" in value:
+            return tuple(_decode(item) for item in value["$tuple"])
+        if "$items" in value:
+            return {_decode(key): _decode(item) for key, item in value["$items"]}
+        return {key: _decode(item) for key, item in value.items()}
+    return value
+
+def _is_loopback(host):
+    """Whether only this machine can reach an address"""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        # Host names and "" (every address) may reach the LAN
+        return False
+
+def _check_token(host, token):
+    """
+    Refuse to serve other machines without a shared token.
+
+    Raises:
+        ValueError: If host is not a loopback address and token is empty
+    """
+    if not token and not _is_loopback(host):
+        raise ValueError(f"A token is required to serve on {host or 'every address'}, "
+                         "pass --token or set RETAIL_DB_TOKEN")
+
+def _license_valid():
+    """Whether the server's license is valid, without revealing it"""
+    # license_validator needs PyQt5, which a test server may not have
+    from license_validator import validate_license
+    return validate_license()
+
+def _served_functions():
+    """Functions a request can call, keyed by name"""
+    functions = {name: getattr(database, name) for name in REMOTE_FUNCTIONS}
+    functions["forecast_all_products"] = forecasting.forecast_all_products
+    functions["get_top_customers"] = analytics.get_top_customers
+    functions["license_valid"] = _license_valid
+    functions["table_versions"] = database.data_versions.versions
+    functions["ping"] = lambda: True
+    return functions
+
+def _run_calls(functions, calls):
+    """Run a batch of calls in order, on a worker thread"""
+    results = []
+    for name, args, kwargs in calls:
+        try:
+            function = functions.get(name)
+            if function is None:
+                raise ValueError(f"Unknown function: {name}")
+            results.append({"result": _encode(function(*_decode(args), **_decode(kwargs)))})
+        except Exception as e:
+            results.append({"error": f"{type(e).__name__}: {e}"})
+    return results
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Serves one client connection until the client closes it"""
+    def handle(self):
+        server = self.server
+        while True:
+            line = self.rfile.readline(MAX_REQUEST_SIZE + 1)
+            if not line:
+                break
+            if len(line) > MAX_REQUEST_SIZE:
+                # The rest of the line is still unread, so the connection
+                # can't be resynchronised: answer and drop it
+                self._respond({"error": f"Request too large, the limit is {MAX_REQUEST_SIZE} bytes"})
+                break
+            try:
+                request = json.loads(line)
+                if server.token and not hmac.compare_digest(str(request.get("token", "")), server.token):
+                    response = {"error": "Invalid token"}
+                else:
+                    calls = request["calls"]
+                    response = {"results": server.executor.submit(_run_calls, server.functions, calls).result()}
+            except Exception as e:
+                response = {"error": f"Bad request: {e}"}
+            self._respond(response)
+
+    def _respond(self, response):
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+        self.wfile.flush()
+
+class DatabaseServer(socketserver.ThreadingTCPServer):
+    """
+    TCP server running database calls for the clients.
+
+    Each client connection gets a thread reading its requests, the calls
+    themselves run on a fixed pool of WORKER_THREADS threads.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, token=DEFAULT_TOKEN, workers=WORKER_THREADS):
+        _check_token(host, token)
+        super().__init__((host, port), _RequestHandler)
+        self.token = token or ""
+        self.functions = _served_functions()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db-service")
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+        database.close_connections()
+
+def start_server(host="127.0.0.1", port=DEFAULT_PORT, token=DEFAULT_TOKEN, workers=WORKER_THREADS):
+    """
+    Start a server on a background thread, e.g. for testing on one machine.
+
+    Args:
+        host (str): Address to listen on, "0.0.0.0" for the whole LAN
+        port (int): Port to listen on, 0 for any free port
+        token (str): Shared secret the clients must send, required
+            unless host is a loopback address
+
+    Returns:
+        DatabaseServer: The running server, its server_address holds the
+        actual port. Call shutdown() and server_close() to stop it.
+
+    Raises:
+        ValueError: If a non-loopback host is given without a token
+    """
+    server = DatabaseServer(host, port, token, workers)
+    thread = threading.Thread(target=server.serve_forever, name="db-service", daemon=True)
+    thread.start()
+    return server
+
+class RemoteResult:
+    """Placeholder for the result of a call in a batch, filled in when the batch is sent"""
+    def __init__(self):
+        self._done = False
+        self._value = None
+        self._error = None
+
+    def result(self):
+        """
+        Get the result of the call.
+
+        Raises:
+            RemoteError: If the call failed, or the batch was not sent yet
+        """
+        if not self._done:
+            raise RemoteError("The batch has not been sent")
+        if self._error is not None:
+            raise RemoteError(self._error)
+        return self._value
+
+class _Batch:
+    """Calls collected by DatabaseClient.batch()"""
+    def __init__(self):
+        self.calls = []
+        self.results = []
+
+    def call(self, name, *args, **kwargs):
+        """
+        Add a call to the batch.
+
+        Returns:
+            RemoteResult: Holds the result once the batch has been sent
+        """
+        self.calls.append((name, args, kwargs))
+        self.results.append(RemoteResult())
+        return self.results[-1]
+
+class DatabaseClient:
+    """
+    Calls database functions on a DatabaseServer.
+
+    Every thread gets its own socket, opened on first use and kept for the
+    following calls. After a connection error the next call reconnects.
+    """
+    def __init__(self, host, port=DEFAULT_PORT, token=DEFAULT_TOKEN, timeout=CLIENT_TIMEOUT):
+        self.address = (host, port)
+        self.token = token or ""
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sockets = set()
+
+    def _connection(self):
+        """Return the calling thread's socket and its file, connecting if needed"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            sock = socket.create_connection(self.address, timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = (sock, sock.makefile("rwb"))
+            self._local.connection = connection
+            with self._lock:
+                self._sockets.add(sock)
+        return connection
+
+    def _drop_connection(self):
+        """Close the calling thread's socket after an error"""
+        connection = getattr(self._local, "connection", None)
+        self._local.connection = None
+        if connection is not None:
+            with self._lock:
+                self._sockets.discard(connection[0])
+            connection[1].close()
+            connection[0].close()
+
+    def _send(self, calls):
+        """Send a batch of calls and return the raw results"""
+        request = json.dumps({
+            "token": self.token,
+            "calls": [[name, _encode(list(args)), _encode(kwargs)] for name, args, kwargs in calls],
+        }).encode("utf-8") + b"\n"
+
+        try:
+            _, stream = self._connection()
+            stream.write(request)
+            stream.flush()
+            line = stream.readline()
+            if not line:
+                raise ConnectionError("Connection closed by the server")
+        except OSError as e:
+            # Not retried: the server may have run the calls already
+            self._drop_connection()
+            raise RemoteError(f"Database server {self.address[0]}:{self.address[1]} unreachable: {e}")
+
+        response = json.loads(line)
+        if "error" in response:
+            raise RemoteError(response["error"])
+        return response["results"]
+
+    def call(self, name, *args, **kwargs):
+        """
+        Call one function on the server.
+
+        Raises:
+            RemoteError: If the call failed or the server can't be reached
+        """
+        with self.batch() as batch:
+            result = batch.call(name, *args, **kwargs)
+        return result.result()
+
+    @contextmanager
+    def batch(self):
+        """
+        Collect calls and send them in a single round trip when the block exits.
+
+            with client.batch() as batch:
+                categories = batch.call("get_all_categories")
+                products = batch.call("get_all_products")
+            categories.result()
+
+        Raises:
+            RemoteError: If the server can't be reached
+        """
+        batch = _Batch()
+        yield batch
+        if batch.calls:
+            for result, outcome in zip(batch.results, self._send(batch.calls)):
+                result._done = True
+                result._value = _decode(outcome.get("result"))
+                result._error = outcome.get("error")
+
+    def function(self, name):
+        """Return a function calling name on the server"""
+        def remote_function(*args, **kwargs):
+            return self.call(name, *args, **kwargs)
+        remote_function.__name__ = name
+        return remote_function
+
+    def close(self):
+        """Close the sockets of every thread"""
+        with self._lock:
+            sockets = list(self._sockets)
+            self._sockets.clear()
+        for sock in sockets:
+            try:
+                sock.close()
+            except OSError as e:
+                print(f"Error closing connection: {e}")
+
+class RemoteDataVersions(database.DataVersionService):
+    """Change tracker reading the table versions from the server"""
+    def __init__(self, client):
+        super().__init__()
+        self._client = client
+
+    def versions(self):
+        try:
+            return self._client.call("table_versions")
+        except RemoteError as e:
+            print(f"Error reading table versions: {e}")
+            return None
+
+    def close(self):
+        pass
+
+_client = None
+
+def parse_address(address):
+    """
+    Split "host" or "host:port" into a host and a port.
+
+    Returns:
+        tuple: (host, port)
+    """
+    host, _, port = address.rpartition(":")
+    if not host:
+        return port, DEFAULT_PORT
+    return host, int(port)
+
+def connect(address, token=DEFAULT_TOKEN):
+    """
+    Switch this process to client mode.
+
+    The functions in REMOTE_FUNCTIONS, forecasting.forecast_all_products(),
+    analytics.get_top_customers() and database.data_versions are replaced
+    by calls to the server, so code using them runs unchanged. The ones in
+    HOST_ONLY_FUNCTIONS raise RemoteError. Call this before loading any data.
+
+    Args:
+        address (str): "host" or "host:port" of the server
+        token (str): Shared secret of the server
+
+    Returns:
+        DatabaseClient: The client used for the calls
+
+    Raises:
+        RemoteError: If the server can't be reached
+    """
+    global _client
+    host, port = parse_address(address)
+    client = DatabaseClient(host, port, token)
+    client.call("ping")
+
+    for name in REMOTE_FUNCTIONS:
+        setattr(database, name, client.function(name))
+    for name in HOST_ONLY_FUNCTIONS:
+        setattr(database, name, _host_only(name))
+    forecasting.forecast_all_products = client.function("forecast_all_products")
+    analytics.get_top_customers = client.function("get_top_customers")
+    database.data_versions = RemoteDataVersions(client)
+    _client = client
+    return client
+
+def _host_only(name):
+    """Return a function refusing to run name on a client"""
+    def host_only_function(*args, **kwargs):
+        raise RemoteError(f"{name} can only run on the database server machine")
+    host_only_function.__name__ = name
+    return host_only_function
+
+def get_client():
+    """
+    Return the client installed by connect().
+
+    Returns:
+        DatabaseClient: The client, None when the database is local
+    """
+    return _client
+
+def serve(host="127.0.0.1", port=DEFAULT_PORT, token=DEFAULT_TOKEN, workers=WORKER_THREADS, backups=True):
+    """
+    Prepare the database and serve it until interrupted.
+
+    Runs the startup maintenance the application runs in local mode:
+    migrations, stock snapshots, archiving and scheduled backups.
+
+    Raises:
+        ValueError: If a non-loopback host is given without a token
+        database.MigrationError: If the database could not be migrated
+    """
+    from backup import start_backup_scheduler, stop_backup_scheduler
+
+    _check_token(host, token)
+
+    database.create_database()
+    database.take_stock_snapshots()
+    database.archive_sales()
+    if backups:
+        start_backup_scheduler()
+
+    server = DatabaseServer(host, port, token, workers)
+    print(f"Serving {database.DB_PATH} on {host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if backups:
+            stop_backup_scheduler()
+        server.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Share the shop database between several terminals")
+    parser.add_argument("--db", default=database.DB_PATH, help="database file (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="serve the database to the terminals")
+    serve_parser.add_argument("--host", default="127.0.0.1",
+                              help="address to listen on, 0.0.0.0 for the LAN, which needs --token (default: %(default)s)")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="port (default: %(default)s)")
+    serve_parser.add_argument("--token", default=DEFAULT_TOKEN, help="shared secret (default: $RETAIL_DB_TOKEN)")
+    serve_parser.add_argument("--workers", type=int, default=WORKER_THREADS,
+                              help="database threads (default: %(default)s)")
+    serve_parser.add_argument("--no-backups", action="store_true", help="do not run scheduled backups")
+    args = parser.parse_args()
+
+    database.DB_PATH = args.db
+    if args.command == "serve":
+        try:
+            serve(args.host, args.port, args.token, args.workers, backups=not args.no_backups)
+        except (ValueError, database.MigrationError) as e:
+            print(f"Error starting the database server: {e}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,233 @@
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+
+import database
+
+# Days of sales history the forecast looks at
+HISTORY_DAYS = 90
+
+# Span of the exponentially weighted average in days: recent days count
+# most, a day this old still counts for about a third as much as yesterday
+DEMAND_SPAN = 14
+
+# Days between placing an order and the stock arriving
+LEAD_TIME_DAYS = 7
+
+# Days of demand a suggested reorder should cover once it arrives
+COVER_DAYS = 30
+
+# Standard deviations of daily demand kept as safety stock, about a 95%
+# chance of not running out before the next delivery
+SAFETY_FACTOR = 1.65
+
+_HISTORY_QUERY = """
+SELECT key_number, day, SUM(quantity)
+FROM sales_daily_rollup
+WHERE day >= ? AND day < ?
+GROUP BY key_number, day
+"""
+
+class DemandForecaster:
+    """
+    Sales velocity and stock-out forecast for every product.
+
+    Daily units sold per product over the last HISTORY_DAYS complete days
+    are kept as a products x days numpy matrix, read from the daily rollup.
+    Demand is the exponentially weighted average of each row, computed for
+    all products at once as a single matrix-vector product. Today is left
+    out until it is over, so a quiet morning does not drag the rate down.
+
+    refresh() only reads the days completed since the previous call. Edits
+    to earlier days, like a deleted sale, are noticed by comparing the
+    total units against the rollup and cause a full reload.
+
+    forecast_all() keeps its result until the history or the products
+    table changes, so repeated views of the catalog cost a version check.
+    """
+    def __init__(self, history_days=HISTORY_DAYS, span=DEMAND_SPAN):
+        self.history_days = history_days
+        alpha = 2 / (span + 1)
+        # Weight of each column, oldest day first, normalized so a
+        # constant demand averages to itself over the window
+        weights = alpha * (1 - alpha) ** np.arange(history_days - 1, -1, -1)
+        self._weights = weights / weights.sum()
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        """Drop the history, the next forecast reloads it"""
+        with self._lock:
+            self._db_path = database.DB_PATH
+            self._end = None  # First day not in the matrix, today when loaded
+            self._keys = np.empty(0, dtype=np.int64)
+            self._matrix = np.zeros((0, self.history_days), dtype=np.int64)
+            self._all = None  # Last result of forecast_all()
+
+    def _fetch(self, first, end):
+        """
+        Read units sold per product and day for the days from first up to end.
+
+        Returns:
+            tuple: Key numbers, day offsets from first and quantities as arrays
+        """
+        with database.read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            cursor.execute(_HISTORY_QUERY, (first.isoformat(), end.isoformat()))
+            rows = cursor.fetchall()
+
+        if not rows:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+        keys, days, quantities = zip(*rows)
+        offsets = (np.array(days, dtype="datetime64[D]") - np.datetime64(first, "D")).astype(np.int64)
+        return np.array(keys, dtype=np.int64), offsets, np.array(quantities, dtype=np.int64)
+
+    def _add(self, keys, offsets, quantities, first_column):
+        """Add fetched quantities to the matrix, growing it for new products"""
+        new_keys = np.setdiff1d(keys, self._keys)
+        if len(new_keys):
+            all_keys = np.union1d(self._keys, new_keys)
+            matrix = np.zeros((len(all_keys), self.history_days), dtype=np.int64)
+            matrix[np.searchsorted(all_keys, self._keys)] = self._matrix
+            self._keys, self._matrix = all_keys, matrix
+
+        rows = np.searchsorted(self._keys, keys)
+        np.add.at(self._matrix, (rows, first_column + offsets), quantities)
+
+    def _load(self, today):
+        """Read the whole history window"""
+        self._keys = np.empty(0, dtype=np.int64)
+        self._matrix = np.zeros((0, self.history_days), dtype=np.int64)
+        first = today - timedelta(days=self.history_days)
+        self._add(*self._fetch(first, today), 0)
+        self._end = today
+
+    def _history_total(self, today):
+        """Total units sold in the window according to the rollup"""
+        first = today - timedelta(days=self.history_days)
+        with database.read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT IFNULL(SUM(quantity), 0) FROM sales_daily_rollup WHERE day >= ? AND day < ?",
+                (first.isoformat(), today.isoformat())
+            )
+            return cursor.fetchone()[0]
+
+    def refresh(self):
+        """
+        Bring the history up to date with the sales table.
+
+        Returns:
+            bool: Whether the history changed
+        """
+        with self._lock:
+            if self._db_path != database.DB_PATH:
+                self.clear()
+
+            today = date.today()
+            if self._end == today and not database.data_versions.changed(self, ("sales",)):
+                return False
+
+            # Before querying, so a sale recorded meanwhile is picked up next time
+            database.data_versions.mark_seen(self, ("sales",))
+
+            if self._end is None or (today - self._end).days >= self.history_days:
+                self._load(today)
+                return True
+
+            changed = False
+            elapsed = (today - self._end).days
+            if elapsed > 0:
+                # Slide the window and read only the days completed since
+                self._matrix = np.roll(self._matrix, -elapsed, axis=1)
+                self._matrix[:, -elapsed:] = 0
+                self._add(*self._fetch(self._end, today), self.history_days - elapsed)
+                self._end = today
+                changed = True
+
+            if int(self._matrix.sum()) != self._history_total(today):
+                # Earlier days were edited, start over
+                self._load(today)
+                changed = True
+            return changed
+
+    def forecast(self, products):
+        """
+        Forecast demand and stock-outs for products.
+
+        Args:
+            products (list): Product dictionaries with key_number and remaining
+
+        Returns:
+            dict: For each key number, a dict with daily_demand (units per
+            day), days_left (days until stock-out at that rate, None without
+            demand), reorder_point (units left when an order should be
+            placed) and reorder_qty (units to order now, 0 if none needed)
+        """
+        with self._lock:
+            self.refresh()
+
+            keys = np.array([product["key_number"] for product in products], dtype=np.int64)
+            remaining = np.array([product["remaining"] for product in products], dtype=np.float64)
+
+            # Weighted mean and spread of daily demand, all products at once
+            mean = self._matrix @ self._weights
+            spread = np.sqrt(np.maximum((self._matrix ** 2) @ self._weights - mean ** 2, 0))
+
+            demand = np.zeros(len(keys))
+            deviation = np.zeros(len(keys))
+            if len(self._keys):
+                rows = np.minimum(np.searchsorted(self._keys, keys), len(self._keys) - 1)
+                found = self._keys[rows] == keys
+                demand[found] = mean[rows[found]]
+                deviation[found] = spread[rows[found]]
+
+        stock = np.maximum(remaining, 0)
+        with np.errstate(divide="ignore"):
+            days_left = np.where(demand > 0, stock / demand, np.inf)
+
+        safety_stock = SAFETY_FACTOR * deviation * np.sqrt(LEAD_TIME_DAYS)
+        reorder_point = np.ceil(demand * LEAD_TIME_DAYS + safety_stock)
+        target = np.ceil(demand * (LEAD_TIME_DAYS + COVER_DAYS) + safety_stock)
+        reorder_qty = np.where((demand > 0) & (stock <= reorder_point), np.maximum(target - stock, 0), 0)
+
+        forecasts = {}
+        for index, key_number in enumerate(keys.tolist()):
+            forecasts[key_number] = {
+                "daily_demand": float(demand[index]),
+                "days_left": float(days_left[index]) if np.isfinite(days_left[index]) else None,
+                "reorder_point": int(reorder_point[index]),
+                "reorder_qty": int(reorder_qty[index]),
+            }
+        return forecasts
+
+    def forecast_all(self):
+        """
+        Forecast every product, see forecast().
+
+        The result is shared between callers and must not be modified.
+
+        Returns:
+            dict: Forecasts keyed by key number
+        """
+        with self._lock:
+            history_changed = self.refresh()
+            if self._all is None or history_changed or database.data_versions.changed(self, ("products",)):
+                # Before querying, like refresh()
+                database.data_versions.mark_seen(self, ("products",))
+                self._all = self.forecast(database.get_all_products())
+            return self._all
+
+# Shared forecaster used by the inventory view
+demand_forecaster = DemandForecaster()
+
+def forecast_all_products():
+    """
+    Forecast every product with the shared forecaster, see DemandForecaster.forecast_all().
+
+    In client mode this runs on the database server, which has the history.
+    """
+    return demand_forecaster.forecast_all()
@@ -1,7 +1,6 @@
-import sqlite3
 import datetime
 from PyQt5.QtWidgets import QApplication, QInputDialog, QMessageBox
-from database import DB_PATH  # adjust if your DB_PATH import is different
+import database
 import hashlib
 
 def generate_license_key(customer_id, expiry_date):
@@ -11,32 +10,18 @@ def generate_license_key(customer_id, expiry_date):
 
 def validate_license():
     """Check the stored license against expected key and expiry."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    try:
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS license (
-                key TEXT PRIMARY KEY,
-                customer_id TEXT,
-                expiry_date TEXT,
-                activation_date TEXT
-            )
-        ''')
-        cursor.execute("SELECT key, customer_id, expiry_date FROM license LIMIT 1")
-        row = cursor.fetchone()
-        if not row:
-            return False
-
-        stored_key, customer_id, expiry_date = row
-        # expiry check
-        if datetime.datetime.now() > datetime.datetime.strptime(expiry_date, "%Y-%m-%d"):
-            return False
+    # The license table is created by the database migrations
+    stored = database.get_license()
+    if not stored:
+        return False
 
-        expected = generate_license_key(customer_id, expiry_date)
-        return stored_key == expected
+    stored_key, customer_id, expiry_date = stored["key"], stored["customer_id"], stored["expiry_date"]
+    # expiry check
+    if datetime.datetime.now() > datetime.datetime.strptime(expiry_date, "%Y-%m-%d"):
+        return False
 
-    finally:
-        conn.close()
+    expected = generate_license_key(customer_id, expiry_date)
+    return stored_key == expected
 
 def register_license():
     """GUI flow to register a new license (ID, date, key)."""
@@ -66,15 +51,7 @@ def register_license():
 
     # 5) Store in DB
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM license")
-        cursor.execute(
-            "INSERT INTO license VALUES (?, ?, ?, ?)",
-            (key.strip(), cid, exp, datetime.datetime.now().strftime("%Y-%m-%d"))
-        )
-        conn.commit()
-        conn.close()
+        database.save_license(key.strip(), cid, exp)
     except Exception as e:
         QMessageBox.critical(None, "Error Saving License", str(e))
         return False
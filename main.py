@@ -1,12 +1,15 @@
+import argparse
 import os
 import sys
 from license_validator import validate_license, register_license
-from PyQt5.QtWidgets import QApplication
+from PyQt5.QtWidgets import QApplication, QMessageBox
 from PyQt5.QtCore import QCoreApplication
 from PyQt5.QtGui import QIcon
 import database
-from database import DB_PATH
+import db_service
+from backup import start_backup_scheduler, stop_backup_scheduler
 
+from ui.db_worker import stop_worker
 from ui.main_window import MainWindow
 
 def resource_path(relative_path):
@@ -19,20 +22,50 @@ def main():
     Main entry point for the application.
     Initializes the database and launches the GUI.
     """
+    # Client mode uses the database of a db_service.py server on the LAN
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--server", default=os.environ.get("RETAIL_DB_SERVER"))
+    args, qt_args = parser.parse_known_args()
+
     # Initialize the PyQt application FIRST
-    app = QApplication(sys.argv)
+    app = QApplication(sys.argv[:1] + qt_args)
     app.setStyle('Fusion')
 
+    if args.server:
+        # The server migrates, archives and backs up the database itself
+        try:
+            client = db_service.connect(args.server)
+        except db_service.RemoteError as e:
+            print(f"Error connecting to the database server: {e}")
+            return
+    else:
+        # Create the database or migrate it; the license table lives there too
+        try:
+            database.create_database()
+        except database.MigrationError as e:
+            # Never run on a database the code does not match
+            print(f"Error upgrading the database: {e}")
+            QMessageBox.critical(None, "Database Error", f"The database could not be upgraded:\n\n{e}")
+            return
+
+        # Stock snapshots for the months completed since the last start
+        database.take_stock_snapshots()
+
+        # Move sales older than ARCHIVE_AFTER_DAYS out of the live database
+        database.archive_sales()
+
     # License validation AFTER QApplication is ready
-    if not validate_license():
+    if args.server:
+        # Licenses are registered on the server machine only
+        if not client.call("license_valid"):
+            print("Invalid or expired license. Register it on the database server machine.")
+            return
+    elif not validate_license():
         print("Invalid or expired license. Starting registration process.")
         if not register_license():
             print("License registration failed or cancelled.")
             return
 
-    # Create the database if it doesn't exist
-    database.create_database()
-
     # Load stylesheet
     try:
         qss_path = resource_path("style.qss")
@@ -41,6 +74,18 @@ def main():
     except Exception as e:
         print(f"Error loading stylesheet: {e}")
 
+    # Stop the background threads, then release the connections
+    if args.server:
+        app.aboutToQuit.connect(stop_worker)
+        app.aboutToQuit.connect(client.close)
+    else:
+        # Back up the database in the background once a day
+        start_backup_scheduler()
+
+        app.aboutToQuit.connect(stop_backup_scheduler)
+        app.aboutToQuit.connect(stop_worker)
+        app.aboutToQuit.connect(database.close_connections)
+
     # Create main window
     window = MainWindow()
     window.show()
@@ -0,0 +1,50 @@
+"""
+Money helpers.
+
+Prices, profit and revenue are stored and passed around as integer cents,
+so sums are exact. Floats only appear at the edges: spin boxes take and
+return dollars, and labels show formatted strings.
+"""
+
+CURRENCY_SYMBOL = "$"
+
+def to_cents(amount):
+    """
+    Convert a dollar amount to integer cents.
+
+    Args:
+        amount (float): Amount in dollars, e.g. from a QDoubleSpinBox
+
+    Returns:
+        int: Amount in cents, rounded to the nearest cent
+    """
+    return int(round(amount * 100))
+
+def from_cents(cents):
+    """
+    Convert integer cents to dollars for widgets that edit amounts.
+
+    Args:
+        cents (int): Amount in cents
+
+    Returns:
+        float: Amount in dollars
+    """
+    return cents / 100
+
+def format_money(cents):
+    """
+    Format cents for display, e.g. 123456 -> "$1234.56", -500 -> "-$5.00".
+
+    Uses integer arithmetic only, so there is no float rounding on the way.
+
+    Args:
+        cents (int): Amount in cents
+
+    Returns:
+        str: The formatted amount
+    """
+    cents = int(cents or 0)
+    sign = "-" if cents < 0 else ""
+    dollars, cents = divmod(abs(cents), 100)
+    return f"{sign}{CURRENCY_SYMBOL}{dollars}.{cents:02d}"
@@ -0,0 +1,35 @@
+import os
+import sys
+import time
+
+import pytest
+
+# The modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """A fresh, migrated database in a temporary folder, used as DB_PATH"""
+    path = str(tmp_path / "shop.db")
+    monkeypatch.setattr(database, "DB_PATH", path)
+    database.catalog_cache.invalidate_categories()
+    database.catalog_cache.invalidate_products()
+    database.create_database()
+    yield path
+    database.close_connections()
+    database.catalog_cache.invalidate_categories()
+    database.catalog_cache.invalidate_products()
+
+@pytest.fixture
+def sell_on():
+    """Record a one-unit sale dated noon of a given day, returns its id"""
+    def sell(key_number, day):
+        sale_id = database.record_sale(key_number, 1, 2000)
+        sale_ts = int(time.mktime(time.strptime(f"{day} 12:00", "%Y-%m-%d %H:%M")))
+        with database.write_connection() as conn:
+            conn.execute("UPDATE sales SET sale_ts = ? WHERE id = ?", (sale_ts, sale_id))
+            conn.commit()
+        return sale_id
+    return sell
@@ -0,0 +1,45 @@
+import analytics
+import database
+
+def test_cached_arrays_append_new_sales(db_path):
+    engine = analytics.SalesAnalytics()
+    database.add_product(1, "Mattress", 1000, 2000, 50)
+    first = database.record_sale(1, 1, 2000)
+    assert engine.refresh() == 1
+    assert engine.refresh() == 0
+
+    fetched_after = []
+    fetch = engine._fetch
+    def recording_fetch(after_id):
+        fetched_after.append(after_id)
+        return fetch(after_id)
+    engine._fetch = recording_fetch
+
+    database.record_sale(1, 2, 2000)
+    assert engine.margin_by_product()[0]["quantity"] == 3
+    # Only the rows after the cached ones were read
+    assert fetched_after == [first]
+
+    # A deleted sale forces the full reload
+    database.delete_sale(first)
+    assert engine.refresh() == -1
+    assert engine.margin_by_product()[0]["quantity"] == 2
+
+def test_top_customers_rank_by_revenue_without_walk_ins(db_path, monkeypatch):
+    monkeypatch.setattr(analytics, "sales_analytics", analytics.SalesAnalytics())
+    database.add_product(1, "Mattress", 1000, 2000, 50)
+    asha = database.add_customer("Asha")
+    ben = database.add_customer("Ben")
+    database.record_sale(1, 1, 2000, customer_id=asha)
+    database.record_sale(1, 3, 2000, customer_id=ben)
+    database.record_sale(1, 1, 2000)
+
+    top = analytics.get_top_customers(limit=5)
+
+    assert [(customer["rank"], customer["name"], customer["quantity"]) for customer in top] == [
+        (1, "Ben", 3),
+        (2, "Asha", 1),
+    ]
+    assert top[0]["revenue"] == 6000
+    assert top[0]["share"] == 60.0
+    assert analytics.get_top_customers(limit=1) == top[:1]
@@ -0,0 +1,53 @@
+import os
+import sqlite3
+
+import backup
+import database
+
+def _archived_sale_count(db_path):
+    archive_dir = database.get_archive_dir(db_path)
+    total = 0
+    for file_name in os.listdir(archive_dir):
+        if file_name.endswith(".db"):
+            conn = sqlite3.connect(os.path.join(archive_dir, file_name))
+            total += conn.execute("SELECT COUNT(*) FROM sales").fetchone()[0]
+            conn.close()
+    return total
+
+def test_restore_after_archiving_brings_back_the_archives(db_path, sell_on, tmp_path):
+    database.add_product(1, "Mattress", 1000, 2000, 50)
+    sell_on(1, "2021-03-01")
+    sell_on(1, "2022-06-01")
+    database.record_sale(1, 1, 2000)
+    assert database.rebuild_sales_rollup()
+    assert database.archive_sales() == {2021: 1, 2022: 1}
+
+    result = backup.backup_database(directory=str(tmp_path / "backups"))
+    assert len(result["sales_archives"]) == 2
+
+    # Archive a later sale and lose an archive file after the backup
+    sell_on(1, "2023-01-10")
+    assert database.archive_sales() == {2023: 1}
+    os.remove(os.path.join(database.get_archive_dir(db_path), "shop-sales-2021.db"))
+
+    assert backup.restore_backup(result["path"], backup_current=False)
+
+    assert [archive["year"] for archive in database.get_sales_archives()] == [2021, 2022]
+    archive_files = sorted(os.listdir(database.get_archive_dir(db_path)))
+    assert archive_files[:2] == ["shop-sales-2021.db", "shop-sales-2022.db"]
+    assert archive_files[2].startswith("shop-sales-2023.db.replaced-")
+    assert _archived_sale_count(db_path) == 2
+    assert database.query_sales(start="2020-01-01")["totals"]["count"] == 3
+
+def test_prune_deletes_the_archive_copies(db_path, sell_on, tmp_path):
+    database.add_product(1, "Mattress", 1000, 2000, 50)
+    sell_on(1, "2021-03-01")
+    assert database.archive_sales() == {2021: 1}
+
+    directory = str(tmp_path / "backups")
+    result = backup.backup_database(directory=directory)
+    assert len(os.listdir(directory)) == 2
+
+    # Keeps nothing
+    assert backup.prune_backups(directory, policy={"last": 0}) == [result["path"]]
+    assert os.listdir(directory) == []
@@ -0,0 +1,188 @@
+import os
+import sqlite3
+import threading
+
+import database
+
+def test_clear_sales_history_clears_archived_sales(db_path, sell_on):
+    database.add_product(1, "Mattress", 1000, 2000, 50)
+    sell_on(1, "2021-03-01")
+    database.record_sale(1, 1, 2000)
+    assert database.rebuild_sales_rollup()
+    assert database.archive_sales() == {2021: 1}
+    assert database.get_total_profit() == 2000
+
+    assert database.clear_sales_history() == 2
+
+    assert database.get_total_profit() == 0
+    assert database.get_sales_archives() == []
+    assert not [name for name in os.listdir(database.get_archive_dir()) if name.endswith(".db")]
+    assert database.query_sales(start="2020-01-01")["totals"]["count"] == 0
+    assert database.get_product_by_key(1)["remaining"] == 50
+
+def test_delete_sale_returns_the_stock(db_path):
+    database.add_product(1, "Mattress", 1000, 2000, 5)
+    sale_id = database.record_sale(1, 2, 2000)
+    assert database.get_product_by_key(1)["remaining"] == 3
+
+    assert database.delete_sale(sale_id)
+    assert not database.delete_sale(sale_id)
+    assert database.get_product_by_key(1)["remaining"] == 5
+    assert database.generate_bill_data(1) is None
+
+def test_delete_category_moves_its_products(db_path):
+    category_id = database.add_category("Pillows")
+    database.add_product(1, "Pillow", 500, 900, 5, category_id=category_id)
+
+    assert not database.delete_category(1)
+    assert database.delete_category(category_id)
+    assert database.get_product_by_key(1)["category_id"] == 1
+    assert database.get_category_by_id(category_id) is None
+
+def test_catalog_writes_report_their_own_results(db_path):
+    assert database.add_category("Pillows") is not None
+    assert database.add_category("Pillows") is None
+    assert not database.update_category(999, "Nothing", "")
+    assert database.add_product(1, "Mattress", 1000, 2000, 5)
+    assert not database.update_product(2, name="Missing")
+    assert database.update_product(1, name="Queen mattress")
+    assert database.get_product_by_key(1)["name"] == "Queen mattress"
+
+    database.record_sale(1, 1, 2000)
+    assert not database.delete_product(1)
+    assert database.add_product(2, "Topper", 500, 900, 3)
+    assert database.delete_product(2)
+    assert database.get_product_by_key(2) is None
+
+def test_queued_writes_commit_together_with_their_own_errors(db_path):
+    futures = [database.add_product(key, f"P{key}", 100, 200, 1, wait=False) for key in range(1, 51)]
+    duplicate = database.add_product(7, "Again", 1, 1, 1, wait=False)
+    database.flush_writes()
+
+    assert all(future.result() for future in futures)
+    assert duplicate.result() is False
+    assert len(database.get_all_products()) == 50
+    assert database.get_product_by_key(7)["name"] == "P7"
+
+def test_catalog_cache_notices_foreign_writes_around_local_ones(db_path):
+    database.add_product(1, "Mattress", 1000, 2000, 5)
+    database.add_product(2, "Pillow", 500, 900, 5)
+    assert database.get_product_by_key(1)["name"] == "Mattress"
+
+    other = database.sqlite3.connect(db_path)
+    try:
+        # Another process renames a product, then we sell one
+        with other:
+            other.execute("UPDATE products SET name = 'Sofa bed' WHERE key_number = 1")
+        database.record_sale(2, 1, 900)
+        assert database.get_product_by_key(1)["name"] == "Sofa bed"
+
+        # We sell one, then another process renames a product
+        database.record_sale(2, 1, 900)
+        with other:
+            other.execute("UPDATE products SET name = 'Futon' WHERE key_number = 1")
+        assert database.get_product_by_key(1)["name"] == "Futon"
+    finally:
+        other.close()
+
+def test_archived_sales_are_flagged_and_not_deleted(db_path, sell_on):
+    database.add_product(1, "Mattress", 1000, 2000, 5)
+    archived_id = sell_on(1, "2021-03-01")
+    live_id = database.record_sale(1, 1, 2000)
+    assert database.rebuild_sales_rollup()
+    assert database.archive_sales() == {2021: 1}
+
+    sales = database.query_sales(start="2020-01-01")["sales"]
+    assert {sale["id"]: sale["archived"] for sale in sales} == {live_id: 0, archived_id: 1}
+    assert [sale["archived"] for sale in database.query_sales()["sales"]] == [0]
+
+    # The archive, its rollup days and the stock stay as they were
+    assert database.delete_sale(archived_id) is False
+    totals = database.query_sales(start="2020-01-01")["totals"]
+    assert (totals["count"], totals["revenue"]) == (2, 4000)
+    assert database.get_product_by_key(1)["remaining"] == 3
+
+    assert database.delete_sale(live_id) is True
+    assert [sale["id"] for sale in database.query_sales(start="2020-01-01")["sales"]] == [archived_id]
+    assert database.get_product_by_key(1)["remaining"] == 4
+
+def test_connections_close_with_their_thread(db_path):
+    with database.ConnectionManager(db_path) as manager:
+        def use():
+            with manager.reader() as conn:
+                conn.execute("SELECT COUNT(*) FROM products").fetchone()
+            with manager.writer() as conn:
+                conn.execute("SELECT COUNT(*) FROM products").fetchone()
+
+        threads = [threading.Thread(target=use) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+            thread.join()
+        # The last thread's two connections are left until a thread opens one
+        assert manager.connection_count() == 2
+
+        use()
+        assert manager.connection_count() == 2
+
+        # Connections of live threads are kept
+        ready, done = threading.Event(), threading.Event()
+        def hold():
+            use()
+            ready.set()
+            done.wait()
+        holder = threading.Thread(target=hold)
+        holder.start()
+        try:
+            ready.wait()
+            use()
+            assert manager.connection_count() == 4
+        finally:
+            done.set()
+            holder.join()
+
+def _query_plans(func, *args, **kwargs):
+    """Run a read function and return the query plan of each SELECT it ran"""
+    statements = []
+    # The calling thread gets the same pooled read connection back
+    with database.read_connection() as conn:
+        conn.set_trace_callback(statements.append)
+    try:
+        func(*args, **kwargs)
+    finally:
+        with database.read_connection() as conn:
+            conn.set_trace_callback(None)
+
+    conn = sqlite3.connect(database.DB_PATH)
+    try:
+        return [" | ".join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}"))
+                for sql in statements if sql.lstrip().upper().startswith("SELECT")]
+    finally:
+        conn.close()
+
+def test_sales_queries_use_the_sales_indexes(db_path):
+    database.add_product(1, "Mattress", 1000, 2000, 500)
+    customer_id = database.add_customer("Ann")
+    for i in range(50):
+        database.record_sale(1, 1, 2000, customer_id=customer_id if i % 2 else None)
+
+    def uses(plans, index):
+        return any(index in plan for plan in plans)
+
+    assert uses(_query_plans(database.query_sales), "SCAN s USING INDEX idx_sales_history_v3")
+    assert uses(_query_plans(database.query_sales, category_id=1), "SCAN s USING INDEX idx_sales_history_v3")
+    assert uses(_query_plans(database.query_sales, start="2020-01-01", end="2030-12-31"),
+                "SEARCH s USING INDEX idx_sales_history_v3 (sale_day>? AND sale_day<?)")
+    assert uses(_query_plans(database.get_sales_by_hour, "2020-01-01", "2030-12-31"),
+                "USING INDEX idx_sales_history_v3 (sale_day>? AND sale_day<?)")
+    assert uses(_query_plans(database.query_sales, key_number=1),
+                "SEARCH s USING INDEX idx_sales_key_v3 (key_number=?)")
+    assert uses(_query_plans(database.get_sales_by_category, 1),
+                "SEARCH s USING INDEX idx_sales_key_v3 (key_number=?)")
+    plans = _query_plans(database.query_sales, customer_id=customer_id)
+    # The totals and the page
+    assert sum("SEARCH s USING INDEX idx_sales_customer_v3 (customer_id=?)" in plan for plan in plans) == 2
+
+    # delete_product only checks the index for sales of the product
+    with database.read_connection() as conn:
+        plan = conn.execute("EXPLAIN QUERY PLAN SELECT EXISTS (SELECT 1 FROM sales WHERE key_number = ?)", (1,)).fetchall()
+    assert any("USING COVERING INDEX idx_sales_key_v3 (key_number=?)" in row[3] for row in plan)
@@ -0,0 +1,76 @@
+import json
+import socket
+
+import pytest
+
+import database
+import db_service
+
+TOKEN = "s3cret"
+
+@pytest.fixture
+def server(db_path):
+    """A server for the test database on a free loopback port"""
+    server = db_service.start_server("127.0.0.1", 0, token=TOKEN)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def _client(server, token):
+    host, port = server.server_address
+    return db_service.DatabaseClient(host, port, token=token)
+
+def test_lan_server_requires_a_token():
+    with pytest.raises(ValueError):
+        db_service.start_server("0.0.0.0", 0, token="")
+
+def test_calls_without_the_token_are_refused(server):
+    for token in ("", "wrong"):
+        client = _client(server, token)
+        try:
+            with pytest.raises(db_service.RemoteError, match="Invalid token"):
+                client.call("ping")
+        finally:
+            client.close()
+
+def test_record_cart_sale_round_trip(server):
+    database.add_product(1, "Mattress", 1000, 2000, 5)
+    database.add_product(2, "Pillow", 500, 900, 10)
+    client = _client(server, TOKEN)
+    try:
+        assert client.call("ping")
+        invoice_id = client.call("record_cart_sale", [
+            {"key_number": 1, "quantity": 1, "price": 2000},
+            {"key_number": 2, "quantity": 2, "price": 900},
+        ])
+        assert invoice_id
+
+        with client.batch() as batch:
+            bill = batch.call("generate_bill_data", invoice_id)
+            mattress = batch.call("get_product_by_key", 1)
+        assert bill.result()["total_amount"] == 3800
+        assert [line["quantity"] for line in bill.result()["lines"]] == [1, 2]
+        assert mattress.result()["remaining"] == 4
+
+        # A short cart is refused as a whole
+        assert client.call("record_cart_sale", [{"key_number": 1, "quantity": 9, "price": 2000}]) is None
+        assert database.get_product_by_key(1)["remaining"] == 4
+    finally:
+        client.close()
+
+def test_oversized_requests_are_refused(server, monkeypatch):
+    monkeypatch.setattr(db_service, "MAX_REQUEST_SIZE", 1024)
+    with socket.create_connection(server.server_address, timeout=5) as sock:
+        stream = sock.makefile("rwb")
+        stream.write(json.dumps({"token": TOKEN, "calls": [["ping", ["x" * 2000], {}]]}).encode("utf-8") + b"\n")
+        stream.flush()
+        assert "Request too large" in json.loads(stream.readline())["error"]
+        # The server drops the connection instead of reading the rest
+        assert stream.readline() == b""
+
+    # Requests within the limit still work
+    client = _client(server, TOKEN)
+    try:
+        assert client.call("ping")
+    finally:
+        client.close()
@@ -0,0 +1,23 @@
+from datetime import date, timedelta
+
+import database
+import forecasting
+
+def test_forecast_all_is_cached_until_sales_or_stock_change(db_path, sell_on):
+    forecaster = forecasting.DemandForecaster()
+    database.add_product(1, "Mattress", 1000, 2000, 50)
+    yesterday = (date.today() - timedelta(days=1)).isoformat()
+    sell_on(1, yesterday)
+
+    first = forecaster.forecast_all()
+    assert first[1]["daily_demand"] > 0
+    assert forecaster.forecast_all() is first
+
+    # A restock changes the days left without touching the history
+    database.adjust_stock(1, 50)
+    restocked = forecaster.forecast_all()
+    assert restocked is not first
+    assert restocked[1]["days_left"] > first[1]["days_left"]
+
+    sell_on(1, yesterday)
+    assert forecaster.forecast_all()[1]["daily_demand"] > restocked[1]["daily_demand"]
@@ -0,0 +1,160 @@
+import sqlite3
+
+import pytest
+
+import database
+
+# Schema of the releases before versioned migrations: money as REAL,
+# sale times as local text and images inline in products
+BASELINE_SCHEMA = '''
+CREATE TABLE categories (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL UNIQUE,
+    description TEXT
+);
+CREATE TABLE products (
+    key_number INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    purchase_price REAL NOT NULL,
+    sale_price REAL NOT NULL,
+    total_added INTEGER NOT NULL,
+    sold INTEGER DEFAULT 0,
+    image_path TEXT,
+    image_data TEXT,
+    category_id INTEGER DEFAULT 1,
+    FOREIGN KEY (category_id) REFERENCES categories(id)
+);
+CREATE TABLE customers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    phone TEXT,
+    email TEXT,
+    address TEXT,
+    created_at TEXT
+);
+CREATE TABLE sales (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key_number INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    sale_price REAL NOT NULL,
+    sale_date TEXT NOT NULL,
+    profit REAL NOT NULL,
+    customer_id INTEGER,
+    FOREIGN KEY (key_number) REFERENCES products (key_number),
+    FOREIGN KEY (customer_id) REFERENCES customers (id)
+);
+INSERT INTO categories (name, description) VALUES ('General', 'Default category for all products');
+INSERT INTO products (key_number, name, purchase_price, sale_price, total_added, sold)
+VALUES (1, 'Mattress', 10.10, 20.20, 10, 3), (2, 'Pillow', 4.99, 9.95, 5, 1);
+INSERT INTO customers (name, phone, created_at) VALUES ('Asha', '555-0101', '2023-01-05 10:00:00');
+INSERT INTO sales (key_number, quantity, sale_price, sale_date, profit, customer_id)
+VALUES (1, 2, 20.20, '2023-01-05 10:15:00', 20.20, 1),
+       (1, 1, 20.20, '2023-02-10 18:30:00', 10.10, NULL),
+       (2, 1, 9.95, '2023-02-11 09:00:00', 4.96, 1);
+'''
+
+# The same data after migrating, in cents with local sale days
+EXPECTED_PRODUCTS = [(1, 1010, 2020, 3), (2, 499, 995, 1)]
+EXPECTED_SALES = [
+    (1, 2020, 2020, "2023-01-05"),
+    (2, 2020, 1010, "2023-02-10"),
+    (3, 995, 496, "2023-02-11"),
+]
+EXPECTED_COUNTS = {"categories": 1, "products": 2, "customers": 1, "sales": 3, "invoices": 3}
+
+def _snapshot(path):
+    conn = sqlite3.connect(path)
+    try:
+        return {
+            "version": conn.execute("PRAGMA user_version").fetchone()[0],
+            "products": conn.execute(
+                "SELECT key_number, purchase_price, sale_price, sold FROM products ORDER BY key_number").fetchall(),
+            "sales": conn.execute(
+                "SELECT id, sale_price, profit, sale_day FROM sales ORDER BY id").fetchall(),
+            "counts": {
+                table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("categories", "products", "customers", "sales", "invoices")
+            },
+        }
+    finally:
+        conn.close()
+
+def _baseline_database(tmp_path, monkeypatch):
+    path = str(tmp_path / "shop.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.close()
+    monkeypatch.setattr(database, "DB_PATH", path)
+    return path
+
+def test_baseline_database_migrates_once(tmp_path, monkeypatch):
+    path = _baseline_database(tmp_path, monkeypatch)
+    try:
+        database.create_database()
+        migrated = _snapshot(path)
+
+        assert migrated["version"] == database.SCHEMA_VERSION
+        assert migrated["products"] == EXPECTED_PRODUCTS
+        assert migrated["sales"] == EXPECTED_SALES
+        assert migrated["counts"] == EXPECTED_COUNTS
+
+        # Running them again finds nothing to do and changes nothing
+        database.create_database()
+        assert _snapshot(path) == migrated
+    finally:
+        database.close_connections()
+        database.catalog_cache.clear()
+
+def test_failed_migration_leaves_the_database_unchanged(tmp_path, monkeypatch):
+    path = _baseline_database(tmp_path, monkeypatch)
+    migrations = list(database.MIGRATIONS)
+    # Fails after the cents migration has dropped the triggers and views
+    position = next(i for i, step in enumerate(migrations) if step[2] is database._migrate_sale_timestamps)
+    target, description, to_timestamps = migrations[position]
+
+    def interrupted(cursor):
+        to_timestamps(cursor)
+        raise sqlite3.OperationalError("disk I/O error")
+
+    failing = list(migrations)
+    failing[position] = (target, description, interrupted)
+    monkeypatch.setattr(database, "MIGRATIONS", failing)
+    try:
+        with pytest.raises(database.MigrationError, match=f"version {target}"):
+            database.create_database()
+
+        # Nothing of the chain was committed
+        conn = sqlite3.connect(path)
+        try:
+            assert conn.execute("PRAGMA user_version").fetchone()[0] == 0
+            prices = conn.execute("SELECT purchase_price, sale_price FROM products ORDER BY key_number").fetchall()
+            assert prices == [(10.1, 20.2), (4.99, 9.95)]
+            assert conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'table_versions'").fetchone()[0] == 0
+        finally:
+            conn.close()
+
+        monkeypatch.setattr(database, "MIGRATIONS", migrations)
+        database.create_database()
+        migrated = _snapshot(path)
+        assert migrated["version"] == database.SCHEMA_VERSION
+        assert migrated["products"] == EXPECTED_PRODUCTS
+        assert migrated["sales"] == EXPECTED_SALES
+        assert migrated["counts"] == EXPECTED_COUNTS
+
+        # The derived objects came back with the schema
+        assert database.record_sale(2, 1, 995)
+        assert database.get_product_by_key(2)["remaining"] == 3
+        assert [product["key_number"] for product in database.search_products("pillow")] == [2]
+    finally:
+        database.close_connections()
+        database.catalog_cache.clear()
+
+def test_check_migrations_reports_a_failure(tmp_path, monkeypatch):
+    path = _baseline_database(tmp_path, monkeypatch)
+
+    def broken(cursor):
+        raise sqlite3.OperationalError("no such table: nowhere")
+
+    monkeypatch.setattr(database, "MIGRATIONS", database.MIGRATIONS + [(database.SCHEMA_VERSION + 1, "Broken", broken)])
+    monkeypatch.setattr(database, "SCHEMA_VERSION", database.SCHEMA_VERSION + 1)
+    assert not database.check_migrations(path)
@@ -0,0 +1,80 @@
+import random
+import time
+
+import database
+
+# Latency target of a search at CATALOG_SIZE products
+CATALOG_SIZE = 100000
+TARGET_MS = 5
+
+def _fill_catalog(size):
+    """Add size products with names drawn from a small and a large vocabulary"""
+    rng = random.Random(1)
+    common = ["mattress", "pillow", "gel", "cool", "memory", "foam", "queen", "king", "twin", "soft",
+              "firm", "cotton", "latex", "spring", "hybrid", "topper", "cover", "quilt", "duvet", "sheet"]
+    rare = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(4, 9))) for _ in range(3000)]
+    with database.write_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany("INSERT INTO categories (name) VALUES (?)", [(f"Range {i}",) for i in range(50)])
+        # Load without the triggers and rebuild the index once, like a migration
+        database._drop_derived_objects(cursor)
+        cursor.executemany(
+            "INSERT INTO products (key_number, name, purchase_price, sale_price, total_added, category_id) "
+            "VALUES (?, ?, 1000, 2000, 10, ?)",
+            [(key_number,
+              " ".join(rng.choice(common) if rng.random() < 0.8 else rng.choice(rare) for _ in range(rng.randint(2, 5))),
+              rng.randint(1, 51))
+             for key_number in range(1, size + 1)]
+        )
+        database._sync_derived_objects(cursor)
+        conn.commit()
+
+def _median_ms(search, runs=15):
+    search()  # Warm the catalog cache and the page cache
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        search()
+        timings.append((time.perf_counter() - start) * 1000)
+    return sorted(timings)[runs // 2]
+
+def test_search_meets_the_latency_target(db_path):
+    _fill_catalog(CATALOG_SIZE)
+    category_id = database.get_all_categories()[7]["id"]
+
+    searches = {
+        "mattress gel cool": lambda: database.search_products("mattress gel cool", limit=50),
+        "q": lambda: database.search_products("q", limit=200),
+        "mattress in a category": lambda: database.search_products("mattress", limit=200, category_id=category_id),
+        "q in a category": lambda: database.search_products("q", limit=200, category_id=category_id),
+    }
+    for name, search in searches.items():
+        assert _median_ms(search) < TARGET_MS, name
+
+    # Filtering in the index still returns the best matches of the category
+    products = database.search_products("mattress", limit=200, category_id=category_id)
+    assert products and all(product["category_id"] == category_id for product in products)
+
+def test_search_ranks_and_filters(db_path):
+    general = database.get_all_categories()[0]["id"]
+    toppers = database.add_category("Toppers")
+    database.add_product(1, "Cool gel mattress", 1000, 2000, 5)
+    database.add_product(2, "Gel topper", 500, 900, 5, category_id=toppers)
+    database.add_product(3, "Mattress cover", 300, 500, 5)
+    database.add_product(12, "Pillow", 300, 500, 5)
+
+    assert [product["key_number"] for product in database.search_products("gel")] == [2, 1]
+    assert [product["key_number"] for product in database.search_products("mattress gel")] == [1]
+    assert [product["key_number"] for product in database.search_products("gel", category_id=general)] == [1]
+    assert [product["key_number"] for product in database.search_products("toppers")] == [2]
+    # The key number comes first, and category keys never match search words
+    assert [product["key_number"] for product in database.search_products("12")][0] == 12
+    assert database.search_products("1", category_id=toppers) == []
+
+    # Ranked matches fold case and diacritics like the index
+    database.add_product(4, "Café gel cushion", 300, 500, 5)
+    assert [product["key_number"] for product in database.search_products("CAFE GEL")] == [4]
+    assert [product["key_number"] for product in database.search_products("gel")] == [2, 1, 4]
+
+    database.update_product(2, category_id=general)
+    assert [product["key_number"] for product in database.search_products("gel", category_id=general)] == [2, 1, 4]
@@ -5,6 +5,7 @@ from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QIntValidator, QDoubleValidator
 
 import database
+from money import to_cents, format_money
 from ui.image_selector import ImageSelector
 
 class AddProductDialog(QDialog):
@@ -146,15 +147,15 @@ class AddProductDialog(QDialog):
     
     def update_profit_margin(self):
         """Calculate and display the profit margin"""
-        purchase_price = self.purchase_price_input.value()
-        sale_price = self.sale_price_input.value()
+        purchase_price = to_cents(self.purchase_price_input.value())
+        sale_price = to_cents(self.sale_price_input.value())
         
         if purchase_price > 0:
             profit = sale_price - purchase_price
             margin_percent = (profit / purchase_price) * 100
             
             # Update the label with the calculated margin
-            self.profit_margin_label.setText(f"${profit:.2f} ({margin_percent:.1f}%)")
+            self.profit_margin_label.setText(f"{format_money(profit)} ({margin_percent:.1f}%)")
             
             # Color code based on margin
             if margin_percent < 10:
@@ -176,14 +177,15 @@ class AddProductDialog(QDialog):
         # Get values from inputs
         key_number = int(self.key_number_input.text())
         name = self.name_input.text()
-        purchase_price = self.purchase_price_input.value()
-        sale_price = self.sale_price_input.value()
+        purchase_price = to_cents(self.purchase_price_input.value())
+        sale_price = to_cents(self.sale_price_input.value())
         total_added = self.quantity_input.value()
         category_id = self.category_combo.currentData()
         
         # Get image data
         image_path = self.image_selector.image_path
         image_data = self.image_selector.image_data
+        thumbnails = self.image_selector.thumbnails
         
         # Try to add the product
         success = database.add_product(
@@ -194,7 +196,8 @@ class AddProductDialog(QDialog):
             total_added,
             category_id,
             image_path,
-            image_data
+            image_data,
+            thumbnails
         )
         
         if success:
@@ -5,6 +5,7 @@ from PyQt5.QtCore import Qt
 from ui.inventory_widget import InventoryWidget
 from ui.sales_history_widget import SalesHistoryWidget
 from ui.category_management import CategoryManagementWidget
+from ui.reports_widget import ReportsWidget
 from ui.add_product_dialog import AddProductDialog
 import database
 
@@ -31,11 +32,13 @@ class AdminPanel(QWidget):
         self.category_management_widget = CategoryManagementWidget(
             on_category_changed=self.refresh_data
         )
+        self.reports_widget = ReportsWidget()
         
         # Add widgets to tabs
         self.tabs.addTab(self.inventory_widget, "Inventory")
         self.tabs.addTab(self.sales_history_widget, "Sales History")
         self.tabs.addTab(self.category_management_widget, "Categories")
+        self.tabs.addTab(self.reports_widget, "Reports")
         
         # Add tabs to layout
         self.layout.addWidget(self.tabs)
@@ -83,16 +86,22 @@ class AdminPanel(QWidget):
             self.refresh_data()
     
     def on_tab_changed(self, index):
-        """Handle tab change events to refresh data"""
+        """Handle tab change events to refresh data that changed"""
         if index == 0:  # Inventory tab
-            self.inventory_widget.refresh_inventory()
+            self.inventory_widget.refresh_if_changed()
         elif index == 1:  # Sales History tab
-            self.sales_history_widget.refresh_sales_history()
+            self.sales_history_widget.refresh_if_changed()
         elif index == 2:  # Categories tab
-            self.category_management_widget.refresh_categories()
+            self.category_management_widget.refresh_if_changed()
+        elif index == 3:  # Reports tab
+            self.reports_widget.refresh_if_changed()
+    
+    def refresh_if_changed(self):
+        """Refresh the current tab only if its data changed since it was loaded"""
+        self.on_tab_changed(self.tabs.currentIndex())
     
     def refresh_data(self):
-        """Refresh all data in the admin panel"""
+        """Refresh all data in the admin panel, whether it changed or not"""
         current_index = self.tabs.currentIndex()
         
         # Refresh the current tab
@@ -102,3 +111,5 @@ class AdminPanel(QWidget):
             self.sales_history_widget.refresh_sales_history()
         elif current_index == 2:
             self.category_management_widget.refresh_categories()
+        elif current_index == 3:
+            self.reports_widget.refresh_reports()
@@ -8,12 +8,13 @@ from datetime import datetime
 import os
 
 import database
+from money import format_money
 
 class BillPreviewDialog(QDialog):
     """
     Dialog for previewing and printing customer bills.
     """
-    def __init__(self, sale_id, parent=None):
+    def __init__(self, invoice_id, parent=None):
         super().__init__(parent)
         self.setWindowTitle("Bill Preview")
         self.setMinimumSize(800, 800)  # Larger minimum size
@@ -21,11 +22,11 @@ class BillPreviewDialog(QDialog):
         # Make the dialog maximized by default
         self.showMaximized()
         
-        # Store sale ID
-        self.sale_id = sale_id
+        # Store invoice ID
+        self.invoice_id = invoice_id
         
         # Get the bill data
-        self.bill_data = database.generate_bill_data(sale_id)
+        self.bill_data = database.generate_bill_data(invoice_id)
         if not self.bill_data:
             QMessageBox.critical(self, "Error", "Failed to generate bill data.")
             self.reject()
@@ -88,8 +89,7 @@ class BillPreviewDialog(QDialog):
             
         bill_date = self.bill_data.get("bill_date", "Unknown Date")
         customer = self.bill_data.get("customer", {"name": "Walk-in Customer", "phone": "", "email": "", "address": ""})
-        product = self.bill_data.get("product", {"name": "Unknown", "key_number": 0, "category": "Unknown", "unit_price": 0})
-        quantity = self.bill_data.get("quantity", 0)
+        lines = self.bill_data.get("lines", [])
         total_amount = self.bill_data.get("total_amount", 0)
         
         # Store the customer name prominently for the invoice
@@ -116,7 +116,7 @@ class BillPreviewDialog(QDialog):
         <body>
             <div class="header">
                 <h1>Retail Master</h1>
-                <p>Invoice #{self.sale_id}</p>
+                <p>Invoice #{self.invoice_id}</p>
                 <p>Date: {bill_date}</p>
             </div>
             
@@ -147,18 +147,26 @@ class BillPreviewDialog(QDialog):
                         <th>Quantity</th>
                         <th>Amount</th>
                     </tr>
+        """
+        
+        # One row per invoice line
+        for line in lines:
+            html += f"""
                     <tr>
-                        <td>{product['name']} (#{product['key_number']})</td>
-                        <td>{product['category']}</td>
-                        <td>${product['unit_price']:.2f}</td>
-                        <td>{quantity}</td>
-                        <td>${total_amount:.2f}</td>
+                        <td>{line['name']} (#{line['key_number']})</td>
+                        <td>{line['category']}</td>
+                        <td>{format_money(line['unit_price'])}</td>
+                        <td>{line['quantity']}</td>
+                        <td>{format_money(line['amount'])}</td>
                     </tr>
+            """
+        
+        html += f"""
                 </table>
             </div>
             
             <div class="total">
-                <h3>Total Amount: ${total_amount:.2f}</h3>
+                <h3>Total Amount: {format_money(total_amount)}</h3>
             </div>
             
             <div class="footer">
@@ -197,7 +205,7 @@ class BillPreviewDialog(QDialog):
         """Save the bill as a PDF file"""
         # Get file name from dialog
         file_name, _ = QFileDialog.getSaveFileName(
-            self, "Save Bill as PDF", f"Invoice_{self.sale_id}.pdf", "PDF Files (*.pdf)"
+            self, "Save Bill as PDF", f"Invoice_{self.invoice_id}.pdf", "PDF Files (*.pdf)"
         )
         
         if file_name:
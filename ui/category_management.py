@@ -68,6 +68,9 @@ class CategoryDialog(QDialog):
 class CategoryManagementWidget(QWidget):
     """Widget for managing product categories"""
     
+    # Tables whose changes make the table out of date
+    DATA_TABLES = ("categories",)
+    
     def __init__(self, on_category_changed=None):
         super().__init__()
         
@@ -146,6 +149,8 @@ class CategoryManagementWidget(QWidget):
     
     def refresh_categories(self):
         """Refresh the categories table with current data"""
+        database.data_versions.mark_seen(self, self.DATA_TABLES)
+        
         # Get all categories
         categories = database.get_all_categories()
         
@@ -182,6 +187,11 @@ class CategoryManagementWidget(QWidget):
                 name_item.setToolTip("Default category - cannot be deleted")
                 desc_item.setToolTip("Default category - cannot be deleted")
     
+    def refresh_if_changed(self):
+        """Reload the categories only if they changed since the last load"""
+        if database.data_versions.changed(self, self.DATA_TABLES):
+            self.refresh_categories()
+    
     def on_category_selected(self):
         """Handle category selection in the table"""
         selected_items = self.category_table.selectedItems()
@@ -4,6 +4,7 @@ from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QFont
 
 import database
+from ui.db_worker import get_worker
 
 class CustomerInfoDialog(QDialog):
     """
@@ -201,9 +202,27 @@ class CustomerInfoDialog(QDialog):
         layout.addLayout(button_layout)
     
     def load_existing_customers(self):
-        """Load existing customers from the database"""
-        self.all_customers = database.get_all_customers()
-        self.update_customer_combo()
+        """Load existing customers from the database in the background"""
+        self.all_customers = []
+        self.existing_customer.setEnabled(False)
+        self.existing_customer.addItem("Loading customers...")
+        get_worker().submit(
+            database.get_all_customers,
+            callback=self.show_existing_customers,
+            tag=(id(self), "customers")
+        )
+    
+    def show_existing_customers(self, customers):
+        """Fill the customer combo box once the customers are loaded"""
+        self.all_customers = customers
+        self.existing_customer.setEnabled(True)
+        # Apply anything typed into the search box while loading
+        self.filter_customers(self.customer_search.text())
+    
+    def done(self, result):
+        """Drop a customer load still pending when the dialog closes"""
+        get_worker().cancel((id(self), "customers"))
+        super().done(result)
     
     def update_customer_combo(self, filtered_customers=None):
         """Update the customer combo box with all or filtered customers"""
@@ -288,7 +307,7 @@ class CustomerInfoDialog(QDialog):
         elif customer_type == "existing":
             # Get the selected customer ID
             index = self.existing_customer.currentIndex()
-            if index >= 0:
+            if index >= 0 and self.existing_customer.itemData(index) is not None:
                 self.customer_id = self.existing_customer.itemData(index)
                 name = self.existing_customer.currentText().split("(")[0].strip()
                 print(f"Selected existing customer: {name}, ID: {self.customer_id}")
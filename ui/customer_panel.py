@@ -19,6 +19,9 @@ class CustomerPanel(QWidget):
     """
     Customer panel for viewing products and generating bills.
     """
+    # Tables whose changes make the category and product views out of date
+    DATA_TABLES = ("categories", "products", "product_images")
+    
     def __init__(self, on_sale_callback=None):
         super().__init__()
         
@@ -99,10 +102,16 @@ class CustomerPanel(QWidget):
     
     def refresh_data(self):
         """Refresh all data in the customer panel"""
+        database.data_versions.mark_seen(self, self.DATA_TABLES)
         self.refresh_categories()
         self.product_detail_widget.clear()
         self.bill_widget.refresh_product_list()
     
+    def refresh_if_changed(self):
+        """Refresh only the parts whose data changed since they were loaded"""
+        if database.data_versions.changed(self, self.DATA_TABLES):
+            self.refresh_data()
+    
     def refresh_categories(self):
         """Refresh the category list"""
         # Remember current selection
@@ -194,6 +203,6 @@ class CustomerPanel(QWidget):
     def on_sale_completed(self):
         """Handle completed sale event"""
         # Refresh the product data and notify parent window
-        self.refresh_data()
+        self.refresh_if_changed()
         if self.on_sale_callback:
             self.on_sale_callback()
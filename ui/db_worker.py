@@ -0,0 +1,144 @@
+import queue
+import threading
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+class DatabaseWorker(QThread):
+    """
+    Background thread running database calls for the UI.
+
+    Requests run one at a time in submission order on the worker thread,
+    which keeps its own pooled connections. Results are delivered to the
+    callbacks on the GUI thread. Requests sharing a tag supersede each
+    other: only the most recent one is run and reported, so an older
+    search can never overwrite the results of a newer one.
+    """
+    # Emitted on the worker thread, delivered on the GUI thread
+    _finished = pyqtSignal(int, object)
+    _failed = pyqtSignal(int, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._requests = {}  # request_id: (tag, callback, error_callback)
+        self._tags = {}      # tag: latest request_id
+
+        self._finished.connect(self._deliver_result)
+        self._failed.connect(self._deliver_error)
+
+    def submit(self, func, *args, callback=None, error_callback=None, tag=None, **kwargs):
+        """
+        Queue a database call.
+
+        Args:
+            func (callable): Function to run on the worker thread, usually from database
+            *args: Positional arguments for func
+            callback (callable, optional): Called with the result on the GUI thread
+            error_callback (callable, optional): Called with the error message on the GUI thread
+            tag (str, optional): Cancels any pending request with the same tag
+            **kwargs: Keyword arguments for func
+
+        Returns:
+            int: Request ID
+        """
+        with self._lock:
+            self._next_id += 1
+            request_id = self._next_id
+            if tag is not None:
+                stale_id = self._tags.get(tag)
+                if stale_id is not None:
+                    self._requests.pop(stale_id, None)
+                self._tags[tag] = request_id
+            self._requests[request_id] = (tag, callback, error_callback)
+
+        self._queue.put((request_id, func, args, kwargs))
+        return request_id
+
+    def cancel(self, tag):
+        """Drop the pending request with this tag, e.g. when its widget closes"""
+        with self._lock:
+            request_id = self._tags.pop(tag, None)
+            if request_id is not None:
+                self._requests.pop(request_id, None)
+
+    def is_pending(self, tag):
+        """Check whether a request with this tag has not been delivered yet"""
+        with self._lock:
+            return tag in self._tags
+
+    def stop(self):
+        """Finish the running request and stop the thread"""
+        self._queue.put(None)
+        self.wait()
+
+    def run(self):
+        while True:
+            request = self._queue.get()
+            if request is None:
+                break
+
+            request_id, func, args, kwargs = request
+            with self._lock:
+                if request_id not in self._requests:
+                    # Superseded or cancelled before it started
+                    continue
+
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                self._failed.emit(request_id, str(e))
+            else:
+                self._finished.emit(request_id, result)
+
+    def _take(self, request_id):
+        """Remove a finished request, returning its callbacks if still wanted"""
+        with self._lock:
+            entry = self._requests.pop(request_id, None)
+            if entry is not None and entry[0] is not None and self._tags.get(entry[0]) == request_id:
+                del self._tags[entry[0]]
+        return entry
+
+    def _deliver_result(self, request_id, result):
+        entry = self._take(request_id)
+        if entry is None or entry[1] is None:
+            return
+        try:
+            entry[1](result)
+        except Exception as e:
+            # Exceptions must not escape a Qt slot
+            print(f"Error handling database result: {e}")
+
+    def _deliver_error(self, request_id, message):
+        entry = self._take(request_id)
+        if entry is None:
+            return
+        print(f"Error in background database call: {message}")
+        if entry[2] is not None:
+            try:
+                entry[2](message)
+            except Exception as e:
+                print(f"Error handling database error: {e}")
+
+_worker = None
+
+def get_worker():
+    """
+    Return the shared database worker, starting it on first use.
+
+    Returns:
+        DatabaseWorker: The running worker
+    """
+    global _worker
+    if _worker is None:
+        _worker = DatabaseWorker()
+        _worker.start()
+    return _worker
+
+def stop_worker():
+    """Stop the shared database worker if it was started"""
+    global _worker
+    if _worker is not None:
+        _worker.stop()
+        _worker = None
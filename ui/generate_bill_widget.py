@@ -6,11 +6,29 @@ from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QFormLayout,
 from PyQt5.QtCore import Qt, pyqtSignal
 from PyQt5.QtGui import QFont, QPixmap, QImage, QTextDocument
 from PyQt5.QtPrintSupport import QPrinter, QPrintDialog, QPrintPreviewDialog
-import base64
 import os
 from datetime import datetime
 
 import database
+from money import to_cents, from_cents, format_money
+from ui.db_worker import get_worker
+from ui.image_cache import pixmap_cache
+
+def load_products(category_id):
+    """
+    Fetch the categories and the products of a category.
+
+    Runs on the database worker thread.
+
+    Returns:
+        tuple: (categories, products)
+    """
+    categories = database.get_all_categories()
+    if category_id is not None:
+        products = database.get_products_by_category(category_id)
+    else:
+        products = database.get_all_products()
+    return categories, products
 
 class GenerateBillWidget(QWidget):
     """
@@ -20,6 +38,9 @@ class GenerateBillWidget(QWidget):
     # Signal when a sale is completed
     sale_completed = pyqtSignal()
 
+    # Tables whose changes make the product list out of date
+    DATA_TABLES = ("categories", "products")
+
     def __init__(self, on_sale_callback=None):
         super().__init__()
 
@@ -251,9 +272,35 @@ class GenerateBillWidget(QWidget):
         self.layout.addLayout(buttons_layout)
 
     def refresh_product_list(self):
-        """Refresh the list of products in the combo box"""
+        """Reload the categories and products in the background"""
+        category_id = self.category_combo.currentData()
+        database.data_versions.mark_seen(self, self.DATA_TABLES)
+
+        # Keep the old list visible but unusable until the new one arrives
+        self.key_number_combo.setEnabled(False)
+        get_worker().submit(
+            load_products, category_id,
+            callback=lambda result: self.show_product_list(category_id, *result),
+            error_callback=lambda message: self.key_number_combo.setEnabled(True),
+            tag=(id(self), "products")
+        )
+
+    def refresh_if_changed(self):
+        """Reload the product list only if its tables changed since the last load"""
+        if database.data_versions.changed(self, self.DATA_TABLES):
+            self.refresh_product_list()
+
+    def show_product_list(self, category_id, categories, products):
+        """Fill the category and product combo boxes with the fetched data"""
+        self.key_number_combo.setEnabled(True)
+
         # Refresh categories in the dropdown
-        self.refresh_categories()
+        self.refresh_categories(categories)
+
+        # The selected category was deleted meanwhile, load the fallback selection
+        if self.category_combo.currentData() != category_id:
+            self.refresh_product_list()
+            return
 
         # Save the current selection if any
         current_key = self.key_number_combo.currentText() if self.key_number_combo.count() > 0 else ""
@@ -261,13 +308,6 @@ class GenerateBillWidget(QWidget):
         # Clear the combo box
         self.key_number_combo.clear()
 
-        # Get all products or products for the current category
-        category_id = self.category_combo.currentData()
-        if category_id is not None:
-            products = database.get_products_by_category(category_id)
-        else:
-            products = database.get_all_products()
-
         # Add products to combo box
         for product in products:
             if product["remaining"] > 0:  # Only show products with stock
@@ -282,7 +322,7 @@ class GenerateBillWidget(QWidget):
             if index >= 0:
                 self.key_number_combo.setCurrentIndex(index)
 
-    def refresh_categories(self):
+    def refresh_categories(self, categories):
         """Refresh the category dropdown for filtering products"""
         # Remember current selection
         current_id = self.category_combo.currentData()
@@ -295,7 +335,6 @@ class GenerateBillWidget(QWidget):
         self.category_combo.addItem("All Categories", None)
 
         # Add each category
-        categories = database.get_all_categories()
         selected_index = 0
 
         for i, category in enumerate(categories):
@@ -322,7 +361,7 @@ class GenerateBillWidget(QWidget):
                     self.product_name.setText(product["name"])
 
                     # Set the product sale price from product
-                    self.product_sale_price.setValue(product["sale_price"])
+                    self.product_sale_price.setValue(from_cents(product["sale_price"]))
 
                     self.available_qty.setText(str(product["remaining"]))
 
@@ -343,6 +382,7 @@ class GenerateBillWidget(QWidget):
         self.product_name.clear()
         self.product_sale_price.setValue(0)
         self.available_qty.clear()
+        pixmap_cache.cancel((id(self), "image"))
         self.product_image.clear()
         self.add_to_cart_btn.setEnabled(False)
 
@@ -351,29 +391,26 @@ class GenerateBillWidget(QWidget):
         # Clear previous image
         self.product_image.clear()
 
-        # Try to load image from image_data first
-        image_data = product.get("image_data")
-        if image_data:
-            try:
-                # Decode from base64 to binary
-                binary_data = base64.b64decode(image_data)
-                image = QImage()
-                image.loadFromData(binary_data)
-                pixmap = QPixmap.fromImage(image)
+        # Use the cached bill-size thumbnail of the stored image first
+        if product.get("has_image"):
+            self.product_image.setText("Loading...")
+            pixmap_cache.get(
+                product["key_number"], "bill",
+                lambda pixmap: self.show_product_image(product, pixmap),
+                tag=(id(self), "image")
+            )
+            return
 
-                if not pixmap.isNull():
-                    # Resize pixmap to fit label while maintaining aspect ratio
-                    pixmap = pixmap.scaled(
-                        100, 80, 
-                        Qt.KeepAspectRatio, 
-                        Qt.SmoothTransformation
-                    )
-                    self.product_image.setPixmap(pixmap)
-                    return
-            except Exception as e:
-                print(f"Error loading image from data: {e}")
+        pixmap_cache.cancel((id(self), "image"))
+        self.show_product_image(product, None)
 
-        # If no image_data or loading failed, try image_path
+    def show_product_image(self, product, pixmap):
+        """Show a loaded thumbnail, falling back to the image path"""
+        if pixmap is not None:
+            self.product_image.setPixmap(pixmap)
+            return
+
+        # If no stored image or loading failed, try image_path
         image_path = product.get("image_path")
         if image_path and os.path.exists(image_path):
             try:
@@ -401,7 +438,7 @@ class GenerateBillWidget(QWidget):
 
         key_number = self.key_number_combo.itemData(index)
         product_name = self.product_name.text()
-        sale_price = self.product_sale_price.value()
+        sale_price = to_cents(self.product_sale_price.value())
         quantity = self.quantity_input.value()
 
         # Get product details for profit calculation
@@ -475,7 +512,7 @@ class GenerateBillWidget(QWidget):
             self.cart_table.setItem(row, 1, QTableWidgetItem(item["name"]))
 
             # Price
-            price_item = QTableWidgetItem(f"${item['price']:.2f}")
+            price_item = QTableWidgetItem(format_money(item["price"]))
             price_item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
             self.cart_table.setItem(row, 2, price_item)
 
@@ -485,7 +522,7 @@ class GenerateBillWidget(QWidget):
             self.cart_table.setItem(row, 3, qty_item)
 
             # Total
-            total_item = QTableWidgetItem(f"${item['total']:.2f}")
+            total_item = QTableWidgetItem(format_money(item["total"]))
             total_item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
             self.cart_table.setItem(row, 4, total_item)
 
@@ -533,7 +570,7 @@ class GenerateBillWidget(QWidget):
     def update_bill_preview(self):
         """Update the bill preview based on current inputs"""
         # Update the single product selection preview
-        sale_price = self.product_sale_price.value()
+        sale_price = to_cents(self.product_sale_price.value())
         quantity = self.quantity_input.value()
         single_total = sale_price * quantity
 
@@ -542,11 +579,11 @@ class GenerateBillWidget(QWidget):
 
         # Show total amount
         total = cart_total
-        self.total_amount.setText(f"${total:.2f}")
+        self.total_amount.setText(format_money(total))
 
         # Calculate profit from cart items
         profit = sum((item["price"] - item["purchase_price"]) * item["quantity"] for item in self.cart_items)
-        self.profit_amount.setText(f"${profit:.2f}")
+        self.profit_amount.setText(format_money(profit))
 
         # Update date/time
         self.date_display.setText(datetime.now().strftime("%Y-%m-%d %H:%M"))
@@ -576,7 +613,7 @@ class GenerateBillWidget(QWidget):
         confirm_msg_box = QMessageBox(
             QMessageBox.Question,
             "Complete Sale",
-            f"Complete this sale for ${total:.2f}?"
+            f"Complete this sale for {format_money(total)}?"
         )
         confirm_msg_box.setStyleSheet("QLabel { font-size: 11pt; }")
         confirm_msg_box.addButton(QMessageBox.Yes)
@@ -592,65 +629,63 @@ class GenerateBillWidget(QWidget):
 
             if result == QDialog.Accepted:
                 customer_id = customer_dialog.get_customer_id()
-                success = True
-                last_sale_id = None
-
-                # Record each item as a separate sale
-                for item in self.cart_items:
-                    sale_id = database.record_sale(
-                        item["key_number"],
-                        item["quantity"],
-                        item["price"],
-                        customer_id
-                    )
 
-                    if not sale_id:
-                        success = False
-                        error_msg_box = QMessageBox(
-                            QMessageBox.Warning,
-                            "Error",
-                            f"Failed to record sale for product {item['name']} (Key: {item['key_number']}).\n"
-                            f"Please check that the product exists and has sufficient stock."
-                        )
-                        error_msg_box.setStyleSheet("QLabel { font-size: 11pt; }")
-                        error_msg_box.exec_()
-                    else:
-                        last_sale_id = sale_id
-
-                if success:
-                    msg_box = QMessageBox(QMessageBox.Information, "Sale Completed", f"Sale recorded successfully!\n\nTotal Amount: ${total:.2f}")
-                    msg_box.setStyleSheet("QLabel { font-size: 11pt; }")  # Set smaller font size
-                    msg_box.exec_()
-
-                    # Show print bill option with smaller font
-                    if last_sale_id:
-                        print_msg_box = QMessageBox(
-                            QMessageBox.Question,
-                            "Print Bill",
-                            "Would you like to print a bill for this sale?"
-                        )
-                        print_msg_box.setStyleSheet("QLabel { font-size: 11pt; }")
-                        print_msg_box.addButton(QMessageBox.Yes)
-                        print_msg_box.addButton(QMessageBox.No)
-                        print_msg_box.setDefaultButton(QMessageBox.Yes)
-                        print_reply = print_msg_box.exec_()
-
-                        if print_reply == QMessageBox.Yes:
-                            from ui.bill_printer import BillPreviewDialog
-                            bill_dialog = BillPreviewDialog(last_sale_id, self)
-                            bill_dialog.exec_()
-
-                    # Clear the cart and form
-                    self.cart_items = []
-                    self.update_cart_table()
-                    self.clear_form()
-
-                    # Refresh the product list
-                    self.refresh_product_list()
-
-                    # Notify about the completed sale
-                    if self.on_sale_callback:
-                        self.on_sale_callback()
+                # Record the whole cart as one invoice, all lines or none.
+                # The widget stays disabled until the database answers.
+                self.setEnabled(False)
+                get_worker().submit(
+                    database.record_cart_sale, list(self.cart_items), customer_id,
+                    callback=lambda invoice_id: self.on_sale_recorded(invoice_id, total),
+                    error_callback=lambda message: self.on_sale_recorded(None, total)
+                )
+
+    def on_sale_recorded(self, invoice_id, total):
+        """Report the outcome of complete_sale"""
+        self.setEnabled(True)
+
+        if not invoice_id:
+            error_msg_box = QMessageBox(
+                QMessageBox.Warning,
+                "Error",
+                "Failed to record the sale. No items were sold.\n"
+                "Please check that every product exists and has sufficient stock."
+            )
+            error_msg_box.setStyleSheet("QLabel { font-size: 11pt; }")
+            error_msg_box.exec_()
+            return
+
+        msg_box = QMessageBox(QMessageBox.Information, "Sale Completed", f"Sale recorded successfully!\n\nTotal Amount: {format_money(total)}")
+        msg_box.setStyleSheet("QLabel { font-size: 11pt; }")  # Set smaller font size
+        msg_box.exec_()
+
+        # Show print bill option with smaller font
+        print_msg_box = QMessageBox(
+            QMessageBox.Question,
+            "Print Bill",
+            "Would you like to print a bill for this sale?"
+        )
+        print_msg_box.setStyleSheet("QLabel { font-size: 11pt; }")
+        print_msg_box.addButton(QMessageBox.Yes)
+        print_msg_box.addButton(QMessageBox.No)
+        print_msg_box.setDefaultButton(QMessageBox.Yes)
+        print_reply = print_msg_box.exec_()
+
+        if print_reply == QMessageBox.Yes:
+            from ui.bill_printer import BillPreviewDialog
+            bill_dialog = BillPreviewDialog(invoice_id, self)
+            bill_dialog.exec_()
+
+        # Clear the cart and form
+        self.cart_items = []
+        self.update_cart_table()
+        self.clear_form()
+
+        # Refresh the product list
+        self.refresh_product_list()
+
+        # Notify about the completed sale
+        if self.on_sale_callback:
+            self.on_sale_callback()
 
     def clear_form(self):
         """Clear all form inputs"""
@@ -0,0 +1,144 @@
+from collections import OrderedDict
+
+from PyQt5.QtCore import Qt, QBuffer, QByteArray, QIODevice
+from PyQt5.QtGui import QPixmap, QImage
+
+import database
+from ui.db_worker import get_worker
+
+# Thumbnail sizes used by the UI (name: (width, height))
+THUMBNAIL_SIZES = {
+    "bill": (100, 80),      # GenerateBillWidget preview
+    "detail": (200, 200),   # Product detail panel and image selector
+    "grid": (120, 120),     # Product grids and lists
+}
+
+# Maximum number of decoded pixmaps kept in memory
+PIXMAP_CACHE_SIZE = 256
+
+def make_thumbnails(image_data):
+    """
+    Scale an image to every thumbnail size.
+
+    Args:
+        image_data (bytes): Raw image file contents
+
+    Returns:
+        dict: Encoded thumbnail bytes keyed by size name, empty if the image can't be read
+    """
+    image = QImage()
+    if not image_data or not image.loadFromData(image_data):
+        return {}
+
+    # Keep transparency where the original has it, photos compress better as JPEG
+    image_format = "PNG" if image.hasAlphaChannel() else "JPG"
+
+    thumbnails = {}
+    for size, (width, height) in THUMBNAIL_SIZES.items():
+        scaled = image.scaled(width, height, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        data = QByteArray()
+        buffer = QBuffer(data)
+        buffer.open(QIODevice.WriteOnly)
+        scaled.save(buffer, image_format, 90)
+        buffer.close()
+        thumbnails[size] = bytes(data)
+
+    return thumbnails
+
+def _load_thumbnail(key_number, size):
+    """
+    Read an encoded thumbnail, generating the missing ones from the original image.
+
+    Runs on the database worker, so it only uses QImage and never waits for
+    the thumbnail write to commit.
+    """
+    data = database.get_product_thumbnail(key_number, size)
+    if data is None:
+        thumbnails = make_thumbnails(database.get_product_image(key_number))
+        if thumbnails:
+            database.save_product_thumbnails(key_number, thumbnails, wait=False)
+        data = thumbnails.get(size)
+    return data
+
+class PixmapCache:
+    """
+    In-process LRU cache of thumbnail pixmaps keyed by product and size.
+
+    Misses are read on the database worker from the stored thumbnails.
+    Products saved before thumbnails existed get them generated from the
+    original image once, also on the worker.
+    """
+    def __init__(self, max_entries=PIXMAP_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._pixmaps = OrderedDict()
+        self._generation = 0  # Bumped when cached images go stale
+
+    def get(self, key_number, size, callback, tag=None):
+        """
+        Deliver the thumbnail pixmap of a product.
+
+        Cached pixmaps are delivered right away. Misses are loaded on the
+        database worker and delivered later on the GUI thread, so callers
+        should show a placeholder until the callback runs.
+
+        Args:
+            key_number (int): The key number of the product
+            size (str): A key of THUMBNAIL_SIZES
+            callback (callable): Called with the QPixmap, or None if the product
+                has no usable image
+            tag (hashable, optional): Supersedes the pending load with the same tag,
+                e.g. one per image label
+
+        Returns:
+            bool: True if the callback already ran
+        """
+        cache_key = (key_number, size)
+        pixmap = self._pixmaps.get(cache_key)
+        if pixmap is not None:
+            self._pixmaps.move_to_end(cache_key)
+            self.cancel(tag)
+            callback(pixmap)
+            return True
+
+        generation = self._generation
+        get_worker().submit(
+            _load_thumbnail, key_number, size,
+            callback=lambda data: callback(self._store(cache_key, data, generation)),
+            error_callback=lambda message: callback(None),
+            tag=tag
+        )
+        return False
+
+    def cancel(self, tag):
+        """Drop the pending load with this tag, e.g. when its label shows something else"""
+        if tag is not None:
+            get_worker().cancel(tag)
+
+    def _store(self, cache_key, data, generation):
+        """Decode a loaded thumbnail on the GUI thread and cache it unless it went stale"""
+        if data is None:
+            return None
+
+        pixmap = QPixmap()
+        if not pixmap.loadFromData(data):
+            return None
+
+        if generation == self._generation:
+            self._pixmaps[cache_key] = pixmap
+            if len(self._pixmaps) > self.max_entries:
+                self._pixmaps.popitem(last=False)
+        return pixmap
+
+    def invalidate(self, key_number):
+        """Drop every cached size of a product, e.g. after its image changed"""
+        self._generation += 1
+        for cache_key in [k for k in self._pixmaps if k[0] == key_number]:
+            del self._pixmaps[cache_key]
+
+    def clear(self):
+        """Drop all cached pixmaps"""
+        self._generation += 1
+        self._pixmaps.clear()
+
+# Shared cache used by all widgets
+pixmap_cache = PixmapCache()
@@ -1,16 +1,17 @@
 from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel, 
                             QPushButton, QFileDialog, QMessageBox)
 from PyQt5.QtCore import Qt, pyqtSignal
-from PyQt5.QtGui import QPixmap, QImage
-import base64
+from PyQt5.QtGui import QPixmap
 import os
 
+from ui.image_cache import make_thumbnails, pixmap_cache
+
 class ImageSelector(QWidget):
     """
     Widget for selecting and displaying product images.
     """
     # Signal emitted when an image is selected
-    image_selected = pyqtSignal(str, str)  # image_path, image_data
+    image_selected = pyqtSignal(str, bytes)  # image_path, image_data
     
     def __init__(self):
         super().__init__()
@@ -18,6 +19,10 @@ class ImageSelector(QWidget):
         # Store image data
         self.image_path = None
         self.image_data = None
+        self.thumbnails = None
+        
+        # Whether a stored product image is shown without its data loaded
+        self.has_stored_image = False
         
         # Create layout
         self.layout = QVBoxLayout(self)
@@ -57,25 +62,24 @@ class ImageSelector(QWidget):
         
         if file_path:
             try:
-                # Load the image
-                pixmap = QPixmap(file_path)
-                if not pixmap.isNull():
-                    # Resize pixmap to fit label while maintaining aspect ratio
-                    pixmap = pixmap.scaled(
-                        self.image_label.width(), 
-                        200, 
-                        Qt.KeepAspectRatio, 
-                        Qt.SmoothTransformation
-                    )
+                # Read the raw image bytes
+                with open(file_path, "rb") as image_file:
+                    image_data = image_file.read()
+                
+                # Scale the image once to every thumbnail size at ingest
+                thumbnails = make_thumbnails(image_data)
+                if thumbnails:
+                    # A stored image still loading must not replace the selection
+                    pixmap_cache.cancel((id(self), "image"))
+                    pixmap = QPixmap()
+                    pixmap.loadFromData(thumbnails["detail"])
                     self.image_label.setPixmap(pixmap)
                     
-                    # Store image path
+                    # Store image path, data and thumbnails
                     self.image_path = file_path
-                    
-                    # Store image data as base64
-                    with open(file_path, "rb") as image_file:
-                        binary_data = image_file.read()
-                        self.image_data = base64.b64encode(binary_data).decode('utf-8')
+                    self.image_data = image_data
+                    self.thumbnails = thumbnails
+                    self.has_stored_image = False
                     
                     # Emit signal
                     self.image_selected.emit(self.image_path, self.image_data)
@@ -86,51 +90,54 @@ class ImageSelector(QWidget):
     
     def clear_image(self):
         """Clear the selected image"""
+        pixmap_cache.cancel((id(self), "image"))
         self.image_label.clear()
         self.image_label.setText("No image selected")
         
         # Clear stored image data
-        old_path = self.image_path
-        old_data = self.image_data
+        had_image = self.image_path or self.image_data or self.has_stored_image
         
         self.image_path = None
         self.image_data = None
+        self.thumbnails = None
+        self.has_stored_image = False
         
         # Emit signal if previously had an image
-        if old_path or old_data:
-            self.image_selected.emit("", "")
+        if had_image:
+            self.image_selected.emit("", b"")
     
-    def set_image_data(self, image_data, image_path=None):
+    def set_product_image(self, key_number, has_image, image_path=None):
         """
-        Set the image from existing data
+        Show the stored image of a product
         
         Args:
-            image_data (str): Base64 encoded image data
+            key_number (int): The key number of the product
+            has_image (bool): Whether the product has a stored image
             image_path (str): Path to the image file
         """
-        self.image_data = image_data
+        self.image_data = None
+        self.thumbnails = None
         self.image_path = image_path
+        self.has_stored_image = bool(has_image)
         
-        if image_data:
-            try:
-                # Decode from base64 to binary
-                binary_data = base64.b64decode(image_data)
-                image = QImage()
-                image.loadFromData(binary_data)
-                pixmap = QPixmap.fromImage(image)
-                
-                if not pixmap.isNull():
-                    # Resize pixmap to fit label while maintaining aspect ratio
-                    pixmap = pixmap.scaled(
-                        self.image_label.width(), 
-                        200, 
-                        Qt.KeepAspectRatio, 
-                        Qt.SmoothTransformation
-                    )
-                    self.image_label.setPixmap(pixmap)
-                    return
-            except Exception as e:
-                print(f"Error loading image from data: {e}")
+        if has_image:
+            self.image_label.clear()
+            self.image_label.setText("Loading image...")
+            pixmap_cache.get(
+                key_number, "detail",
+                lambda pixmap: self.show_stored_image(pixmap, image_path),
+                tag=(id(self), "image")
+            )
+            return
+        
+        pixmap_cache.cancel((id(self), "image"))
+        self.show_stored_image(None, image_path)
+    
+    def show_stored_image(self, pixmap, image_path):
+        """Show a loaded thumbnail, falling back to the image path"""
+        if pixmap is not None:
+            self.image_label.setPixmap(pixmap)
+            return
         
         # Try loading from path if data loading failed
         if image_path and os.path.exists(image_path):
@@ -153,7 +160,10 @@ class ImageSelector(QWidget):
     
     def clear(self):
         """Clear all image data"""
+        pixmap_cache.cancel((id(self), "image"))
         self.image_label.clear()
         self.image_label.setText("No image selected")
         self.image_path = None
         self.image_data = None
+        self.thumbnails = None
+        self.has_stored_image = False
@@ -6,12 +6,69 @@ from PyQt5.QtCore import Qt, pyqtSlot
 from PyQt5.QtGui import QCursor
 
 import database
+import forecasting
+from forecasting import LEAD_TIME_DAYS
+from money import format_money
+from ui.db_worker import get_worker
 from ui.product_detail_widget import ProductDetailWidget
 
+# Search results listed at most, best matches first; the search runs on
+# every keystroke, so a short prefix must not list the whole catalog
+SEARCH_RESULTS = 200
+
+# Forecast shown for a product missing from the loaded forecasts
+NO_FORECAST = {"daily_demand": 0.0, "days_left": None, "reorder_point": 0, "reorder_qty": 0}
+
+def load_inventory(search_term, category_id, with_forecasts):
+    """
+    Fetch the categories and the filtered product list.
+    
+    Runs on the database worker thread.
+    
+    Args:
+        search_term (str): Text to search for, empty for every product
+        category_id (int): Category to show, None for all
+        with_forecasts (bool): Also fetch the forecasts of every product
+    
+    Returns:
+        tuple: (categories, products, forecasts), forecasts None unless requested
+    """
+    categories = database.get_all_categories()
+    
+    # Get products based on search and category filter
+    if search_term:
+        products = database.search_products(search_term, SEARCH_RESULTS, category_id)
+    elif category_id is not None:
+        products = database.get_products_by_category(category_id)
+    else:
+        products = database.get_all_products()
+    
+    forecasts = forecasting.forecast_all_products() if with_forecasts else None
+    return categories, products, forecasts
+
+class SortableItem(QTableWidgetItem):
+    """
+    Table item that sorts by a value instead of its text, so "$90.00" sorts
+    before "$100.00" and items without a value (None) sort last.
+    """
+    def __init__(self, text, sort_value):
+        super().__init__(text)
+        self.sort_value = sort_value
+    
+    def __lt__(self, other):
+        if not isinstance(other, SortableItem):
+            return super().__lt__(other)
+        if self.sort_value is None or other.sort_value is None:
+            return other.sort_value is None and self.sort_value is not None
+        return self.sort_value < other.sort_value
+
 class InventoryWidget(QWidget):
     """
     Widget for displaying and managing inventory.
     """
+    # Tables whose changes make the table out of date, sales for the forecast
+    DATA_TABLES = ("categories", "products", "product_images", "sales")
+    
     def __init__(self, is_admin=False):
         super().__init__()
         
@@ -21,6 +78,10 @@ class InventoryWidget(QWidget):
         # Current selected category
         self.current_category_id = None
         
+        # Forecasts of every product, kept while searching and filtering
+        self.forecasts = {}
+        self.forecasts_stale = True
+        
         # Create main layout
         self.layout = QVBoxLayout(self)
         
@@ -87,16 +148,26 @@ class InventoryWidget(QWidget):
         
         controls_layout.addLayout(category_layout, 1)  # 1/3 of the width for category filter
         
+        # Shown while the product list is being fetched
+        self.loading_label = QLabel("Loading...")
+        self.loading_label.setStyleSheet("color: gray;")
+        self.loading_label.hide()
+        controls_layout.addWidget(self.loading_label)
+        
         self.layout.addLayout(controls_layout)
     
     def create_inventory_table(self):
         """Create the inventory table"""
         self.inventory_table = QTableWidget()
-        self.inventory_table.setColumnCount(7)
+        self.inventory_table.setColumnCount(9)
         self.inventory_table.setHorizontalHeaderLabels([
             "Key Number", "Product Name", "Purchase Price", "Sale Price",
-            "Total Added", "Sold", "Remaining"
+            "Total Added", "Sold", "Remaining", "Days Left", "Reorder Qty"
         ])
+        self.inventory_table.horizontalHeaderItem(7).setToolTip("Days until stock-out at the recent sales rate")
+        self.inventory_table.horizontalHeaderItem(8).setToolTip(
+            f"Units to order now to cover the {LEAD_TIME_DAYS} day lead time and the following weeks"
+        )
         
         # Set table properties
         self.inventory_table.horizontalHeader().setSectionResizeMode(1, QHeaderView.Stretch)
@@ -105,6 +176,10 @@ class InventoryWidget(QWidget):
         self.inventory_table.setEditTriggers(QTableWidget.NoEditTriggers)
         self.inventory_table.setSelectionBehavior(QTableWidget.SelectRows)
         
+        # Sort by clicking a header, rows keep the query's order until then
+        self.inventory_table.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self.inventory_table.setSortingEnabled(True)
+        
         # Connect selection change
         self.inventory_table.itemSelectionChanged.connect(self.on_product_selected)
         
@@ -126,23 +201,49 @@ class InventoryWidget(QWidget):
         
         self.layout.addLayout(action_layout)
     
-    def refresh_inventory(self):
-        """Refresh the inventory table with current data"""
-        # Refresh category filter first
-        self.refresh_category_filter()
-        
+    def refresh_inventory(self, reload_forecasts=True):
+        """
+        Reload the inventory table in the background.
+        
+        Args:
+            reload_forecasts (bool): False to reuse the forecasts when only
+                the search or the category filter changed
+        """
         search_term = self.search_input.text().strip()
+        database.data_versions.mark_seen(self, self.DATA_TABLES)
+        
+        # Stays set until forecasts arrive, so a superseded reload is
+        # retried by the next refresh
+        if reload_forecasts:
+            self.forecasts_stale = True
+        
+        # A newer refresh, e.g. the next keystroke, supersedes a pending one
+        self.loading_label.show()
+        get_worker().submit(
+            load_inventory, search_term, self.current_category_id, self.forecasts_stale,
+            callback=self.show_inventory,
+            error_callback=lambda message: self.loading_label.hide(),
+            tag=(id(self), "inventory")
+        )
+    
+    def refresh_if_changed(self):
+        """Reload the inventory only if its tables changed since the last load"""
+        if database.data_versions.changed(self, self.DATA_TABLES):
+            self.refresh_inventory()
+    
+    def show_inventory(self, result):
+        """Fill the inventory table with the fetched data"""
+        categories, products, forecasts = result
+        self.loading_label.hide()
+        if forecasts is not None:
+            self.forecasts = forecasts
+            self.forecasts_stale = False
         
-        # Get products based on search and category filter
-        if search_term:
-            products = database.search_products(search_term)
-            # Further filter by category if one is selected
-            if self.current_category_id is not None:
-                products = [p for p in products if p["category_id"] == self.current_category_id]
-        elif self.current_category_id is not None:
-            products = database.get_products_by_category(self.current_category_id)
-        else:
-            products = database.get_all_products()
+        # Refresh category filter first
+        self.refresh_category_filter(categories)
+        
+        # Rows must not move while they are filled in, sort once at the end
+        self.inventory_table.setSortingEnabled(False)
         
         # Clear table
         self.inventory_table.setRowCount(0)
@@ -152,7 +253,7 @@ class InventoryWidget(QWidget):
             self.inventory_table.insertRow(row)
             
             # Key Number
-            key_item = QTableWidgetItem(str(product["key_number"]))
+            key_item = SortableItem(str(product["key_number"]), product["key_number"])
             # Store the key number as item data for easier retrieval
             key_item.setData(Qt.UserRole, product["key_number"])
             self.inventory_table.setItem(row, 0, key_item)
@@ -163,46 +264,66 @@ class InventoryWidget(QWidget):
             self.inventory_table.setItem(row, 1, name_item)
             
             # Purchase Price
-            purchase_price_item = QTableWidgetItem(f"${product['purchase_price']:.2f}")
+            purchase_price_item = SortableItem(format_money(product["purchase_price"]), product["purchase_price"])
             purchase_price_item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
             self.inventory_table.setItem(row, 2, purchase_price_item)
             
             # Sale Price
-            sale_price_item = QTableWidgetItem(f"${product['sale_price']:.2f}")
+            sale_price_item = SortableItem(format_money(product["sale_price"]), product["sale_price"])
             sale_price_item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
             # Color the sale price green
             sale_price_item.setForeground(Qt.darkGreen)
             self.inventory_table.setItem(row, 3, sale_price_item)
             
             # Total Added
-            total_added_item = QTableWidgetItem(str(product["total_added"]))
+            total_added_item = SortableItem(str(product["total_added"]), product["total_added"])
             total_added_item.setTextAlignment(Qt.AlignCenter)
             self.inventory_table.setItem(row, 4, total_added_item)
             
             # Sold
-            sold_item = QTableWidgetItem(str(product["sold"]))
+            sold_item = SortableItem(str(product["sold"]), product["sold"])
             sold_item.setTextAlignment(Qt.AlignCenter)
             self.inventory_table.setItem(row, 5, sold_item)
             
             # Remaining
             remaining = product["remaining"]
-            remaining_item = QTableWidgetItem(str(remaining))
+            remaining_item = SortableItem(str(remaining), remaining)
             remaining_item.setTextAlignment(Qt.AlignCenter)
             
-            # Color code the remaining based on stock level
+            # Color code the remaining: out of stock, or due for reordering
+            # Products added since the forecasts were loaded show as not selling
+            forecast = self.forecasts.get(product["key_number"], NO_FORECAST)
             if remaining <= 0:
                 remaining_item.setBackground(Qt.red)
                 remaining_item.setForeground(Qt.white)
-            elif remaining <= 5:
+            elif forecast["reorder_qty"] > 0:
                 remaining_item.setBackground(Qt.yellow)
             
             self.inventory_table.setItem(row, 6, remaining_item)
+            
+            # Days Left, empty for products that are not selling
+            days_left = forecast["days_left"]
+            days_left_item = SortableItem("-" if days_left is None else f"{days_left:.0f}", days_left)
+            days_left_item.setTextAlignment(Qt.AlignCenter)
+            days_left_item.setToolTip(f"Selling {forecast['daily_demand']:.2f} per day")
+            if days_left is not None and days_left <= LEAD_TIME_DAYS:
+                days_left_item.setForeground(Qt.red)
+            self.inventory_table.setItem(row, 7, days_left_item)
+            
+            # Reorder Qty
+            reorder_qty = forecast["reorder_qty"]
+            reorder_item = SortableItem(str(reorder_qty) if reorder_qty else "", reorder_qty)
+            reorder_item.setTextAlignment(Qt.AlignCenter)
+            reorder_item.setToolTip(f"Reorder when {forecast['reorder_point']} are left")
+            self.inventory_table.setItem(row, 8, reorder_item)
+        
+        self.inventory_table.setSortingEnabled(True)
         
         # Reset the product detail view if no products or none selected
         if hasattr(self, 'product_detail') and (self.inventory_table.rowCount() == 0 or not self.inventory_table.selectedItems()):
             self.product_detail.clear()
     
-    def refresh_category_filter(self):
+    def refresh_category_filter(self, categories):
         """Refresh the category filter dropdown"""
         # Remember current selection
         current_id = self.current_category_id
@@ -215,7 +336,6 @@ class InventoryWidget(QWidget):
         self.category_filter.addItem("All Categories", None)
         
         # Add each category
-        categories = database.get_all_categories()
         selected_index = 0
         
         for i, category in enumerate(categories):
@@ -230,18 +350,18 @@ class InventoryWidget(QWidget):
     @pyqtSlot(str)
     def on_search_changed(self, text):
         """Handle search input changes"""
-        self.refresh_inventory()
+        self.refresh_inventory(reload_forecasts=False)
     
     def on_category_filter_changed(self, index):
         """Handle category filter changes"""
         if index >= 0:
             self.current_category_id = self.category_filter.itemData(index)
-            self.refresh_inventory()
+            self.refresh_inventory(reload_forecasts=False)
     
     def clear_search(self):
         """Clear the search input and refresh"""
         self.search_input.clear()
-        self.refresh_inventory()
+        self.refresh_inventory(reload_forecasts=False)
     
     def on_product_selected(self):
         """Handle product selection in the table"""
@@ -6,6 +6,7 @@ from PyQt5.QtGui import QFont, QIcon
 from ui.admin_panel import AdminPanel
 from ui.customer_panel import CustomerPanel
 import database
+from money import format_money
 
 class MainWindow(QMainWindow):
     """
@@ -105,25 +106,27 @@ class MainWindow(QMainWindow):
     
     def update_profit_display(self):
         """Update the total profit display in the footer"""
+        database.data_versions.mark_seen(self, ("sales",))
         total_profit = database.get_total_profit()
-        self.profit_value.setText(f"${total_profit:.2f}")
+        self.profit_value.setText(format_money(total_profit))
     
     def on_tab_changed(self, index):
         """Handle tab change events to update panel info and refresh data"""
         if index == 0:  # Admin panel
             self.panel_label.setText("Admin Panel")
-            self.admin_panel.refresh_data()
+            self.admin_panel.refresh_if_changed()
         elif index == 1:  # Customer panel
             self.panel_label.setText("Customer Panel")
-            self.customer_panel.refresh_data()
+            self.customer_panel.refresh_if_changed()
         
-        self.update_profit_display()
+        if database.data_versions.changed(self, ("sales",)):
+            self.update_profit_display()
     
     def on_sale_completed(self):
         """Handle completed sale event"""
         self.status_label.setText("Sale completed successfully")
         self.update_profit_display()
         
-        # Refresh data in both panels
-        self.admin_panel.refresh_data()
-        self.customer_panel.refresh_data()
+        # Refresh whatever the sale changed in both panels
+        self.admin_panel.refresh_if_changed()
+        self.customer_panel.refresh_if_changed()
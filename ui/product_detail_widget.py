@@ -2,11 +2,12 @@ from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel,
                             QPushButton, QFormLayout, QLineEdit, QComboBox,
                             QDoubleSpinBox, QGroupBox, QMessageBox, QFileDialog)
 from PyQt5.QtCore import Qt, pyqtSignal
-from PyQt5.QtGui import QPixmap, QImage
-import base64
+from PyQt5.QtGui import QPixmap
 import os
 
 import database
+from money import to_cents, from_cents, format_money
+from ui.image_cache import pixmap_cache
 from ui.image_selector import ImageSelector
 
 class ProductDetailWidget(QWidget):
@@ -166,7 +167,7 @@ class ProductDetailWidget(QWidget):
             # Update customer view
             self.product_name_label.setText(product["name"])
             self.category_label.setText(product["category_name"])
-            self.price_label.setText(f"${product['sale_price']:.2f}")
+            self.price_label.setText(format_money(product["sale_price"]))
             
             # Set availability text and style
             remaining = product["remaining"]
@@ -193,8 +194,8 @@ class ProductDetailWidget(QWidget):
                 self.category_combo.setCurrentIndex(index)
             
             # Set prices
-            self.purchase_price_input.setValue(product["purchase_price"])
-            self.sale_price_input.setValue(product["sale_price"])
+            self.purchase_price_input.setValue(from_cents(product["purchase_price"]))
+            self.sale_price_input.setValue(from_cents(product["sale_price"]))
             
             # Update profit margin
             self.update_profit_margin()
@@ -206,7 +207,9 @@ class ProductDetailWidget(QWidget):
             self.inventory_label.setText(f"Total: {total}, Sold: {sold}, Remaining: {remaining}")
             
             # Display image if available
-            self.image_selector.set_image_data(product.get("image_data"), product.get("image_path"))
+            self.image_selector.set_product_image(
+                product["key_number"], product.get("has_image"), product.get("image_path")
+            )
     
     def clear(self):
         """Clear the product display"""
@@ -218,6 +221,7 @@ class ProductDetailWidget(QWidget):
             self.category_label.setText("")
             self.price_label.setText("")
             self.availability_label.setText("")
+            pixmap_cache.cancel((id(self), "image"))
             self.image_label.clear()
             self.image_label.setText("No product selected")
         else:
@@ -235,30 +239,27 @@ class ProductDetailWidget(QWidget):
         if not self.for_customer or not hasattr(self, 'image_label'):
             return
         
-        # Try to load image from image_data first
-        image_data = product.get("image_data")
-        if image_data:
-            try:
-                # Decode from base64 to binary
-                binary_data = base64.b64decode(image_data)
-                image = QImage()
-                image.loadFromData(binary_data)
-                pixmap = QPixmap.fromImage(image)
-                
-                if not pixmap.isNull():
-                    # Resize pixmap to fit label while maintaining aspect ratio
-                    pixmap = pixmap.scaled(
-                        self.image_label.width(), 
-                        200, 
-                        Qt.KeepAspectRatio, 
-                        Qt.SmoothTransformation
-                    )
-                    self.image_label.setPixmap(pixmap)
-                    return
-            except Exception as e:
-                print(f"Error loading image from data: {e}")
+        # Use the cached detail thumbnail of the stored image first
+        if product.get("has_image"):
+            self.image_label.clear()
+            self.image_label.setText("Loading image...")
+            pixmap_cache.get(
+                product["key_number"], "detail",
+                lambda pixmap: self.show_product_image(product, pixmap),
+                tag=(id(self), "image")
+            )
+            return
         
-        # If no image_data or loading failed, try image_path
+        pixmap_cache.cancel((id(self), "image"))
+        self.show_product_image(product, None)
+    
+    def show_product_image(self, product, pixmap):
+        """Show a loaded thumbnail in customer view, falling back to the image path"""
+        if pixmap is not None:
+            self.image_label.setPixmap(pixmap)
+            return
+        
+        # If no stored image or loading failed, try image_path
         image_path = product.get("image_path")
         if image_path and os.path.exists(image_path):
             try:
@@ -284,14 +285,14 @@ class ProductDetailWidget(QWidget):
         if self.for_customer or not hasattr(self, 'profit_margin_label'):
             return
             
-        purchase_price = self.purchase_price_input.value()
-        sale_price = self.sale_price_input.value()
+        purchase_price = to_cents(self.purchase_price_input.value())
+        sale_price = to_cents(self.sale_price_input.value())
         
         if purchase_price > 0:
             profit = sale_price - purchase_price
             margin_percent = (profit / purchase_price) * 100
             
-            self.profit_margin_label.setText(f"${profit:.2f} ({margin_percent:.1f}%)")
+            self.profit_margin_label.setText(f"{format_money(profit)} ({margin_percent:.1f}%)")
             
             # Color code based on margin
             if margin_percent < 10:
@@ -311,9 +312,14 @@ class ProductDetailWidget(QWidget):
             
         # Update image in database
         key_number = self.current_product["key_number"]
-        success = database.update_product_image(key_number, image_path, image_data)
+        success = database.update_product_image(
+            key_number, image_path, image_data, self.image_selector.thumbnails
+        )
         
         if success:
+            # Cached thumbnails show the previous image
+            pixmap_cache.invalidate(key_number)
+            
             # Emit signal that image was updated
             self.on_image_updated.emit()
             QMessageBox.information(self, "Success", "Product image updated successfully")
@@ -328,8 +334,8 @@ class ProductDetailWidget(QWidget):
         key_number = int(self.key_number_input.text())
         name = self.name_input.text().strip()
         category_id = self.category_combo.currentData()
-        purchase_price = self.purchase_price_input.value()
-        sale_price = self.sale_price_input.value()
+        purchase_price = to_cents(self.purchase_price_input.value())
+        sale_price = to_cents(self.sale_price_input.value())
         
         # Validate
         if not name:
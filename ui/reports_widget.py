@@ -0,0 +1,281 @@
+from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QGridLayout, QTableWidget,
+                            QTableWidgetItem, QLabel, QPushButton, QHeaderView,
+                            QComboBox, QGroupBox)
+from PyQt5.QtCore import Qt, QDate
+from PyQt5.QtGui import QFont
+
+import analytics
+import database
+from money import format_money
+from ui.db_worker import get_worker
+
+# Number of products in each top-sellers table
+TOP_PRODUCTS = 10
+
+# Number of customers in the top customers table
+TOP_CUSTOMERS = 10
+
+def load_reports(start, end, limit=TOP_PRODUCTS):
+    """
+    Run every report for a date range.
+
+    Runs on the database worker thread.
+
+    Returns:
+        dict: Results keyed by report name
+    """
+    return {
+        "comparison": database.compare_periods(start, end),
+        "top_products": database.get_top_products(start, end, limit),
+        "categories": database.get_category_margins(start, end),
+        "hours": database.get_sales_by_hour(start, end),
+        "customers": analytics.get_top_customers(start, end, TOP_CUSTOMERS),
+    }
+
+class ReportsWidget(QWidget):
+    """
+    Widget showing sales reports for a selectable period: this period against
+    the previous one, top sellers, category margins, sales by hour and top
+    customers.
+    """
+    # Tables whose changes make the reports out of date
+    DATA_TABLES = ("categories", "products", "customers", "sales")
+
+    # Selectable periods (label, key)
+    PERIODS = [
+        ("Today", "today"),
+        ("Last 7 Days", "week"),
+        ("Last 30 Days", "30days"),
+        ("This Month", "month"),
+        ("This Year", "year"),
+    ]
+
+    def __init__(self):
+        super().__init__()
+
+        # Set up layout
+        self.layout = QVBoxLayout(self)
+
+        # Create period selection
+        self.create_period_section()
+
+        # Create comparison section
+        self.create_comparison_section()
+
+        # Create report tables
+        self.create_report_tables()
+
+        # Initialize data
+        self.refresh_reports()
+
+    def create_period_section(self):
+        """Create the period selector and refresh button"""
+        period_layout = QHBoxLayout()
+
+        period_label = QLabel("Period:")
+        self.period_combo = QComboBox()
+        for label, key in self.PERIODS:
+            self.period_combo.addItem(label, key)
+        self.period_combo.setCurrentIndex(2)
+        self.period_combo.currentIndexChanged.connect(self.refresh_reports)
+
+        self.range_label = QLabel()
+        self.range_label.setStyleSheet("color: gray;")
+
+        # Shown while the reports are being computed
+        self.loading_label = QLabel("Loading...")
+        self.loading_label.setStyleSheet("color: gray;")
+        self.loading_label.hide()
+
+        refresh_button = QPushButton("Refresh")
+        refresh_button.setIcon(self.style().standardIcon(self.style().SP_BrowserReload))
+        refresh_button.clicked.connect(self.refresh_reports)
+
+        period_layout.addWidget(period_label)
+        period_layout.addWidget(self.period_combo)
+        period_layout.addWidget(self.range_label)
+        period_layout.addStretch()
+        period_layout.addWidget(self.loading_label)
+        period_layout.addWidget(refresh_button)
+
+        self.layout.addLayout(period_layout)
+
+    def create_comparison_section(self):
+        """Create the summary comparing the period with the previous one"""
+        comparison_group = QGroupBox("This Period vs Previous Period")
+        comparison_layout = QGridLayout(comparison_group)
+
+        self.comparison_labels = {}
+        for column, (field, title) in enumerate([("revenue", "Revenue"), ("profit", "Profit"),
+                                                 ("count", "Sales"), ("quantity", "Units Sold")]):
+            title_label = QLabel(title)
+            title_label.setFont(QFont("Arial", 10, QFont.Bold))
+
+            value_label = QLabel("-")
+            value_label.setFont(QFont("Arial", 12, QFont.Bold))
+
+            change_label = QLabel("")
+
+            comparison_layout.addWidget(title_label, 0, column)
+            comparison_layout.addWidget(value_label, 1, column)
+            comparison_layout.addWidget(change_label, 2, column)
+            self.comparison_labels[field] = (value_label, change_label)
+
+        self.layout.addWidget(comparison_group)
+
+    def create_table(self, title, headers, stretch_column=None):
+        """Create a read-only report table inside a group box"""
+        group = QGroupBox(title)
+        group_layout = QVBoxLayout(group)
+
+        table = QTableWidget()
+        table.setColumnCount(len(headers))
+        table.setHorizontalHeaderLabels(headers)
+        table.setFont(QFont("Arial", 8))
+        table.verticalHeader().setVisible(False)
+        table.setAlternatingRowColors(True)
+        table.setEditTriggers(QTableWidget.NoEditTriggers)
+        table.setSelectionBehavior(QTableWidget.SelectRows)
+        if stretch_column is not None:
+            table.horizontalHeader().setSectionResizeMode(stretch_column, QHeaderView.Stretch)
+
+        group_layout.addWidget(table)
+        return group, table
+
+    def create_report_tables(self):
+        """Create the top sellers, category, hour of day and top customer tables"""
+        grid = QGridLayout()
+
+        revenue_group, self.top_revenue_table = self.create_table(
+            "Top Products by Revenue", ["#", "Product", "Category", "Units", "Revenue", "Share"], 1
+        )
+        profit_group, self.top_profit_table = self.create_table(
+            "Top Products by Profit", ["#", "Product", "Category", "Units", "Profit", "Margin"], 1
+        )
+        category_group, self.category_table = self.create_table(
+            "Margin by Category", ["Category", "Sales", "Revenue", "Profit", "Margin", "Share"], 0
+        )
+        hour_group, self.hour_table = self.create_table(
+            "Sales by Hour of Day", ["Hour", "Sales", "Units", "Revenue", "Share"]
+        )
+        customer_group, self.customer_table = self.create_table(
+            "Top Customers by Revenue", ["#", "Customer", "Sales", "Units", "Revenue", "Profit", "Share"], 1
+        )
+
+        grid.addWidget(revenue_group, 0, 0)
+        grid.addWidget(profit_group, 0, 1)
+        grid.addWidget(category_group, 1, 0)
+        grid.addWidget(hour_group, 1, 1)
+        grid.addWidget(customer_group, 2, 0, 1, 2)
+
+        self.layout.addLayout(grid)
+
+    def get_period_range(self):
+        """
+        Get the selected period.
+
+        Returns:
+            tuple: First and last day as "YYYY-MM-DD"
+        """
+        today = QDate.currentDate()
+        period = self.period_combo.currentData()
+
+        if period == "today":
+            start = today
+        elif period == "week":
+            start = today.addDays(-6)
+        elif period == "30days":
+            start = today.addDays(-29)
+        elif period == "month":
+            start = QDate(today.year(), today.month(), 1)
+        else:
+            start = QDate(today.year(), 1, 1)
+
+        return start.toString("yyyy-MM-dd"), today.toString("yyyy-MM-dd")
+
+    def refresh_reports(self):
+        """Recompute the reports in the background"""
+        database.data_versions.mark_seen(self, self.DATA_TABLES)
+
+        start, end = self.get_period_range()
+        self.range_label.setText(f"{start} to {end}")
+        self.loading_label.show()
+        get_worker().submit(
+            load_reports, start, end,
+            callback=self.show_reports,
+            error_callback=lambda message: self.loading_label.hide(),
+            tag=(id(self), "reports")
+        )
+
+    def refresh_if_changed(self):
+        """Recompute the reports only if their tables changed since the last load"""
+        if database.data_versions.changed(self, self.DATA_TABLES):
+            self.refresh_reports()
+
+    def show_reports(self, reports):
+        """Fill the comparison and the tables with the computed reports"""
+        self.loading_label.hide()
+        self.show_comparison(reports["comparison"])
+
+        top_products = reports["top_products"]
+        self.fill_table(self.top_revenue_table, [
+            [str(product["rank"]), product["name"], product["category_name"], str(product["quantity"]),
+             format_money(product["revenue"]), f"{product['share']:.1f}%"]
+            for product in top_products["by_revenue"]
+        ])
+        self.fill_table(self.top_profit_table, [
+            [str(product["rank"]), product["name"], product["category_name"], str(product["quantity"]),
+             format_money(product["profit"]), f"{product['margin']:.1f}%"]
+            for product in top_products["by_profit"]
+        ])
+
+        self.fill_table(self.category_table, [
+            [category["category_name"], str(category["count"]), format_money(category["revenue"]),
+             format_money(category["profit"]), f"{category['margin']:.1f}%", f"{category['revenue_share']:.1f}%"]
+            for category in reports["categories"]
+        ])
+
+        # Only the hours the shop actually sold in
+        self.fill_table(self.hour_table, [
+            [f"{hour['hour']:02d}:00", str(hour["count"]), str(hour["quantity"]),
+             format_money(hour["revenue"]), f"{hour['revenue_share']:.1f}%"]
+            for hour in reports["hours"] if hour["count"]
+        ])
+
+        self.fill_table(self.customer_table, [
+            [str(customer["rank"]), customer["name"], str(customer["count"]), str(customer["quantity"]),
+             format_money(customer["revenue"]), format_money(customer["profit"]), f"{customer['share']:.1f}%"]
+            for customer in reports["customers"]
+        ])
+
+    def show_comparison(self, comparison):
+        """Show the current totals and their change against the previous period"""
+        current = comparison["current"]
+        previous = comparison["previous"]
+
+        for field, (value_label, change_label) in self.comparison_labels.items():
+            if field in ("revenue", "profit"):
+                value_label.setText(format_money(current[field]))
+                previous_text = format_money(previous[field])
+            else:
+                value_label.setText(str(current[field]))
+                previous_text = str(previous[field])
+
+            change = comparison["change"][field]
+            if change is None:
+                change_label.setText(f"Previous: {previous_text}")
+                change_label.setStyleSheet("color: gray;")
+            else:
+                change_label.setText(f"{change:+.1f}% (previous: {previous_text})")
+                change_label.setStyleSheet("color: green;" if change >= 0 else "color: red;")
+
+    def fill_table(self, table, rows):
+        """Replace the contents of a report table, numbers aligned right"""
+        table.setRowCount(len(rows))
+        for row, values in enumerate(rows):
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(value)
+                if value[:1].isdigit() or value[:1] in "$-":
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                table.setItem(row, column, item)
+        table.resizeColumnsToContents()
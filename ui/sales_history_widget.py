@@ -6,12 +6,37 @@ from PyQt5.QtCore import Qt, QDate
 from PyQt5.QtGui import QFont, QCursor
 
 import database
-from datetime import datetime, timedelta
+import db_service
+from money import format_money
+from ui.db_worker import get_worker
+
+# Item data role marking a table row as an archived sale
+ARCHIVED_ROLE = Qt.UserRole + 1
+
+ARCHIVED_TOOLTIP = ("This sale is in a yearly sales archive. Archived sales are read-only "
+                    "and can't be deleted, only cleared with the whole sales history.")
+
+def load_sales_history(filters):
+    """
+    Fetch the categories and the first page of sales.
+    
+    Runs on the database worker thread.
+    
+    Returns:
+        tuple: (categories, query_sales result)
+    """
+    return database.get_all_categories(), database.query_sales(**filters)
 
 class SalesHistoryWidget(QWidget):
     """
     Widget for displaying sales history and profit information.
     """
+    # Number of sales loaded per page
+    PAGE_SIZE = 500
+    
+    # Tables whose changes make the history out of date
+    DATA_TABLES = ("categories", "products", "sales")
+    
     def __init__(self, is_admin=False):
         super().__init__()
         
@@ -25,6 +50,9 @@ class SalesHistoryWidget(QWidget):
         self.start_date = None
         self.end_date = None
         
+        # Cursor of the next page of sales, None when everything is loaded
+        self.next_cursor = None
+        
         # Set up layout
         self.layout = QVBoxLayout(self)
         
@@ -137,11 +165,11 @@ class SalesHistoryWidget(QWidget):
         refresh_button.setIcon(self.style().standardIcon(self.style().SP_BrowserReload))
         refresh_button.clicked.connect(self.refresh_sales_history)
         
-        # Clear history button (admin only)
+        # Clear history button (admin only, on the machine holding the database)
         self.clear_button = QPushButton("Clear History")
         self.clear_button.setIcon(self.style().standardIcon(self.style().SP_TrashIcon))
         self.clear_button.clicked.connect(self.clear_sales_history)
-        self.clear_button.setVisible(self.is_admin)
+        self.clear_button.setVisible(self.is_admin and db_service.get_client() is None)
         
         # Add to layout
         summary_layout.addWidget(sales_count_label)
@@ -194,20 +222,32 @@ class SalesHistoryWidget(QWidget):
         
         table_layout.addWidget(self.sales_table)
         
-        # Create action button section (for admin only)
+        # Action buttons: delete (admin only) and load the next page
+        action_layout = QHBoxLayout()
         if self.is_admin:
-            action_layout = QHBoxLayout()
-            delete_btn = QPushButton("Delete Selected Sale")
-            delete_btn.setIcon(self.style().standardIcon(self.style().SP_TrashIcon))
-            delete_btn.clicked.connect(self.delete_selected_sale)
-            action_layout.addWidget(delete_btn)
-            action_layout.addStretch()
-            
-            table_layout.addLayout(action_layout)
+            self.delete_btn = QPushButton("Delete Selected Sale")
+            self.delete_btn.setIcon(self.style().standardIcon(self.style().SP_TrashIcon))
+            self.delete_btn.clicked.connect(self.delete_selected_sale)
+            action_layout.addWidget(self.delete_btn)
+            self.sales_table.itemSelectionChanged.connect(self.update_delete_button)
+        action_layout.addStretch()
+        
+        # Shown while a page of sales is being fetched
+        self.loading_label = QLabel("Loading...")
+        self.loading_label.setStyleSheet("color: gray;")
+        self.loading_label.hide()
+        action_layout.addWidget(self.loading_label)
+        
+        self.load_more_btn = QPushButton("Load More")
+        self.load_more_btn.clicked.connect(self.load_more_sales)
+        self.load_more_btn.setEnabled(False)
+        action_layout.addWidget(self.load_more_btn)
+        
+        table_layout.addLayout(action_layout)
         
         self.layout.addWidget(table_group)
     
-    def refresh_categories(self):
+    def refresh_categories(self, categories):
         """Refresh the category filter dropdown"""
         # Remember current selection
         current_id = self.current_category_id
@@ -220,7 +260,6 @@ class SalesHistoryWidget(QWidget):
         self.category_filter.addItem("All Categories", None)
         
         # Add each category
-        categories = database.get_all_categories()
         selected_index = 0
         
         for i, category in enumerate(categories):
@@ -233,23 +272,50 @@ class SalesHistoryWidget(QWidget):
         self.category_filter.blockSignals(False)
     
     def refresh_sales_history(self):
-        """Refresh the sales history table with current data"""
+        """Reload the sales history in the background"""
+        database.data_versions.mark_seen(self, self.DATA_TABLES)
+        
+        # A newer refresh supersedes a pending refresh or page load
+        self.set_loading(True)
+        get_worker().submit(
+            load_sales_history, self.get_sales_filters(),
+            callback=self.show_sales_history,
+            error_callback=lambda message: self.set_loading(False),
+            tag=(id(self), "sales")
+        )
+    
+    def refresh_if_changed(self):
+        """Reload the sales history only if its tables changed since the last load"""
+        if database.data_versions.changed(self, self.DATA_TABLES):
+            self.refresh_sales_history()
+    
+    def set_loading(self, loading):
+        """Show or hide the loading state while a request is pending"""
+        self.loading_label.setVisible(loading)
+        if loading:
+            self.load_more_btn.setEnabled(False)
+        else:
+            self.load_more_btn.setEnabled(self.next_cursor is not None)
+    
+    def show_sales_history(self, result):
+        """Fill the summary and the table with the fetched first page"""
+        categories, result = result
+        
         # Refresh categories first
-        self.refresh_categories()
+        self.refresh_categories(categories)
         
-        # Get sales history with filters applied
-        sales = self.get_filtered_sales()
+        totals = result["totals"]
         
         # Update sales count
-        self.sales_count.setText(str(len(sales)))
+        self.sales_count.setText(str(totals["count"]))
         
-        # Calculate totals for filtered sales
-        total_revenue = sum(sale["sale_price"] * sale["quantity"] for sale in sales)
-        total_profit = sum(sale["profit"] for sale in sales)
+        # Totals are computed by the database over every matching sale
+        total_revenue = totals["revenue"]
+        total_profit = totals["profit"]
         
         # Update total displays
-        self.total_revenue.setText(f"${total_revenue:.2f}")
-        self.total_profit.setText(f"${total_profit:.2f}")
+        self.total_revenue.setText(format_money(total_revenue))
+        self.total_profit.setText(format_money(total_profit))
         
         # Calculate and update profit margin
         if total_revenue > 0:
@@ -261,29 +327,51 @@ class SalesHistoryWidget(QWidget):
         # Clear table
         self.sales_table.setRowCount(0)
         
-        # Populate table with sales
-        for row, sale in enumerate(sales):
+        # Populate table with sales (already sorted newest first)
+        self.add_sales_rows(result["sales"])
+        self.set_next_cursor(result["next_cursor"])
+    
+    def load_more_sales(self):
+        """Append the next page of sales to the table"""
+        if self.next_cursor is None:
+            return
+        
+        self.set_loading(True)
+        get_worker().submit(
+            database.query_sales, **self.get_sales_filters(self.next_cursor),
+            callback=self.show_more_sales,
+            error_callback=lambda message: self.set_loading(False),
+            tag=(id(self), "sales")
+        )
+    
+    def show_more_sales(self, result):
+        """Append a fetched page of sales to the table"""
+        self.add_sales_rows(result["sales"])
+        self.set_next_cursor(result["next_cursor"])
+    
+    def set_next_cursor(self, cursor):
+        """Remember where the next page starts and end the loading state"""
+        self.next_cursor = cursor
+        self.set_loading(False)
+    
+    def add_sales_rows(self, sales):
+        """Append sales records to the table"""
+        for sale in sales:
+            row = self.sales_table.rowCount()
             self.sales_table.insertRow(row)
             
-            # Format date and time
-            try:
-                sale_datetime = datetime.strptime(sale["sale_date"], "%Y-%m-%d %H:%M:%S")
-                date_str = sale_datetime.strftime("%Y-%m-%d")
-                time_str = sale_datetime.strftime("%H:%M:%S")
-            except ValueError:
-                date_str = "Unknown"
-                time_str = "Unknown"
-            
-            # Date
-            self.sales_table.setItem(row, 0, QTableWidgetItem(date_str))
-            
-            # Time
-            self.sales_table.setItem(row, 1, QTableWidgetItem(time_str))
+            # Date and time come pre-split from the database
+            self.sales_table.setItem(row, 0, QTableWidgetItem(sale["sale_day"]))
+            self.sales_table.setItem(row, 1, QTableWidgetItem(sale["sale_time"]))
             
             # Key Number
             key_item = QTableWidgetItem(str(sale["key_number"]))
             # Store the sale ID for easier retrieval
             key_item.setData(Qt.UserRole, sale["id"])
+            # Archived sales are read-only
+            key_item.setData(ARCHIVED_ROLE, bool(sale["archived"]))
+            if sale["archived"]:
+                key_item.setToolTip(ARCHIVED_TOOLTIP)
             self.sales_table.setItem(row, 2, key_item)
             
             # Product Name
@@ -298,12 +386,12 @@ class SalesHistoryWidget(QWidget):
             self.sales_table.setItem(row, 5, quantity_item)
             
             # Sale Price
-            price_item = QTableWidgetItem(f"${sale['sale_price']:.2f}")
+            price_item = QTableWidgetItem(format_money(sale["sale_price"]))
             price_item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
             self.sales_table.setItem(row, 6, price_item)
             
             # Profit
-            profit_item = QTableWidgetItem(f"${sale['profit']:.2f}")
+            profit_item = QTableWidgetItem(format_money(sale["profit"]))
             profit_item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
             
             # Color code the profit
@@ -313,34 +401,22 @@ class SalesHistoryWidget(QWidget):
                 profit_item.setForeground(Qt.red)
             
             self.sales_table.setItem(row, 7, profit_item)
-        
-        # Sort by date (newest first)
-        self.sales_table.sortItems(0, Qt.DescendingOrder)
     
-    def get_filtered_sales(self):
-        """Get sales history with filters applied"""
-        # Apply category filter
-        if self.current_category_id is not None:
-            sales = database.get_sales_by_category(self.current_category_id)
-        else:
-            sales = database.get_sales_history()
-        
-        # Apply date filter if set
+    def get_sales_filters(self, after_cursor=None):
+        """Build the query_sales arguments for one page with the current filters"""
+        start_str = None
+        end_str = None
         if self.start_date and self.end_date:
-            # Convert QDate to string format for comparison
             start_str = self.start_date.toString("yyyy-MM-dd")
-            
-            # Add one day to end date to include the end date in the range
-            end_date_plus = self.end_date.addDays(1)
-            end_str = end_date_plus.toString("yyyy-MM-dd")
-            
-            # Filter sales by date
-            sales = [
-                sale for sale in sales 
-                if start_str <= sale["sale_date"].split()[0] < end_str
-            ]
-        
-        return sales
+            end_str = self.end_date.toString("yyyy-MM-dd")
+        
+        return {
+            "start": start_str,
+            "end": end_str,
+            "category_id": self.current_category_id,
+            "limit": self.PAGE_SIZE,
+            "after_cursor": after_cursor
+        }
     
     def on_filter_changed(self, *args):
         """Handle filter changes"""
@@ -403,6 +479,7 @@ class SalesHistoryWidget(QWidget):
         # Only show the menu if a row is selected
         if not self.sales_table.selectedItems():
             return
+        delete_action.setEnabled(not self.selected_sale_archived())
             
         # Show the context menu
         action = menu.exec_(self.sales_table.mapToGlobal(position))
@@ -411,6 +488,20 @@ class SalesHistoryWidget(QWidget):
         if action == delete_action:
             self.delete_selected_sale()
     
+    def selected_sale_archived(self):
+        """Whether the selected row is a sale read from an archive"""
+        selected_items = self.sales_table.selectedItems()
+        if not selected_items:
+            return False
+        key_item = self.sales_table.item(selected_items[0].row(), 2)
+        return bool(key_item and key_item.data(ARCHIVED_ROLE))
+    
+    def update_delete_button(self):
+        """Disable deleting while an archived sale is selected"""
+        archived = self.selected_sale_archived()
+        self.delete_btn.setEnabled(not archived)
+        self.delete_btn.setToolTip(ARCHIVED_TOOLTIP if archived else "")
+    
     def delete_selected_sale(self):
         """Delete the selected sale"""
         if not self.is_admin:
@@ -430,6 +521,10 @@ class SalesHistoryWidget(QWidget):
         sale_id = key_item.data(Qt.UserRole)
         product_name = self.sales_table.item(row, 3).text()
         
+        if key_item.data(ARCHIVED_ROLE):
+            QMessageBox.information(self, "Archived Sale", ARCHIVED_TOOLTIP)
+            return
+        
         # Confirm deletion
         reply = QMessageBox.question(
             self, 
@@ -457,7 +552,7 @@ class SalesHistoryWidget(QWidget):
             self, 
             "Confirm Clear History",
             "Are you sure you want to clear ALL sales history?\n\n"
-            "This will delete ALL sales records and reset inventory sold counts.\n"
+            "This will delete ALL sales records, archived years included, and reset inventory sold counts.\n"
             "This action cannot be undone.",
             QMessageBox.Yes | QMessageBox.No,
             QMessageBox.No